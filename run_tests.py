@@ -16,6 +16,7 @@ import test.output
 import test.runner
 import test.check_whitespace
 import test.unit.connection.authentication
+import test.unit.descriptor.cache
 import test.unit.descriptor.reader
 import test.unit.descriptor.server_descriptor
 import test.unit.descriptor.extrainfo_descriptor
@@ -26,8 +27,11 @@ import test.unit.response.protocolinfo
 import test.unit.util.conf
 import test.unit.util.connection
 import test.unit.util.enum
+import test.unit.util.proc
 import test.unit.util.system
 import test.unit.util.tor_tools
+import test.unit.exit_policy
+import test.unit.process
 import test.unit.version
 import test.integ.connection.authentication
 import test.integ.connection.connect
@@ -94,17 +98,21 @@ UNIT_TESTS = (
   test.unit.util.enum.TestEnum,
   test.unit.util.connection.TestConnection,
   test.unit.util.conf.TestConf,
+  test.unit.util.proc.TestProc,
   test.unit.util.system.TestSystem,
   test.unit.util.tor_tools.TestTorTools,
+  test.unit.descriptor.cache.TestDescriptorCache,
   test.unit.descriptor.reader.TestDescriptorReader,
   test.unit.descriptor.server_descriptor.TestServerDescriptor,
   test.unit.descriptor.extrainfo_descriptor.TestExtraInfoDescriptor,
+  test.unit.exit_policy.TestExitPolicy,
   test.unit.version.TestVersion,
   test.unit.response.control_message.TestControlMessage,
   test.unit.response.control_line.TestControlLine,
   test.unit.response.getinfo.TestGetInfoResponse,
   test.unit.response.protocolinfo.TestProtocolInfoResponse,
   test.unit.connection.authentication.TestAuthenticate,
+  test.unit.process.TestProcess,
 )
 
 INTEG_TESTS = (
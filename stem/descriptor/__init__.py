@@ -5,6 +5,11 @@ Package for parsing and processing descriptor data.
 
 ::
 
+  ValidationLevel - checks performed when parsing descriptors
+    |- NONE - only extracts attributes, accepting malformed content
+    |- STRUCTURE - checks the required, single, first and last keywords
+    +- FULL - also checks the validity of every field
+  
   parse_file - Iterates over the descriptors in a file.
   Descriptor - Common parent for all descriptor file types.
     |- get_path - location of the descriptor on disk if it came from a file
@@ -12,29 +17,51 @@ Package for parsing and processing descriptor data.
     +- __str__ - string that the descriptor was made from
 """
 
-__all__ = ["descriptor", "reader", "extrainfo_descriptor", "server_descriptor", "parse_file", "Descriptor"]
+__all__ = ["descriptor", "cache", "reader", "extrainfo_descriptor", "server_descriptor", "parse_file", "Descriptor", "ValidationLevel"]
 
 import os
 import re
+import mmap
+import datetime
+
+import stem.util.enum
 
 KEYWORD_CHAR    = "a-zA-Z0-9-"
 WHITESPACE      = " \t"
 KEYWORD_LINE    = re.compile("^([%s]+)[%s]*(.*)$" % (KEYWORD_CHAR, WHITESPACE))
 PGP_BLOCK_START = re.compile("^-----BEGIN ([%s%s]+)-----$" % (KEYWORD_CHAR, WHITESPACE))
 PGP_BLOCK_END   = "-----END %s-----"
+SHA1_HEX        = re.compile("^[0-9a-fA-F]{40}$")
+
+# Recently parsed timestamps. Descriptors often share these (for instance, the
+# end of their history intervals) so this is cleared when it gets too big
+# rather than tracking which entries are least recently used.
+
+TIMESTAMP_CACHE = {}
+TIMESTAMP_CACHE_SIZE = 1000
+
+# Checks that are performed when parsing descriptors. Checking fields (their
+# nicknames, addresses, fingerprints, etc) is the bulk of our parsing time so
+# content from a trusted source can skip those while still catching truncated
+# or mangled documents.
 
-def parse_file(path, descriptor_file):
+ValidationLevel = stem.util.enum.UppercaseEnum("NONE", "STRUCTURE", "FULL")
+
+def parse_file(path, descriptor_file, validate = True, content_filter = None):
   """
   Provides an iterator for the descriptors within a given file.
   
   :param str path: absolute path to the file's location on disk
   :param file descriptor_file: opened file with the descriptor contents
+  :param bool,ValidationLevel validate: checks performed on the descriptor content, True and False are aliases for FULL and NONE
+  :param functor content_filter: called with the content of each descriptor, descriptors are skipped without being parsed if this returns False
   
   :returns: iterator for :class:`stem.descriptor.Descriptor` instances in the file
   
   :raises:
     * TypeError if we can't match the contents of the file to a descriptor type
     * IOError if unable to read from the descriptor_file
+    * ValueError if the contents is malformed and we're validating
   """
   
   import stem.descriptor.server_descriptor
@@ -56,7 +83,7 @@ def parse_file(path, descriptor_file):
     file_parser = stem.descriptor.extrainfo_descriptor.parse_file
   
   if file_parser:
-    for desc in file_parser(descriptor_file):
+    for desc in file_parser(descriptor_file, validate, content_filter):
       desc._set_path(path)
       yield desc
     
@@ -64,16 +91,21 @@ def parse_file(path, descriptor_file):
   
   # Metrics descriptor handling. These contain a single descriptor per file.
   
-  first_line, desc = descriptor_file.readline().strip(), None
+  first_line, desc_class = descriptor_file.readline().strip(), None
   
   if first_line == "@type server-descriptor 1.0":
-    desc = stem.descriptor.server_descriptor.RelayDescriptor(descriptor_file.read())
+    desc_class = stem.descriptor.server_descriptor.RelayDescriptor
   elif first_line == "@type bridge-server-descriptor 1.0":
-    desc = stem.descriptor.server_descriptor.BridgeDescriptor(descriptor_file.read())
+    desc_class = stem.descriptor.server_descriptor.BridgeDescriptor
   elif first_line in ("@type extra-info 1.0", "@type bridge-extra-info 1.0"):
-    desc = stem.descriptor.extrainfo_descriptor.ExtraInfoDescriptor(descriptor_file.read())
+    desc_class = stem.descriptor.extrainfo_descriptor.ExtraInfoDescriptor
   
-  if desc:
+  if desc_class:
+    descriptor_text = descriptor_file.read()
+    
+    if content_filter and not content_filter(descriptor_text): return
+    
+    desc = desc_class(descriptor_text, validate)
     desc._set_path(path)
     yield desc
     return
@@ -117,6 +149,22 @@ class Descriptor:
   def __str__(self):
     return self._raw_contents
 
+def _get_validation_level(validate):
+  """
+  Normalizes a descriptor's validate argument to a ValidationLevel.
+  
+  :param bool,ValidationLevel validate: checks to be performed, True and False are aliases for FULL and NONE
+  
+  :returns: :data:`stem.descriptor.ValidationLevel` for the checks to be performed
+  
+  :raises: ValueError if this isn't a boolean or ValidationLevel
+  """
+  
+  if validate is True: return ValidationLevel.FULL
+  elif validate is False or validate is None: return ValidationLevel.NONE
+  elif validate in ValidationLevel: return validate
+  else: raise ValueError("'%s' isn't a recognized validation level" % validate)
+
 def _read_until_keyword(keyword, descriptor_file, inclusive = False):
   """
   Reads from the descriptor file until we get to the given keyword or reach the
@@ -149,6 +197,160 @@ def _read_until_keyword(keyword, descriptor_file, inclusive = False):
   
   return content
 
+def _parse_entries(descriptor, entries, validate, parsers):
+  """
+  Applies a series of 'keyword => (value, pgp block)' mappings to a descriptor
+  as attributes. Each keyword is handled by its entry in the parsers dict,
+  which is called with...
+  
+  ::
+  
+    parser(descriptor, keyword, values, line, validate)
+  
+  ... where the values are the (value, pgp block) tuples for the keyword and
+  the line is the original content of the first. Keywords without a parser
+  are added to the descriptor's unrecognized lines.
+  
+  :param stem.descriptor.Descriptor descriptor: descriptor to apply the entries to
+  :param dict entries: descriptor contents to be applied
+  :param bool validate: checks the validity of descriptor content if True
+  :param dict parsers: mapping of keywords to the functions that parse them
+  
+  :raises: ValueError if an error occures in validation
+  """
+  
+  for keyword, values in entries.items():
+    # most just work with the first (and only) value
+    value, block_contents = values[0]
+    
+    line = "%s %s" % (keyword, value) # original line
+    if block_contents: line += "\n%s" % block_contents
+    
+    parser = parsers.get(keyword)
+    
+    if parser:
+      parser(descriptor, keyword, values, line, validate)
+    else:
+      descriptor._unrecognized_lines.append(line)
+
+def _parse_timestamp(timestamp_str):
+  """
+  Parses a 'YYYY-MM-DD HH:MM:SS' timestamp. This is the only format used by
+  descriptors so rather than strptime (which is slow and locale dependent) we
+  read its fields from fixed positions, falling back to strptime if they're
+  not where we expect.
+  
+  :param str timestamp_str: timestamp to be parsed
+  
+  :returns: datetime for the timestamp
+  
+  :raises: ValueError if the timestamp is malformed
+  """
+  
+  timestamp = TIMESTAMP_CACHE.get(timestamp_str)
+  
+  if timestamp is None:
+    fields = (timestamp_str[0:4], timestamp_str[5:7], timestamp_str[8:10], timestamp_str[11:13], timestamp_str[14:16], timestamp_str[17:19])
+    separators = timestamp_str[4] + timestamp_str[7] + timestamp_str[10] + timestamp_str[13] + timestamp_str[16] if len(timestamp_str) == 19 else None
+    
+    if separators == "-- ::" and "".join(fields).isdigit():
+      timestamp = datetime.datetime(*map(int, fields))
+    else:
+      timestamp = datetime.datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
+    
+    if len(TIMESTAMP_CACHE) >= TIMESTAMP_CACHE_SIZE:
+      TIMESTAMP_CACHE.clear()
+    
+    TIMESTAMP_CACHE[timestamp_str] = timestamp
+  
+  return timestamp
+
+def _mmap_file(descriptor_file):
+  """
+  Provides a read-only memory map for the contents of a file. Mappings share
+  the page cache with other readers of the file (like tor itself) and can be
+  scanned or sliced without first reading the whole file into a string.
+  
+  :param file descriptor_file: file with the descriptor content
+  
+  :returns: mmap for the file's contents, None if it can't be memory mapped (for instance, if it's empty or not a regular file)
+  """
+  
+  try:
+    file_number = descriptor_file.fileno()
+    if not os.fstat(file_number).st_size: return None
+    return mmap.mmap(file_number, 0, access = mmap.ACCESS_READ)
+  except (AttributeError, IOError, OSError, ValueError, mmap.error):
+    return None
+
+def _find_keyword_line(content, keyword, start):
+  """
+  Provides the position of the first line at or after the start position that
+  begins with the given keyword.
+  
+  :param str,mmap content: content to be searched, start must be the beginning of a line
+  :param str keyword: keyword we want to find
+  :param int start: position to begin searching from
+  
+  :returns: int for the start of the matching line, -1 if there isn't one
+  """
+  
+  position, keyword_end = start, len(keyword)
+  
+  while True:
+    if content[position:position + keyword_end] == keyword and \
+      content[position + keyword_end:position + keyword_end + 1] in ("", " ", "\r", "\n"):
+      return position
+    
+    position = content.find("\n" + keyword, position)
+    if position == -1: return -1
+    position += 1 # skip the newline
+
+def _get_descriptor_ranges(content, start_keyword, end_keyword, offset = 0):
+  """
+  Scans content for descriptor boundaries, providing the offsets for each
+  descriptor without copying anything. This is intended for memory mapped
+  files, where slicing out a range is the first time we load its content.
+  
+  Descriptors begin with a line starting with the start_keyword, prior to which
+  are its annotations, and end with the pseudo-Open-PGP-style block following
+  the end_keyword. If the start_keyword is None then descriptors span from the
+  end of the previous one.
+  
+  This matches the ranges that successive :func:`_read_until_keyword` calls
+  would provide. Any annotations after the last descriptor are ignored.
+  
+  :param str,mmap content: content to be scanned
+  :param str start_keyword: keyword of the descriptor's first line
+  :param str end_keyword: keyword of the line prior to the descriptor's signature
+  :param int offset: position to start scanning from, this must be the start of a line
+  
+  :returns: iterator of ``(annotation_start, descriptor_start, descriptor_end)`` tuples
+  """
+  
+  content_size = len(content)
+  block_end_prefix = PGP_BLOCK_END.split(' ', 1)[0]
+  
+  while offset < content_size:
+    if start_keyword:
+      start = _find_keyword_line(content, start_keyword, offset)
+      if start == -1: break
+    else:
+      start = offset
+    
+    # we've found the end_keyword, now include the pgp style block
+    end = _find_keyword_line(content, end_keyword, start)
+    if end != -1: end = _find_keyword_line(content, block_end_prefix, end)
+    
+    if end == -1:
+      end = content_size
+    else:
+      end = content.find("\n", end) + 1
+      if end == 0: end = content_size
+    
+    yield (offset, start, end)
+    offset = end
+
 def _get_pseudo_pgp_block(remaining_contents):
   """
   Checks if given contents begins with a pseudo-Open-PGP-style block and, if
@@ -0,0 +1,185 @@
+"""
+Binary format for persisting parsed descriptors. Loading descriptors from a
+cache skips parsing their text, which is most of the cost of reading them.
+
+Caches are versioned by both their format and the version of stem that wrote
+them (descriptor attributes change between releases), and consist of
+length-prefixed records each holding a pickled descriptor. Only descriptor
+related classes can be loaded from a cache, so they can't be used to run
+arbitrary code.
+
+::
+
+  # writes the descriptors in an archive to a cache
+  with DescriptorReader("/tmp/server-descriptors-2012-03.tar.bz2") as reader:
+    with open("/tmp/server-descriptors-2012-03.cache", "w") as cache_file:
+      stem.descriptor.cache.dump(reader, cache_file)
+  
+  # then reads them back
+  with open("/tmp/server-descriptors-2012-03.cache") as cache_file:
+    for descriptor in stem.descriptor.cache.load(cache_file):
+      print descriptor
+
+The :class:`stem.descriptor.reader.DescriptorReader` can maintain caches next
+to the archives it reads for us via its use_cache argument.
+
+**Module Overview:**
+
+::
+
+  dump - Writes descriptors to a cache.
+  load - Iterates over the descriptors in a cache.
+  is_current - Checks if a cache is newer than the file it was made from.
+  serialize - Provides a cache record for a descriptor.
+  deserialize - Provides the descriptor from a cache record.
+"""
+
+import os
+import sys
+import struct
+import cPickle
+import cStringIO
+
+import stem
+
+MAGIC = "STEMDESC"
+FORMAT_VERSION = 1
+
+# magic, format version, and the version of stem that wrote the cache
+HEADER = struct.Struct("!8sH16s")
+RECORD_LENGTH = struct.Struct("!I")
+
+# Classes that can be loaded from a cache, as (module, name) tuples. Pickles
+# can otherwise construct arbitrary objects.
+
+SAFE_GLOBALS = frozenset([
+  ("__builtin__", "set"),
+  ("__builtin__", "frozenset"),
+  ("datetime", "datetime"),
+  ("array", "array"),
+  ("array", "_array_reconstructor"),
+  ("stem.version", "Version"),
+  ("stem.exit_policy", "ExitPolicy"),
+  ("stem.exit_policy", "ExitPolicyRule"),
+  ("stem.descriptor.server_descriptor", "RelayDescriptor"),
+  ("stem.descriptor.server_descriptor", "BridgeDescriptor"),
+  ("stem.descriptor.extrainfo_descriptor", "ExtraInfoDescriptor"),
+])
+
+def dump(descriptors, output_file):
+  """
+  Writes descriptors to a cache.
+  
+  :param list descriptors: descriptors to be written
+  :param file output_file: file to write the cache to
+  
+  :raises:
+    * IOError if unable to write to the file
+    * TypeError if a descriptor can't be serialized
+  """
+  
+  output_file.write(_get_header())
+  
+  for desc in descriptors:
+    output_file.write(serialize(desc))
+
+def load(input_file):
+  """
+  Iterates over the descriptors in a cache.
+  
+  :param file input_file: file with the cache's contents
+  
+  :returns: iterator for the :class:`stem.descriptor.Descriptor` instances in the cache
+  
+  :raises:
+    * ValueError if the cache is malformed or was written by a different version of stem
+    * IOError if unable to read from the file
+  """
+  
+  header = input_file.read(HEADER.size)
+  
+  if header != _get_header():
+    if len(header) == HEADER.size and header.startswith(MAGIC):
+      raise ValueError("Cache was made by a different version of stem")
+    else:
+      raise ValueError("Content isn't a descriptor cache")
+  
+  while True:
+    record_length = input_file.read(RECORD_LENGTH.size)
+    
+    if not record_length:
+      break # end of the cache
+    elif len(record_length) != RECORD_LENGTH.size:
+      raise ValueError("Cache is truncated")
+    
+    record_length = RECORD_LENGTH.unpack(record_length)[0]
+    record = input_file.read(record_length)
+    
+    if len(record) != record_length:
+      raise ValueError("Cache is truncated")
+    
+    yield deserialize(record)
+
+def is_current(cache_path, path):
+  """
+  Checks if a cache exists and is at least as new as the file it was made
+  from.
+  
+  :param str cache_path: location of the cache
+  :param str path: location of the file that the cache was made from
+  
+  :returns: True if the cache is current, False otherwise
+  """
+  
+  try:
+    return os.stat(cache_path).st_mtime >= os.stat(path).st_mtime
+  except OSError:
+    return False
+
+def serialize(descriptor):
+  """
+  Provides the length-prefixed cache record for a descriptor.
+  
+  :param stem.descriptor.Descriptor descriptor: descriptor to be serialized
+  
+  :returns: str with the cache record
+  
+  :raises: TypeError if the descriptor can't be serialized
+  """
+  
+  try:
+    record = cPickle.dumps(descriptor, cPickle.HIGHEST_PROTOCOL)
+  except cPickle.PicklingError, exc:
+    raise TypeError(exc)
+  
+  return RECORD_LENGTH.pack(len(record)) + record
+
+def deserialize(record):
+  """
+  Provides the descriptor from a cache record, without its length prefix.
+  
+  :param str record: serialized descriptor
+  
+  :returns: :class:`stem.descriptor.Descriptor` from the record
+  
+  :raises: ValueError if the record is malformed or has classes that aren't descriptor related
+  """
+  
+  unpickler = cPickle.Unpickler(cStringIO.StringIO(record))
+  unpickler.find_global = _find_global
+  
+  try:
+    return unpickler.load()
+  except (cPickle.UnpicklingError, EOFError, AttributeError, ImportError, IndexError, TypeError), exc:
+    raise ValueError("Malformed cache record: %s" % exc)
+
+def _get_header():
+  return HEADER.pack(MAGIC, FORMAT_VERSION, stem.__version__)
+
+def _find_global(module, name):
+  if not (module, name) in SAFE_GLOBALS:
+    raise cPickle.UnpicklingError("Caches can't include %s.%s" % (module, name))
+  
+  __import__(module)
+  return getattr(sys.modules[module], name)
+
@@ -41,16 +41,20 @@ Extra-info descriptors are available from a few sources...
     +- MD - median download rate in B/s
   
   parse_file - Iterates over the extra-info descriptors in a file.
+  get_history_matrix - Aligns the bandwidth histories of many descriptors.
   ExtraInfoDescriptor - Tor extra-info descriptor.
     +- get_unrecognized_lines - lines with unrecognized content
 """
 
 import re
+import array
+import calendar
 import datetime
 
 import stem.descriptor
 import stem.util.enum
 import stem.util.connection
+import stem.util.tor_tools
 
 # known statuses for dirreq-v2-resp and dirreq-v3-resp...
 DirResponses = stem.util.enum.Enum(
@@ -114,20 +118,90 @@ SINGLE_FIELDS = (
 FIRST_FIELD = "extra-info"
 LAST_FIELD = "router-signature"
 
-def parse_file(descriptor_file, validate = True):
+# Attribute prefixes for lines that share a format. For instance, the
+# 'read-history' line sets our read_history_end, read_history_interval, and
+# read_history_values attributes.
+
+KEYWORD_ATTRIBUTE = {
+  "dirreq-v2-resp": "dir_v2_responses",
+  "dirreq-v3-resp": "dir_v3_responses",
+  "dirreq-v2-direct-dl": "dir_v2_direct_dl",
+  "dirreq-v3-direct-dl": "dir_v3_direct_dl",
+  "dirreq-v2-tunneled-dl": "dir_v2_tunneled_dl",
+  "dirreq-v3-tunneled-dl": "dir_v3_tunneled_dl",
+  "dirreq-v2-share": "dir_v2_share",
+  "dirreq-v3-share": "dir_v3_share",
+  "cell-processed-cells": "cell_processed_cells",
+  "cell-queued-cells": "cell_queued_cells",
+  "cell-time-in-queue": "cell_time_in_queue",
+  "published": "published",
+  "geoip-start-time": "geoip_start_time",
+  "cell-stats-end": "cell_stats",
+  "entry-stats-end": "entry_stats",
+  "exit-stats-end": "exit_stats",
+  "bridge-stats-end": "bridge_stats",
+  "dirreq-stats-end": "dir_stats",
+  "read-history": "read_history",
+  "write-history": "write_history",
+  "dirreq-read-history": "dir_read_history",
+  "dirreq-write-history": "dir_write_history",
+  "exit-kibibytes-written": "exit_kibibytes_written",
+  "exit-kibibytes-read": "exit_kibibytes_read",
+  "exit-streams-opened": "exit_streams_opened",
+  "dirreq-v2-ips": "dir_v2_ips",
+  "dirreq-v3-ips": "dir_v3_ips",
+  "dirreq-v2-reqs": "dir_v2_requests",
+  "dirreq-v3-reqs": "dir_v3_requests",
+  "geoip-client-origins": "geoip_client_origins",
+  "entry-ips": "entry_ips",
+  "bridge-ips": "bridge_ips",
+}
+
+LOCALE_PATTERN = re.compile("^[a-zA-Z0-9\?]{2}$")
+
+# History values are kept as arrays of 64 bit signed integers. The 'q' type
+# code was added in python 3.3, prior to which we need to use longs (these
+# are 64 bits on most platforms, but 32 bits on windows and 32 bit systems).
+
+try:
+  array.array("q")
+  HISTORY_TYPECODE = "q"
+except ValueError:
+  HISTORY_TYPECODE = "l"
+
+def parse_file(descriptor_file, validate = True, content_filter = None):
   """
   Iterates over the extra-info descriptors in a file.
   
   :param file descriptor_file: file with descriptor content
-  :param bool validate: checks the validity of the descriptor's content if True, skips these checks otherwise
+  :param bool,ValidationLevel validate: checks performed on the descriptor's content, True and False are aliases for FULL and NONE
+  :param functor content_filter: called with the content of each descriptor, descriptors are skipped without being parsed if this returns False
   
   :returns: iterator for ExtraInfoDescriptor instances in the file
   
   :raises:
-    * ValueError if the contents is malformed and validate is True
+    * ValueError if the contents is malformed and we're validating
     * IOError if the file can't be read
   """
   
+  # Regular files, such as the cached-extrainfo, are memory mapped so we can
+  # find descriptor boundaries without reading the file line by line.
+  
+  mapped_content = stem.descriptor._mmap_file(descriptor_file)
+  
+  if mapped_content:
+    try:
+      for _, start, end in stem.descriptor._get_descriptor_ranges(mapped_content, None, "router-signature", descriptor_file.tell()):
+        extrainfo_text = mapped_content[start:end]
+        descriptor_file.seek(end)
+        
+        if content_filter and not content_filter(extrainfo_text): continue
+        yield ExtraInfoDescriptor(extrainfo_text, validate)
+    finally:
+      mapped_content.close()
+    
+    return
+  
   while True:
     extrainfo_content = stem.descriptor._read_until_keyword("router-signature", descriptor_file)
     
@@ -136,9 +210,96 @@ def parse_file(descriptor_file, validate = True):
     extrainfo_content += stem.descriptor._read_until_keyword(block_end_prefix, descriptor_file, True)
     
     if extrainfo_content:
-      yield ExtraInfoDescriptor("".join(extrainfo_content), validate)
+      extrainfo_text = "".join(extrainfo_content)
+      
+      if content_filter and not content_filter(extrainfo_text): continue
+      yield ExtraInfoDescriptor(extrainfo_text, validate)
     else: break # done parsing file
 
+def get_history_matrix(descriptors, history = "read_history", missing = -1):
+  """
+  Aligns the bandwidth histories of many descriptors so each column is a
+  single sampling interval. For instance, the following provides the bytes
+  that each relay read during each fifteen minute interval...
+  
+  ::
+  
+    end_times, rows = get_history_matrix(descriptors)
+    
+    for end_time, column in zip(end_times, zip(*rows)):
+      print "%s: %i relays read %i bytes" % (end_time, len(column), sum([v for v in column if v != -1]))
+  
+  Rows are arrays, so these can also be loaded into numpy without copying
+  (for instance via numpy.frombuffer).
+  
+  Relays don't end their histories at the same time, so the columns end at
+  the latest history's end time and each history is placed in the columns
+  ending closest to its own intervals. Histories are thus shifted by up to
+  half an interval.
+  
+  :param list descriptors: server or extra-info descriptors with the history
+  :param str history: history attribute to be aligned, this is 'read_history', 'write_history', 'dir_read_history', or 'dir_write_history'
+  :param int missing: value for the intervals that a descriptor lacks
+  
+  :returns:
+    tuple of the form ``(end_times, rows)``...
+    
+    * **end_times (list)** - datetime for the end of each interval
+    * **rows (list)** - array of values for each of the descriptors, in the same order
+  
+  :raises: ValueError if the histories were sampled with different intervals
+  """
+  
+  histories, interval = [], None
+  
+  # (end time in seconds, values) tuples for each descriptor's history
+  
+  for desc in descriptors:
+    history_end = getattr(desc, history + "_end", None)
+    history_interval = getattr(desc, history + "_interval", None)
+    history_values = getattr(desc, history + "_values", None)
+    
+    if history_end is None or not history_interval or not history_values:
+      histories.append(None)
+      continue
+    elif interval is not None and history_interval != interval:
+      raise ValueError("Histories must have the same interval to be aligned (%i and %i)" % (interval, history_interval))
+    
+    interval = history_interval
+    histories.append((calendar.timegm(history_end.utctimetuple()), history_values))
+  
+  if interval is None:
+    return [], [array.array(HISTORY_TYPECODE) for _ in histories]
+  
+  # Columns are numbered backward from the one ending at the latest end time,
+  # and each history's last value goes in the column ending nearest to it.
+  
+  anchor = max([entry[0] for entry in histories if entry])
+  
+  for i, entry in enumerate(histories):
+    if entry:
+      last_slot = (anchor - entry[0] + interval / 2) / interval
+      histories[i] = (last_slot + len(entry[1]) - 1, entry[1])
+  
+  slot_count = max([entry[0] for entry in histories if entry]) + 1
+  empty_row = array.array(HISTORY_TYPECODE, [missing]) * slot_count
+  
+  end_times, rows = [], []
+  
+  for slot in xrange(slot_count - 1, -1, -1):
+    end_times.append(datetime.datetime.utcfromtimestamp(anchor - slot * interval))
+  
+  for entry in histories:
+    row = array.array(HISTORY_TYPECODE, empty_row)
+    
+    if entry:
+      start = slot_count - 1 - entry[0]
+      row[start:start + len(entry[1])] = array.array(HISTORY_TYPECODE, entry[1])
+    
+    rows.append(row)
+  
+  return end_times, rows
+
 def _parse_timestamp_and_interval(keyword, content):
   """
   Parses a 'YYYY-MM-DD HH:MM:SS (NSEC s) *' entry.
@@ -151,23 +312,260 @@ def _parse_timestamp_and_interval(keyword, content):
   :raises: ValueError if the content is malformed
   """
   
-  line = "%s %s" % (keyword, content)
-  content_match = re.match("^(.*) \(([0-9]+) s\)( .*)?$", content)
+  # splits the content into its timestamp, interval, and the remainder
+  timestamp_str, interval_prefix, remainder = content.partition(" (")
+  interval, interval_suffix, remainder = remainder.partition(" s)")
   
-  if not content_match:
-    raise ValueError("Malformed %s line: %s" % (keyword, line))
+  if not interval_prefix or not interval_suffix or not interval.isdigit() or (remainder and remainder[0] != " "):
+    raise ValueError("Malformed %s line: %s %s" % (keyword, keyword, content))
   
-  timestamp_str, interval, remainder = content_match.groups()
-  if remainder: remainder = remainder[1:] # remove leading space
-  
-  if not interval.isdigit():
-    raise ValueError("%s line's interval wasn't a number: %s" % (keyword, line))
+  remainder = remainder[1:] if remainder else None # remove leading space
   
   try:
-    timestamp = datetime.datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
+    timestamp = stem.descriptor._parse_timestamp(timestamp_str)
     return timestamp, int(interval), remainder
   except ValueError:
-    raise ValueError("%s line's timestamp wasn't parseable: %s" % (keyword, line))
+    raise ValueError("%s line's timestamp wasn't parseable: %s %s" % (keyword, keyword, content))
+
+# Parsers for the lines of extra-info descriptors. These are called via
+# stem.descriptor._parse_entries() with the descriptor, the line's keyword,
+# its (value, pgp block) tuples, the original line, and if we're validating.
+
+def _parse_extra_info_line(descriptor, keyword, values, line, validate):
+  # "extra-info" Nickname Fingerprint
+  extra_info_comp = values[0][0].split()
+  
+  if len(extra_info_comp) < 2:
+    if not validate: return
+    raise ValueError("Extra-info line must have two values: %s" % line)
+  
+  if validate:
+    if not stem.util.tor_tools.is_valid_nickname(extra_info_comp[0]):
+      raise ValueError("Extra-info line entry isn't a valid nickname: %s" % extra_info_comp[0])
+    elif not stem.util.tor_tools.is_valid_fingerprint(extra_info_comp[1]):
+      raise ValueError("Tor relay fingerprints consist of fourty hex digits: %s" % extra_info_comp[1])
+  
+  descriptor.nickname = extra_info_comp[0]
+  descriptor.fingerprint = extra_info_comp[1]
+
+def _parse_geoip_db_digest_line(descriptor, keyword, values, line, validate):
+  # "geoip-db-digest" Digest
+  
+  value = values[0][0]
+  
+  if validate and not stem.descriptor.SHA1_HEX.match(value):
+    raise ValueError("Geoip digest line had an invalid sha1 digest: %s" % line)
+  
+  descriptor.geoip_db_digest = value
+
+def _parse_cell_circuits_per_decile_line(descriptor, keyword, values, line, validate):
+  # "cell-circuits-per-decile" num
+  
+  value = values[0][0]
+  
+  if not value.isdigit():
+    if validate:
+      raise ValueError("Non-numeric cell-circuits-per-decile value: %s" % line)
+    else:
+      return
+  
+  stat = int(value)
+  
+  if validate and stat < 0:
+    raise ValueError("Negative cell-circuits-per-decile value: %s" % line)
+  
+  descriptor.cell_circuits_per_decile = stat
+
+def _parse_dir_stats_line(descriptor, keyword, values, line, validate):
+  # "<keyword>" STATUS=COUNT,STATUS=COUNT,...
+  
+  value = values[0][0]
+  recognized_counts = {}
+  unrecognized_counts = {}
+  
+  is_response_stats = keyword in ("dirreq-v2-resp", "dirreq-v3-resp")
+  key_set = DirResponses if is_response_stats else DirStats
+  
+  key_type = "STATUS" if is_response_stats else "STAT"
+  error_msg = "%s lines should contain %s=COUNT mappings: %s" % (keyword, key_type, line)
+  
+  if value:
+    for entry in value.split(","):
+      if not "=" in entry:
+        if validate: raise ValueError(error_msg)
+        else: continue
+      
+      status, count = entry.split("=", 1)
+      
+      if count.isdigit():
+        if status in key_set:
+          recognized_counts[status] = int(count)
+        else:
+          unrecognized_counts[status] = int(count)
+      elif validate:
+        raise ValueError(error_msg)
+  
+  attribute = KEYWORD_ATTRIBUTE[keyword]
+  setattr(descriptor, attribute, recognized_counts)
+  setattr(descriptor, attribute + "_unknown", unrecognized_counts)
+
+def _parse_dir_share_line(descriptor, keyword, values, line, validate):
+  # "<keyword>" num%
+  
+  value = values[0][0]
+  
+  try:
+    if not value.endswith("%"): raise ValueError()
+    percentage = float(value[:-1]) / 100
+    
+    if validate and (percentage > 1 or percentage < 0):
+      raise ValueError()
+    
+    setattr(descriptor, KEYWORD_ATTRIBUTE[keyword], percentage)
+  except ValueError, exc:
+    if validate:
+      raise ValueError("Value can't be parsed as a percentage: %s" % line)
+
+def _parse_cell_line(descriptor, keyword, values, line, validate):
+  # "<keyword>" num,...,num
+  
+  value = values[0][0]
+  entries = []
+  
+  if value:
+    for entry in value.split(","):
+      try:
+        # TODO: The description of the values sound like they should
+        # always be positive, but this is not always the case in
+        # practice...
+        # https://trac.torproject.org/projects/tor/ticket/5849
+        
+        entries.append(float(entry))
+      except ValueError:
+        if validate: raise ValueError("Non-numeric entry in %s listing: %s" % (keyword, line))
+  
+  setattr(descriptor, KEYWORD_ATTRIBUTE[keyword], entries)
+
+def _parse_timestamp_line(descriptor, keyword, values, line, validate):
+  # "<keyword>" YYYY-MM-DD HH:MM:SS
+  
+  try:
+    setattr(descriptor, KEYWORD_ATTRIBUTE[keyword], stem.descriptor._parse_timestamp(values[0][0]))
+  except ValueError:
+    if validate:
+      raise ValueError("Timestamp on %s line wasn't parseable: %s" % (keyword, line))
+
+def _parse_stats_end_line(descriptor, keyword, values, line, validate):
+  # "<keyword>" YYYY-MM-DD HH:MM:SS (NSEC s)
+  
+  try:
+    timestamp, interval, _ = _parse_timestamp_and_interval(keyword, values[0][0])
+    
+    attribute = KEYWORD_ATTRIBUTE[keyword]
+    setattr(descriptor, attribute + "_end", timestamp)
+    setattr(descriptor, attribute + "_interval", interval)
+  except ValueError, exc:
+    if validate: raise exc
+
+def _parse_conn_bi_direct_line(descriptor, keyword, values, line, validate):
+  # "conn-bi-direct" YYYY-MM-DD HH:MM:SS (NSEC s) BELOW,READ,WRITE,BOTH
+  
+  try:
+    timestamp, interval, remainder = _parse_timestamp_and_interval(keyword, values[0][0])
+    stats = remainder.split(",")
+    
+    if len(stats) != 4 or not \
+      (stats[0].isdigit() and stats[1].isdigit() and \
+       stats[2].isdigit() and stats[3].isdigit()):
+      raise ValueError("conn-bi-direct line should end with four numeric values: %s" % line)
+    
+    descriptor.conn_bi_direct_end = timestamp
+    descriptor.conn_bi_direct_interval = interval
+    descriptor.conn_bi_direct_below = int(stats[0])
+    descriptor.conn_bi_direct_read = int(stats[1])
+    descriptor.conn_bi_direct_write = int(stats[2])
+    descriptor.conn_bi_direct_both = int(stats[3])
+  except ValueError, exc:
+    if validate: raise exc
+
+def _parse_history_line(descriptor, keyword, values, line, validate):
+  # "<keyword>" YYYY-MM-DD HH:MM:SS (NSEC s) NUM,NUM,NUM,NUM,NUM...
+  
+  try:
+    timestamp, interval, remainder = _parse_timestamp_and_interval(keyword, values[0][0])
+    history_values = array.array(HISTORY_TYPECODE)
+    
+    if remainder:
+      try:
+        history_values = array.array(HISTORY_TYPECODE, [int(entry) for entry in remainder.split(",")])
+      except (ValueError, OverflowError):
+        raise ValueError("%s line has non-numeric values: %s" % (keyword, line))
+    
+    attribute = KEYWORD_ATTRIBUTE[keyword]
+    setattr(descriptor, attribute + "_end", timestamp)
+    setattr(descriptor, attribute + "_interval", interval)
+    setattr(descriptor, attribute + "_values", history_values)
+  except ValueError, exc:
+    if validate: raise exc
+
+def _parse_port_count_line(descriptor, keyword, values, line, validate):
+  # "<keyword>" port=N,port=N,...
+  
+  value = values[0][0]
+  port_mappings = {}
+  error_msg = "Entries in %s line should only be PORT=N entries: %s" % (keyword, line)
+  
+  if value:
+    for entry in value.split(","):
+      if not "=" in entry:
+        if validate: raise ValueError(error_msg)
+        else: continue
+      
+      port, stat = entry.split("=", 1)
+      
+      if (port == 'other' or stem.util.connection.is_valid_port(port)) and stat.isdigit():
+        if port != 'other': port = int(port)
+        port_mappings[port] = int(stat)
+      elif validate:
+        raise ValueError(error_msg)
+  
+  setattr(descriptor, KEYWORD_ATTRIBUTE[keyword], port_mappings)
+
+def _parse_locale_count_line(descriptor, keyword, values, line, validate):
+  # "<keyword>" CC=N,CC=N,...
+  #
+  # The maxmind geoip (https://www.maxmind.com/app/iso3166) has numeric
+  # locale codes for some special values, for instance...
+  #   A1,"Anonymous Proxy"
+  #   A2,"Satellite Provider"
+  #   ??,"Unknown"
+  
+  value = values[0][0]
+  locale_usage = {}
+  error_msg = "Entries in %s line should only be CC=N entries: %s" % (keyword, line)
+  
+  if value:
+    for entry in value.split(","):
+      if not "=" in entry:
+        if validate: raise ValueError(error_msg)
+        else: continue
+      
+      locale, count = entry.split("=", 1)
+      
+      if LOCALE_PATTERN.match(locale) and count.isdigit():
+        locale_usage[locale] = int(count)
+      elif validate:
+        raise ValueError(error_msg)
+  
+  setattr(descriptor, KEYWORD_ATTRIBUTE[keyword], locale_usage)
+
+def _parse_router_signature_line(descriptor, keyword, values, line, validate):
+  block_contents = values[0][1]
+  
+  if validate and not block_contents:
+    raise ValueError("Router signature line must be followed by a signature block: %s" % line)
+  
+  descriptor.signature = block_contents
 
 class ExtraInfoDescriptor(stem.descriptor.Descriptor):
   """
@@ -190,11 +588,11 @@ class ExtraInfoDescriptor(stem.descriptor.Descriptor):
   
   :var datetime read_history_end: end of the sampling interval
   :var int read_history_interval: seconds per interval
-  :var list read_history_values: bytes read during each interval
+  :var array read_history_values: bytes read during each interval
   
   :var datetime write_history_end: end of the sampling interval
   :var int write_history_interval: seconds per interval
-  :var list write_history_values: bytes written during each interval
+  :var array write_history_values: bytes written during each interval
   
   **Cell relaying statistics:**
   
@@ -235,11 +633,11 @@ class ExtraInfoDescriptor(stem.descriptor.Descriptor):
   
   :var datetime dir_read_history_end: end of the sampling interval
   :var int dir_read_history_interval: seconds per interval
-  :var list dir_read_history_values: bytes read during each interval
+  :var array dir_read_history_values: bytes read during each interval
   
   :var datetime dir_write_history_end: end of the sampling interval
   :var int dir_write_history_interval: seconds per interval
-  :var list dir_write_history_values: bytes read during each interval
+  :var array dir_write_history_values: bytes read during each interval
   
   **Guard Attributes:**
   
@@ -266,6 +664,49 @@ class ExtraInfoDescriptor(stem.descriptor.Descriptor):
   **\*** attribute is either required when we're parsed with validation or has a default value, others are left as None if undefined
   """
   
+  # Parsers for the lines we recognize. Subclasses for other kinds of
+  # extra-info descriptors can extend this.
+  
+  _PARSER_FOR_KEYWORD = {
+    "extra-info": _parse_extra_info_line,
+    "geoip-db-digest": _parse_geoip_db_digest_line,
+    "cell-circuits-per-decile": _parse_cell_circuits_per_decile_line,
+    "dirreq-v2-resp": _parse_dir_stats_line,
+    "dirreq-v3-resp": _parse_dir_stats_line,
+    "dirreq-v2-direct-dl": _parse_dir_stats_line,
+    "dirreq-v3-direct-dl": _parse_dir_stats_line,
+    "dirreq-v2-tunneled-dl": _parse_dir_stats_line,
+    "dirreq-v3-tunneled-dl": _parse_dir_stats_line,
+    "dirreq-v2-share": _parse_dir_share_line,
+    "dirreq-v3-share": _parse_dir_share_line,
+    "cell-processed-cells": _parse_cell_line,
+    "cell-queued-cells": _parse_cell_line,
+    "cell-time-in-queue": _parse_cell_line,
+    "published": _parse_timestamp_line,
+    "geoip-start-time": _parse_timestamp_line,
+    "cell-stats-end": _parse_stats_end_line,
+    "entry-stats-end": _parse_stats_end_line,
+    "exit-stats-end": _parse_stats_end_line,
+    "bridge-stats-end": _parse_stats_end_line,
+    "dirreq-stats-end": _parse_stats_end_line,
+    "conn-bi-direct": _parse_conn_bi_direct_line,
+    "read-history": _parse_history_line,
+    "write-history": _parse_history_line,
+    "dirreq-read-history": _parse_history_line,
+    "dirreq-write-history": _parse_history_line,
+    "exit-kibibytes-written": _parse_port_count_line,
+    "exit-kibibytes-read": _parse_port_count_line,
+    "exit-streams-opened": _parse_port_count_line,
+    "dirreq-v2-ips": _parse_locale_count_line,
+    "dirreq-v3-ips": _parse_locale_count_line,
+    "dirreq-v2-reqs": _parse_locale_count_line,
+    "dirreq-v3-reqs": _parse_locale_count_line,
+    "geoip-client-origins": _parse_locale_count_line,
+    "entry-ips": _parse_locale_count_line,
+    "bridge-ips": _parse_locale_count_line,
+    "router-signature": _parse_router_signature_line,
+  }
+  
   def __init__(self, raw_contents, validate = True):
     """
     Extra-info descriptor constructor, created from a relay's extra-info
@@ -277,9 +718,9 @@ class ExtraInfoDescriptor(stem.descriptor.Descriptor):
     malformed data.
     
     :param str raw_contents: extra-info content provided by the relay
-    :param bool validate: checks the validity of the extra-info descriptor if True, skips these checks otherwise
+    :param bool,ValidationLevel validate: checks performed on the descriptor's content, True and False are aliases for FULL and NONE
     
-    :raises: ValueError if the contents is malformed and validate is True
+    :raises: ValueError if the contents is malformed and we're validating
     """
     
     stem.descriptor.Descriptor.__init__(self, raw_contents)
@@ -359,10 +800,14 @@ class ExtraInfoDescriptor(stem.descriptor.Descriptor):
     
     self._unrecognized_lines = []
     
+    validation_level = stem.descriptor._get_validation_level(validate)
+    validate = validation_level == stem.descriptor.ValidationLevel.FULL
+    check_structure = validation_level != stem.descriptor.ValidationLevel.NONE
+    
     entries, first_keyword, last_keyword, _ = \
-      stem.descriptor._get_descriptor_components(raw_contents, validate, ())
+      stem.descriptor._get_descriptor_components(raw_contents, check_structure, ())
     
-    if validate:
+    if check_structure:
       for keyword in REQUIRED_FIELDS:
         if not keyword in entries:
           raise ValueError("Extra-info descriptor must have a '%s' entry" % keyword)
@@ -392,292 +837,5 @@ class ExtraInfoDescriptor(stem.descriptor.Descriptor):
     :raises: ValueError if an error occures in validation
     """
     
-    for keyword, values in entries.items():
-      # most just work with the first (and only) value
-      value, block_contents = values[0]
-      
-      line = "%s %s" % (keyword, value) # original line
-      if block_contents: line += "\n%s" % block_contents
-      
-      if keyword == "extra-info":
-        # "extra-info" Nickname Fingerprint
-        extra_info_comp = value.split()
-        
-        if len(extra_info_comp) < 2:
-          if not validate: continue
-          raise ValueError("Extra-info line must have two values: %s" % line)
-        
-        if validate:
-          if not stem.util.tor_tools.is_valid_nickname(extra_info_comp[0]):
-            raise ValueError("Extra-info line entry isn't a valid nickname: %s" % extra_info_comp[0])
-          elif not stem.util.tor_tools.is_valid_fingerprint(extra_info_comp[1]):
-            raise ValueError("Tor relay fingerprints consist of fourty hex digits: %s" % extra_info_comp[1])
-        
-        self.nickname = extra_info_comp[0]
-        self.fingerprint = extra_info_comp[1]
-      elif keyword == "geoip-db-digest":
-        # "geoip-db-digest" Digest
-        
-        if validate and not re.match("^[0-9a-fA-F]{40}$", value):
-          raise ValueError("Geoip digest line had an invalid sha1 digest: %s" % line)
-        
-        self.geoip_db_digest = value
-      elif keyword == "cell-circuits-per-decile":
-        # "cell-circuits-per-decile" num
-        
-        if not value.isdigit():
-          if validate:
-            raise ValueError("Non-numeric cell-circuits-per-decile value: %s" % line)
-          else:
-            continue
-        
-        stat = int(value)
-        
-        if validate and stat < 0:
-          raise ValueError("Negative cell-circuits-per-decile value: %s" % line)
-        
-        self.cell_circuits_per_decile = stat
-      elif keyword in ("dirreq-v2-resp", "dirreq-v3-resp", "dirreq-v2-direct-dl", "dirreq-v3-direct-dl", "dirreq-v2-tunneled-dl", "dirreq-v3-tunneled-dl"):
-        recognized_counts = {}
-        unrecognized_counts = {}
-        
-        is_response_stats = keyword in ("dirreq-v2-resp", "dirreq-v3-resp")
-        key_set = DirResponses if is_response_stats else DirStats
-        
-        key_type = "STATUS" if is_response_stats else "STAT"
-        error_msg = "%s lines should contain %s=COUNT mappings: %s" % (keyword, key_type, line)
-        
-        
-        if value:
-          for entry in value.split(","):
-            if not "=" in entry:
-              if validate: raise ValueError(error_msg)
-              else: continue
-            
-            status, count = entry.split("=", 1)
-            
-            if count.isdigit():
-              if status in key_set:
-                recognized_counts[status] = int(count)
-              else:
-                unrecognized_counts[status] = int(count)
-            elif validate:
-              raise ValueError(error_msg)
-        
-        if keyword == "dirreq-v2-resp":
-          self.dir_v2_responses = recognized_counts
-          self.dir_v2_responses_unknown = unrecognized_counts
-        elif keyword == "dirreq-v3-resp":
-          self.dir_v3_responses = recognized_counts
-          self.dir_v3_responses_unknown = unrecognized_counts
-        elif keyword == "dirreq-v2-direct-dl":
-          self.dir_v2_direct_dl = recognized_counts
-          self.dir_v2_direct_dl_unknown = unrecognized_counts
-        elif keyword == "dirreq-v3-direct-dl":
-          self.dir_v3_direct_dl = recognized_counts
-          self.dir_v3_direct_dl_unknown = unrecognized_counts
-        elif keyword == "dirreq-v2-tunneled-dl":
-          self.dir_v2_tunneled_dl = recognized_counts
-          self.dir_v2_tunneled_dl_unknown = unrecognized_counts
-        elif keyword == "dirreq-v3-tunneled-dl":
-          self.dir_v3_tunneled_dl = recognized_counts
-          self.dir_v3_tunneled_dl_unknown = unrecognized_counts
-      elif keyword in ("dirreq-v2-share", "dirreq-v3-share"):
-        # "<keyword>" num%
-        
-        try:
-          if not value.endswith("%"): raise ValueError()
-          percentage = float(value[:-1]) / 100
-          
-          if validate and (percentage > 1 or percentage < 0):
-            raise ValueError()
-          
-          if keyword == "dirreq-v2-share":
-            self.dir_v2_share = percentage
-          elif keyword == "dirreq-v3-share":
-            self.dir_v3_share = percentage
-        except ValueError, exc:
-          if validate:
-            raise ValueError("Value can't be parsed as a percentage: %s" % line)
-      elif keyword in ("cell-processed-cells", "cell-queued-cells", "cell-time-in-queue"):
-        # "<keyword>" num,...,num
-        
-        entries = []
-        
-        if value:
-          for entry in value.split(","):
-            try:
-              # TODO: The description of the values sound like they should
-              # always be positive, but this is not always the case in
-              # practice...
-              # https://trac.torproject.org/projects/tor/ticket/5849
-              
-              entries.append(float(entry))
-            except ValueError:
-              if validate: raise ValueError("Non-numeric entry in %s listing: %s" % (keyword, line))
-        
-        if keyword == "cell-processed-cells":
-          self.cell_processed_cells = entries
-        elif keyword == "cell-queued-cells":
-          self.cell_queued_cells = entries
-        elif keyword == "cell-time-in-queue":
-          self.cell_time_in_queue = entries
-      elif keyword in ("published", "geoip-start-time"):
-        # "<keyword>" YYYY-MM-DD HH:MM:SS
-        
-        try:
-          timestamp = datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
-          
-          if keyword == "published":
-            self.published = timestamp
-          elif keyword == "geoip-start-time":
-            self.geoip_start_time = timestamp
-        except ValueError:
-          if validate:
-            raise ValueError("Timestamp on %s line wasn't parseable: %s" % (keyword, line))
-      elif keyword in ("cell-stats-end", "entry-stats-end", "exit-stats-end", "bridge-stats-end", "dirreq-stats-end"):
-        # "<keyword>" YYYY-MM-DD HH:MM:SS (NSEC s)
-        
-        try:
-          timestamp, interval, _ = _parse_timestamp_and_interval(keyword, value)
-          
-          if keyword == "cell-stats-end":
-            self.cell_stats_end = timestamp
-            self.cell_stats_interval = interval
-          elif keyword == "entry-stats-end":
-            self.entry_stats_end = timestamp
-            self.entry_stats_interval = interval
-          elif keyword == "exit-stats-end":
-            self.exit_stats_end = timestamp
-            self.exit_stats_interval = interval
-          elif keyword == "bridge-stats-end":
-            self.bridge_stats_end = timestamp
-            self.bridge_stats_interval = interval
-          elif keyword == "dirreq-stats-end":
-            self.dir_stats_end = timestamp
-            self.dir_stats_interval = interval
-        except ValueError, exc:
-          if validate: raise exc
-      elif keyword == "conn-bi-direct":
-        # "conn-bi-direct" YYYY-MM-DD HH:MM:SS (NSEC s) BELOW,READ,WRITE,BOTH
-        
-        try:
-          timestamp, interval, remainder = _parse_timestamp_and_interval(keyword, value)
-          stats = remainder.split(",")
-          
-          if len(stats) != 4 or not \
-            (stats[0].isdigit() and stats[1].isdigit() and \
-             stats[2].isdigit() and stats[3].isdigit()):
-            raise ValueError("conn-bi-direct line should end with four numeric values: %s" % line)
-          
-          self.conn_bi_direct_end = timestamp
-          self.conn_bi_direct_interval = interval
-          self.conn_bi_direct_below = int(stats[0])
-          self.conn_bi_direct_read = int(stats[1])
-          self.conn_bi_direct_write = int(stats[2])
-          self.conn_bi_direct_both = int(stats[3])
-        except ValueError, exc:
-          if validate: raise exc
-      elif keyword in ("read-history", "write-history", "dirreq-read-history", "dirreq-write-history"):
-        # "<keyword>" YYYY-MM-DD HH:MM:SS (NSEC s) NUM,NUM,NUM,NUM,NUM...
-        try:
-          timestamp, interval, remainder = _parse_timestamp_and_interval(keyword, value)
-          history_values = []
-          
-          if remainder:
-            try:
-              history_values = [int(entry) for entry in remainder.split(",")]
-            except ValueError:
-              raise ValueError("%s line has non-numeric values: %s" % (keyword, line))
-          
-          if keyword == "read-history":
-            self.read_history_end = timestamp
-            self.read_history_interval = interval
-            self.read_history_values = history_values
-          elif keyword == "write-history":
-            self.write_history_end = timestamp
-            self.write_history_interval = interval
-            self.write_history_values = history_values
-          elif keyword == "dirreq-read-history":
-            self.dir_read_history_end = timestamp
-            self.dir_read_history_interval = interval
-            self.dir_read_history_values = history_values
-          elif keyword == "dirreq-write-history":
-            self.dir_write_history_end = timestamp
-            self.dir_write_history_interval = interval
-            self.dir_write_history_values = history_values
-        except ValueError, exc:
-          if validate: raise exc
-      elif keyword in ("exit-kibibytes-written", "exit-kibibytes-read", "exit-streams-opened"):
-        # "<keyword>" port=N,port=N,...
-        
-        port_mappings = {}
-        error_msg = "Entries in %s line should only be PORT=N entries: %s" % (keyword, line)
-        
-        if value:
-          for entry in value.split(","):
-            if not "=" in entry:
-              if validate: raise ValueError(error_msg)
-              else: continue
-            
-            port, stat = entry.split("=", 1)
-            
-            if (port == 'other' or stem.util.connection.is_valid_port(port)) and stat.isdigit():
-              if port != 'other': port = int(port)
-              port_mappings[port] = int(stat)
-            elif validate:
-              raise ValueError(error_msg)
-        
-        if keyword == "exit-kibibytes-written":
-          self.exit_kibibytes_written = port_mappings
-        elif keyword == "exit-kibibytes-read":
-          self.exit_kibibytes_read = port_mappings
-        elif keyword == "exit-streams-opened":
-          self.exit_streams_opened = port_mappings
-      elif keyword in ("dirreq-v2-ips", "dirreq-v3-ips", "dirreq-v2-reqs", "dirreq-v3-reqs", "geoip-client-origins", "entry-ips", "bridge-ips"):
-        # "<keyword>" CC=N,CC=N,...
-        #
-        # The maxmind geoip (https://www.maxmind.com/app/iso3166) has numeric
-        # locale codes for some special values, for instance...
-        #   A1,"Anonymous Proxy"
-        #   A2,"Satellite Provider"
-        #   ??,"Unknown"
-        
-        locale_usage = {}
-        error_msg = "Entries in %s line should only be CC=N entries: %s" % (keyword, line)
-        
-        if value:
-          for entry in value.split(","):
-            if not "=" in entry:
-              if validate: raise ValueError(error_msg)
-              else: continue
-            
-            locale, count = entry.split("=", 1)
-            
-            if re.match("^[a-zA-Z0-9\?]{2}$", locale) and count.isdigit():
-              locale_usage[locale] = int(count)
-            elif validate:
-              raise ValueError(error_msg)
-        
-        if keyword == "dirreq-v2-ips":
-          self.dir_v2_ips = locale_usage
-        elif keyword == "dirreq-v3-ips":
-          self.dir_v3_ips = locale_usage
-        elif keyword == "dirreq-v2-reqs":
-          self.dir_v2_requests = locale_usage
-        elif keyword == "dirreq-v3-reqs":
-          self.dir_v3_requests = locale_usage
-        elif keyword == "geoip-client-origins":
-          self.geoip_client_origins = locale_usage
-        elif keyword == "entry-ips":
-          self.entry_ips = locale_usage
-        elif keyword == "bridge-ips":
-          self.bridge_ips = locale_usage
-      elif keyword == "router-signature":
-        if validate and not block_contents:
-          raise ValueError("Router signature line must be followed by a signature block: %s" % line)
-        
-        self.signature = block_contents
-      else:
-        self._unrecognized_lines.append(line)
+    stem.descriptor._parse_entries(self, entries, validate, self._PARSER_FOR_KEYWORD)
 
@@ -47,6 +47,99 @@ again...
   
   save_processed_files("/tmp/used_descriptors", reader.get_processed_files())
 
+Rather than polling, long running processes should use the watch() method. This
+reads our targets once then waits for files to be added or changed, only
+reading those. On Linux this is done with inotify so an idle reader costs
+nothing, and elsewhere it falls back to periodically checking the modification
+times of the files under our targets...
+
+::
+
+  reader = DescriptorReader(["/tmp/descriptor_data"])
+  reader.watch()
+  
+  try:
+    # prints descriptors as they're added until we're interrupted
+    for descriptor in reader:
+      print descriptor
+  finally:
+    reader.stop()
+
+Files that tor appends descriptors to (cached-descriptors and cached-extrainfo)
+are also tracked by the byte offset we've read up to. When these change we only
+read the descriptors that were appended since our last run unless the file has
+been replaced or truncated. These checkpoints can be persisted along with the
+processed files listing...
+
+::
+
+  processed_files, checkpoints = load_processed_files("/tmp/used_descriptors", True)
+  
+  reader = DescriptorReader(["/home/atagar/.tor"])
+  reader.set_processed_files(processed_files)
+  reader.set_checkpoints(checkpoints)
+  
+  with reader:
+    for descriptor in reader:
+      print descriptor
+  
+  save_processed_files("/tmp/used_descriptors", reader.get_processed_files(), reader.get_checkpoints())
+
+Descriptors are handed from the reader thread to the caller in batches. When
+reading a large number of descriptors it's cheapest to process them the same
+way...
+
+::
+
+  with DescriptorReader(["/tmp/descriptor_data"]) as reader:
+    for descriptors in reader.iter_batches(500):
+      process(descriptors)
+
+Archives and cached descriptor files often contain the same descriptor more
+than once (for instance, consecutive monthly tarballs overlap). With the
+deduplicate argument we remember a digest of the descriptors we've read and
+skip copies of them without parsing. These digests can be persisted along with
+the processed files listing...
+
+::
+
+  processed_files, digests = load_processed_files("/tmp/used_descriptors", include_digests = True)
+  
+  reader = DescriptorReader(["/tmp/descriptor_data"], deduplicate = True)
+  reader.set_processed_files(processed_files)
+  reader.set_seen_digests(digests)
+  
+  with reader:
+    for descriptor in reader:
+      print descriptor
+  
+  save_processed_files("/tmp/used_descriptors", reader.get_processed_files(), digests = reader.get_seen_digests())
+
+Most often we only want some of the descriptors, for instance those of
+particular relays or a time range. Rather than parse everything and discard
+most of it, a DescriptorFilter checks the raw 'router', 'fingerprint', and
+'published' lines of descriptors so those that don't match are skipped without
+being parsed...
+
+::
+
+  my_filter = DescriptorFilter(
+    fingerprints = ["9695DFC35FFEB861329B9F1AB04C46397020CE31"],
+    published_after = datetime.datetime(2012, 3, 1),
+  )
+  
+  with DescriptorReader(["/tmp/descriptor_data"], filter = my_filter) as reader:
+    for descriptor in reader:
+      print descriptor
+
+This can also be given to :func:`stem.descriptor.parse_file` via its
+content_filter argument (``content_filter = my_filter.is_content_match``).
+
+Analysis often reads the same archives time and again. With the use_cache
+argument we write the descriptors of each archive to a binary cache alongside
+it (see :mod:`stem.descriptor.cache`), and later runs load these rather than
+parsing the archive while the cache is newer than it.
+
 **Module Overview:**
 
 ::
@@ -54,14 +147,30 @@ again...
   load_processed_files - Loads a listing of processed files.
   save_processed_files - Saves a listing of processed files.
   
+  DuplicateFilter - Bounded record of the descriptors that we've read.
+    |- is_new - checks if this is the first time we've seen some content
+    |- is_seen - checks if we've seen some content, without remembering it
+    |- add - remembers some content
+    +- get_digests - provides the digests that we remember
+  
+  DescriptorFilter - Criteria for the descriptors that we want.
+    |- is_content_match - checks if raw descriptor content might match
+    +- is_match - checks if a parsed descriptor matches
+  
   DescriptorReader - Iterator for descriptor data on the local file system.
     |- get_processed_files - provides the listing of files that we've processed
     |- set_processed_files - sets our tracking of the files we have processed
+    |- get_checkpoints - provides how far we've read into appended files
+    |- set_checkpoints - sets how far we've read into appended files
+    |- get_seen_digests - provides the digests of descriptors we've read
+    |- set_seen_digests - sets the digests of descriptors we've read
     |- register_skip_listener - adds a listener that's notified of skipped files
     |- start - begins reading descriptor data
+    |- watch - begins reading descriptor data, then continues with changed files
     |- stop - stops reading descriptor data
     |- __enter__ / __exit__ - manages the descriptor reader thread in the context
-    +- __iter__ - iterates over descriptor data in unread files
+    |- __iter__ - iterates over descriptor data in unread files
+    +- iter_batches - iterates over lists of descriptor data in unread files
   
   FileSkipped - Base exception for a file that was skipped.
     |- AlreadyRead - We've already read a file with this last modified timestamp.
@@ -72,16 +181,68 @@ again...
 """
 
 import os
+import stat
+import errno
+import select
+import struct
+import hashlib
+import binascii
 import tarfile
 import threading
 import mimetypes
+import collections
 import Queue
 
 import stem.descriptor
+import stem.descriptor.cache
+import stem.descriptor.server_descriptor
+import stem.descriptor.extrainfo_descriptor
+import stem.util.log as log
+import stem.util.tor_tools
 
 # flag to indicate when the reader thread is out of descriptor files to read
 FINISHED = "DONE"
 
+# Maximum number of descriptors the reader thread gathers before handing them
+# to our caller. Lists of descriptors are passed between threads so we don't
+# pay for queue synchronization with each one.
+
+BATCH_SIZE = 50
+
+# Files that tor appends descriptors to. We keep track of how far we've read
+# into these so later runs only need to read the new content.
+
+APPENDED_FILES = ("cached-descriptors", "cached-extrainfo")
+
+# Number of descriptor digests we remember when deduplicating. Each is around a
+# hundred bytes, so this is roughly ten megabytes.
+
+DEDUPLICATION_SIZE = 100000
+
+# suffix of the descriptor caches we write alongside archives
+CACHE_SUFFIX = ".cache"
+
+# inotify flags from sys/inotify.h, these are stable parts of the kernel's ABI
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+INOTIFY_EVENT = struct.Struct("iIII") # wd, mask, cookie, name length
+
+# We determine the type of files from their first few bytes. This is enough to
+# include the 'ustar' magic of tar headers, and compressed files are
+# identified by their gzip, bzip2, or xz magic numbers.
+
+FILE_HEADER_SIZE = 512
+TAR_MAGIC = (257, "ustar")
+COMPRESSION_MAGIC = ("\x1f\x8b", "BZh", "\xfd7zXZ\x00")
+
 class FileSkipped(Exception):
   "Base error when we can't provide descriptor data from a file."
 
@@ -123,22 +284,257 @@ class FileMissing(ReadFailed):
   def __init__(self):
     ReadFailed.__init__(self, None)
 
-def load_processed_files(path):
+class DuplicateFilter:
+  """
+  Bounded record of the descriptor content that we've read, so copies can be
+  dropped before they're parsed. Content is identified by its md5 digest, and
+  once we have max_size digests the least recently seen are forgotten.
+  
+  :param int max_size: maximum number of digests that we remember
+  :param list digests: hex digests to start with, least recently seen first
+  
+  :raises: TypeError if the digests are malformed
+  """
+  
+  def __init__(self, max_size = DEDUPLICATION_SIZE, digests = None):
+    self._max_size = max_size
+    self._digests = collections.OrderedDict()
+    self._digests_lock = threading.RLock()
+    
+    for digest in digests or []:
+      try:
+        self._add(binascii.unhexlify(digest))
+      except TypeError:
+        raise TypeError("'%s' is not a hex digest" % digest)
+  
+  def is_new(self, content):
+    """
+    Checks if this is the first time that we've seen the given content, and
+    remembers it.
+    
+    :param str content: raw descriptor content
+    
+    :returns: True if we haven't seen this content before, False otherwise
+    """
+    
+    return self._add(hashlib.md5(content).digest())
+  
+  def is_seen(self, content):
+    """
+    Checks if we've seen the given content, without remembering it. This way
+    content can be checked prior to being parsed, and only remembered with
+    :func:`~stem.descriptor.reader.DuplicateFilter.add` if that succeeds.
+    
+    :param str content: raw descriptor content
+    
+    :returns: True if we've seen this content before, False otherwise
+    """
+    
+    with self._digests_lock:
+      return hashlib.md5(content).digest() in self._digests
+  
+  def add(self, content):
+    """
+    Remembers the given content.
+    
+    :param str content: raw descriptor content
+    """
+    
+    self._add(hashlib.md5(content).digest())
+  
+  def get_digests(self):
+    """
+    Provides the hex digests of the content that we remember.
+    
+    :returns: list of hex digests, least recently seen first
+    """
+    
+    with self._digests_lock:
+      return [binascii.hexlify(digest) for digest in self._digests]
+  
+  def _add(self, digest):
+    with self._digests_lock:
+      is_new = self._digests.pop(digest, None) is None
+      self._digests[digest] = True
+      
+      if len(self._digests) > self._max_size:
+        self._digests.popitem(last = False)
+      
+      return is_new
+  
+  def __len__(self):
+    return len(self._digests)
+
+class DescriptorFilter:
+  """
+  Criteria for the descriptors that we want. Checks are skipped for criteria
+  that are None, and descriptors must match all of the rest.
+  
+  Raw descriptor content can be checked with is_content_match(), which only
+  looks at the lines it needs so non-matching descriptors can be skipped
+  without parsing them. RelayDescriptors and BridgeDescriptors can't be told
+  apart from their content, so is_match() should also be used once they're
+  parsed if distinguishing the two.
+  
+  :param list fingerprints: relay fingerprints, in any case
+  :param list nicknames: relay nicknames
+  :param datetime published_after: earliest publication time, inclusive
+  :param datetime published_before: latest publication time, inclusive
+  :param list descriptor_types: descriptor classes, such as :class:`stem.descriptor.server_descriptor.RelayDescriptor` or :class:`stem.descriptor.extrainfo_descriptor.ExtraInfoDescriptor`
+  
+  :raises: ValueError if a fingerprint is malformed
+  """
+  
+  def __init__(self, fingerprints = None, nicknames = None, published_after = None, published_before = None, descriptor_types = None):
+    if fingerprints is not None:
+      for fingerprint in fingerprints:
+        if not stem.util.tor_tools.is_valid_fingerprint(fingerprint):
+          raise ValueError("'%s' isn't a valid fingerprint" % fingerprint)
+      
+      fingerprints = frozenset([fingerprint.upper() for fingerprint in fingerprints])
+    
+    self.fingerprints = fingerprints
+    self.nicknames = frozenset(nicknames) if nicknames is not None else None
+    self.published_after = published_after
+    self.published_before = published_before
+    self.descriptor_types = tuple(descriptor_types) if descriptor_types is not None else None
+  
+  def is_content_match(self, content):
+    """
+    Checks if raw descriptor content matches our criteria. This only reads the
+    lines that are needed, and for the descriptor type can only tell server
+    and extra-info descriptors apart.
+    
+    :param str content: descriptor content, without annotations
+    
+    :returns: True if the descriptor might match our criteria, False if it doesn't
+    """
+    
+    first_line = content[:content.find("\n")] if "\n" in content else content
+    if first_line.startswith("opt "): first_line = first_line[4:]
+    keyword, _, value = first_line.partition(" ")
+    
+    if keyword == "router":
+      descriptor_class = stem.descriptor.server_descriptor.ServerDescriptor
+    elif keyword == "extra-info":
+      descriptor_class = stem.descriptor.extrainfo_descriptor.ExtraInfoDescriptor
+    else:
+      descriptor_class = None
+    
+    if self.descriptor_types is not None:
+      if not descriptor_class: return False
+      
+      for descriptor_type in self.descriptor_types:
+        if issubclass(descriptor_type, descriptor_class) or issubclass(descriptor_class, descriptor_type):
+          break
+      else:
+        return False
+    
+    # the nickname is the first value of either first line, and extra-info
+    # descriptors have their fingerprint there too
+    
+    fields = value.split()
+    
+    if self.nicknames is not None:
+      if not fields or not fields[0] in self.nicknames: return False
+    
+    if self.fingerprints is not None:
+      if keyword == "extra-info":
+        fingerprint = fields[1] if len(fields) >= 2 else None
+      else:
+        fingerprint = _get_line_value(content, "fingerprint")
+        if fingerprint: fingerprint = fingerprint.replace(" ", "")
+      
+      if not fingerprint or not fingerprint.upper() in self.fingerprints:
+        return False
+    
+    if self.published_after is not None or self.published_before is not None:
+      try:
+        published = stem.descriptor._parse_timestamp(_get_line_value(content, "published"))
+      except (TypeError, ValueError, IndexError):
+        return False
+      
+      if not self._is_published_match(published): return False
+    
+    return True
+  
+  def is_match(self, descriptor):
+    """
+    Checks if a parsed descriptor matches our criteria.
+    
+    :param stem.descriptor.Descriptor descriptor: descriptor to be checked
+    
+    :returns: True if the descriptor matches our criteria, False otherwise
+    """
+    
+    if self.descriptor_types is not None and not isinstance(descriptor, self.descriptor_types):
+      return False
+    
+    if self.nicknames is not None and not getattr(descriptor, "nickname", None) in self.nicknames:
+      return False
+    
+    if self.fingerprints is not None:
+      fingerprint = getattr(descriptor, "fingerprint", None)
+      
+      if not fingerprint or not fingerprint.upper() in self.fingerprints:
+        return False
+    
+    if self.published_after is not None or self.published_before is not None:
+      published = getattr(descriptor, "published", None)
+      if not published or not self._is_published_match(published): return False
+    
+    return True
+  
+  def _is_published_match(self, published):
+    if self.published_after is not None and published < self.published_after:
+      return False
+    elif self.published_before is not None and published > self.published_before:
+      return False
+    else:
+      return True
+
+def _get_line_value(content, keyword):
+  """
+  Provides the value of the first line with the given keyword.
+  
+  :param str content: descriptor content
+  :param str keyword: keyword of the line, with or without an 'opt ' prefix
+  
+  :returns: str with the line's value, None if there isn't one
+  """
+  
+  for line_keyword in (keyword, "opt " + keyword):
+    start = stem.descriptor._find_keyword_line(content, line_keyword, 0)
+    
+    if start != -1:
+      end = content.find("\n", start)
+      if end == -1: end = len(content)
+      return content[start + len(line_keyword):end].strip()
+  
+  return None
+
+def load_processed_files(path, include_checkpoints = False, include_digests = False):
   """
   Loads a dictionary of 'path => last modified timestamp' mappings, as
   persisted by :func:`stem.descriptor.reader.save_processed_files`, from a
   file.
   
   :param str path: location to load the processed files dictionary from
+  :param bool include_checkpoints: provides the read checkpoints for appended files too if True
+  :param bool include_digests: provides the digests of descriptors we've read too if True
   
-  :returns: dict of 'path (str) => last modified unix timestamp (int)' mappings
+  :returns:
+    dict of 'path (str) => last modified unix timestamp (int)' mappings, if
+    include_checkpoints or include_digests are True then this is a tuple that
+    also has a dict of 'path (str) => (offset, inode, size)' checkpoints and a
+    list of hex digests (in that order)
   
   :raises:
     * IOError if unable to read the file
     * TypeError if unable to parse the file's contents
   """
   
-  processed_files = {}
+  processed_files, checkpoints, digests = {}, {}, []
   
   with open(path) as input_file:
     for line in input_file.readlines():
@@ -146,10 +542,33 @@ def load_processed_files(path):
       
       if not line: continue # skip blank lines
       
+      # descriptor digests from deduplication, which are in the order that
+      # we last saw them
+      
+      if line.startswith("digest "):
+        digest = line[7:]
+        
+        if len(digest) != 32 or not all(c in "0123456789abcdefABCDEF" for c in digest):
+          raise TypeError("'%s' is not a hex digest" % digest)
+        
+        digests.append(digest)
+        continue
+      
       if not " " in line:
         raise TypeError("Malformed line: %s" % line)
       
       path, timestamp = line.rsplit(" ", 1)
+      checkpoint = None
+      
+      # files that we've read incrementally are followed by an
+      # 'offset:inode:size' checkpoint
+      
+      if ":" in timestamp:
+        if not " " in path:
+          raise TypeError("Malformed line: %s" % line)
+        
+        checkpoint = timestamp
+        path, timestamp = path.rsplit(" ", 1)
       
       if not os.path.isabs(path):
         raise TypeError("'%s' is not an absolute path" % path)
@@ -157,10 +576,25 @@ def load_processed_files(path):
         raise TypeError("'%s' is not an integer timestamp" % timestamp)
       
       processed_files[path] = int(timestamp)
+      
+      if checkpoint:
+        checkpoint_comp = checkpoint.split(":")
+        
+        if len(checkpoint_comp) != 3 or not (checkpoint_comp[0].isdigit() and checkpoint_comp[1].isdigit() and checkpoint_comp[2].isdigit()):
+          raise TypeError("'%s' is not an offset:inode:size checkpoint" % checkpoint)
+        
+        checkpoints[path] = tuple(map(int, checkpoint_comp))
+  
+  results = [processed_files]
+  if include_checkpoints: results.append(checkpoints)
+  if include_digests: results.append(digests)
   
-  return processed_files
+  if len(results) == 1:
+    return processed_files
+  else:
+    return tuple(results)
 
-def save_processed_files(path, processed_files):
+def save_processed_files(path, processed_files, checkpoints = None, digests = None):
   """
   Persists a dictionary of 'path => last modified timestamp' mappings (as
   provided by the DescriptorReader's get_processed_files() method) so that they
@@ -168,12 +602,16 @@ def save_processed_files(path, processed_files):
   
   :param str path: location to save the processed files dictionary to
   :param dict processed_files: 'path => last modified' mappings
+  :param dict checkpoints: 'path => (offset, inode, size)' mappings as provided by the DescriptorReader's get_checkpoints() method
+  :param list digests: hex digests of descriptors we've read, as provided by the DescriptorReader's get_seen_digests() method
   
   :raises:
     * IOError if unable to write to the file
     * TypeError if processed_files is of the wrong type
   """
   
+  if checkpoints is None: checkpoints = {}
+  
   # makes the parent directory if it doesn't already exist
   try:
     path_dir = os.path.dirname(path)
@@ -185,7 +623,13 @@ def save_processed_files(path, processed_files):
       if not os.path.isabs(path):
         raise TypeError("Only absolute paths are acceptable: %s" % path)
       
-      output_file.write("%s %i\n" % (path, timestamp))
+      if path in checkpoints:
+        output_file.write("%s %i %i:%i:%i\n" % ((path, timestamp) + tuple(checkpoints[path])))
+      else:
+        output_file.write("%s %i\n" % (path, timestamp))
+    
+    for digest in digests or []:
+      output_file.write("digest %s\n" % digest)
 
 class DescriptorReader:
   """
@@ -205,19 +649,38 @@ class DescriptorReader:
   :param bool follow_links: determines if we'll follow symlinks when traversing directories
   :param int buffer_size: descriptors we'll buffer before waiting for some to be read, this is unbounded if zero
   :param str persistence_path: if set we will load and save processed file listings from this path, errors are ignored
+  :param bool,ValidationLevel validate: checks performed on the descriptor content, True and False are aliases for FULL and NONE
+  :param bool,int deduplicate: skips descriptors that we've already read if True, an int is the number of descriptors we remember (otherwise this is DEDUPLICATION_SIZE)
+  :param stem.descriptor.reader.DescriptorFilter filter: only provides descriptors matching this, those that don't are skipped prior to parsing
+  :param bool use_cache: reads archives from a binary cache alongside them if it's current, and otherwise writes one when reading an archive with full validation
   """
   
-  def __init__(self, target, follow_links = False, buffer_size = 100, persistence_path = None):
+  def __init__(self, target, follow_links = False, buffer_size = 100, persistence_path = None, validate = True, deduplicate = False, filter = None, use_cache = False):
     if isinstance(target, str): self._targets = [target]
     else: self._targets = target
     
     self._follow_links = follow_links
+    self._validate = stem.descriptor._get_validation_level(validate)
+    self._deduplication_size = DEDUPLICATION_SIZE if deduplicate is True else deduplicate
+    self._duplicate_filter = DuplicateFilter(self._deduplication_size) if deduplicate else None
+    self._filter = filter
+    self._use_cache = use_cache
     self._persistence_path = persistence_path
     self._skip_listeners = []
     self._processed_files = {}
+    self._checkpoints = {}
+    
+    # Our processed files only have the second a file was modified, so we
+    # also note the precise modification time, size, and inode of the files
+    # that we've read. This way files rewritten within the same second are
+    # read again rather than skipped. Like our processed files these are
+    # dropped when the files are removed.
+    
+    self._read_stamps = {}
     
     self._reader_thread = None
     self._reader_thread_lock = threading.RLock()
+    self._watcher = None
     
     self._iter_lock = threading.RLock()
     self._iter_notice = threading.Event()
@@ -225,15 +688,24 @@ class DescriptorReader:
     self._is_stopped = threading.Event()
     self._is_stopped.set()
     
-    # Descriptors that we have read but not yet provided to the caller. A
-    # FINISHED entry is used by the reading thread to indicate the end.
+    # Lists of descriptors that we have read but not yet provided to the
+    # caller. A FINISHED entry is used by the reading thread to indicate the
+    # end. The buffer_size limits the number of descriptors across these
+    # lists, which is tracked by our buffered count.
     
-    self._unreturned_descriptors = Queue.Queue(buffer_size)
+    self._unreturned_descriptors = Queue.Queue()
+    self._buffer_size = buffer_size
+    self._batch_size = min(BATCH_SIZE, buffer_size) if buffer_size > 0 else BATCH_SIZE
+    self._pending_batch = []
+    self._buffered_count = 0
+    self._buffered_count_cond = threading.Condition()
     
     if self._persistence_path:
       try:
-        processed_files = load_processed_files(self._persistence_path)
+        processed_files, checkpoints, digests = load_processed_files(self._persistence_path, True, True)
         self.set_processed_files(processed_files)
+        self.set_checkpoints(checkpoints)
+        self.set_seen_digests(digests)
       except: pass
   
   def get_processed_files(self):
@@ -265,6 +737,61 @@ class DescriptorReader:
     
     self._processed_files = dict(processed_files)
   
+  def get_checkpoints(self):
+    """
+    Provides how far we've read into the files that tor appends descriptors to
+    (cached-descriptors and cached-extrainfo). This is a mapping of the form...
+    
+    ::
+    
+      absolute path (str) => (offset (int), inode (int), size (int))
+    
+    ... where the offset is the end of the last descriptor we read, and the
+    inode and size are of the file when we read it. If the file's later
+    replaced or shrinks then we read it from the start again.
+    
+    :returns: dict with the absolute paths and read checkpoints for appended files that we have processed
+    """
+    
+    return dict((os.path.abspath(k), v) for (k, v) in self._checkpoints.items())
+  
+  def set_checkpoints(self, checkpoints):
+    """
+    Sets how far we've read into the files that tor appends descriptors to.
+    This is commonly used with set_processed_files() to resume reading where a
+    prior run left off.
+    
+    :param dict checkpoints: mapping of absolute paths (str) to (offset, inode, size) tuples
+    """
+    
+    self._checkpoints = dict(checkpoints)
+  
+  def get_seen_digests(self):
+    """
+    Provides the digests of the descriptors we've read when deduplicating.
+    These are the most recently seen, up to the number that we remember.
+    
+    :returns: list of hex digests, least recently seen first, this is empty if we aren't deduplicating
+    """
+    
+    if self._duplicate_filter is not None:
+      return self._duplicate_filter.get_digests()
+    else:
+      return []
+  
+  def set_seen_digests(self, digests):
+    """
+    Sets the digests of descriptors we've read, so copies of them are skipped.
+    This does nothing if we aren't deduplicating.
+    
+    :param list digests: hex digests, least recently seen first
+    
+    :raises: TypeError if the digests are malformed
+    """
+    
+    if self._duplicate_filter is not None:
+      self._duplicate_filter = DuplicateFilter(self._deduplication_size, digests)
+  
   def register_skip_listener(self, listener):
     """
     Registers a listener for files that are skipped. This listener is expected
@@ -287,7 +814,7 @@ class DescriptorReader:
     :returns: int for the estimated number of currently enqueued descriptors, this is not entirely reliable
     """
     
-    return self._unreturned_descriptors.qsize()
+    return self._buffered_count
   
   def start(self):
     """
@@ -296,12 +823,42 @@ class DescriptorReader:
     :raises: ValueError if we're already reading the descriptor files
     """
     
+    self._start_thread(self._read_descriptor_files)
+  
+  def watch(self, poll_interval = 1):
+    """
+    Starts reading our descriptor files, and once we're done continues to
+    provide the descriptors of files that are added or changed until stop() is
+    called. Only files that change are read.
+    
+    Changes are detected via inotify if it's available (Linux), and otherwise
+    by checking the modification time of the files under our targets every
+    poll_interval seconds.
+    
+    :param int poll_interval: seconds between checks for changes if inotify is unavailable
+    
+    :raises: ValueError if we're already reading the descriptor files
+    """
+    
+    with self._reader_thread_lock:
+      if self._reader_thread:
+        raise ValueError("Already running, you need to call stop() first")
+      
+      try:
+        self._watcher = _InotifyWatcher()
+      except OSError, exc:
+        log.debug("Unable to use inotify to watch for descriptor changes, polling instead: %s" % exc)
+        self._watcher = _PollingWatcher(poll_interval)
+      
+      self._start_thread(self._watch_descriptor_files, (self._watcher,))
+  
+  def _start_thread(self, target, args = ()):
     with self._reader_thread_lock:
       if self._reader_thread:
         raise ValueError("Already running, you need to call stop() first")
       else:
         self._is_stopped.clear()
-        self._reader_thread = threading.Thread(target = self._read_descriptor_files, name="Descriptor Reader")
+        self._reader_thread = threading.Thread(target = target, args = args, name="Descriptor Reader")
         self._reader_thread.setDaemon(True)
         self._reader_thread.start()
   
@@ -314,23 +871,99 @@ class DescriptorReader:
       self._is_stopped.set()
       self._iter_notice.set()
       
-      # clears our queue to unblock enqueue calls
-      try:
-        while True:
-          self._unreturned_descriptors.get_nowait()
-      except Queue.Empty: pass
+      if self._watcher:
+        self._watcher.interrupt()
+        self._watcher = None
+      
+      # clears our queue and unblocks the reader thread if it's waiting for
+      # room in our buffer
       
-      self._reader_thread.join()
-      self._reader_thread = None
+      with self._buffered_count_cond:
+        try:
+          while True:
+            self._unreturned_descriptors.get_nowait()
+        except Queue.Empty: pass
+        
+        self._buffered_count = 0
+        self._buffered_count_cond.notify_all()
+      
+      if self._reader_thread:
+        self._reader_thread.join()
+        self._reader_thread = None
+        self._pending_batch = []
       
       if self._persistence_path:
         try:
           processed_files = self.get_processed_files()
-          save_processed_files(self._persistence_path, processed_files)
+          checkpoints = self.get_checkpoints()
+          digests = self.get_seen_digests()
+          save_processed_files(self._persistence_path, processed_files, checkpoints, digests)
         except: pass
   
   def _read_descriptor_files(self):
-    new_processed_files = {}
+    self._read_targets()
+    self._flush_batch()
+    
+    if not self._is_stopped.is_set():
+      self._unreturned_descriptors.put(FINISHED)
+    
+    self._iter_notice.set()
+  
+  def _watch_descriptor_files(self, watcher):
+    try:
+      # Watches are registered prior to reading our targets so we don't miss
+      # changes that are made while we're reading.
+      
+      file_targets, directory_targets = {}, []
+      
+      for target in self._targets:
+        if os.path.isdir(target):
+          directory_targets.append(os.path.join(os.path.normpath(target), ""))
+          
+          for root, _, _ in os.walk(target, followlinks = self._follow_links):
+            watcher.add(root)
+        else:
+          file_targets[os.path.normpath(target)] = target
+          target_dir = os.path.dirname(target)
+          if os.path.isdir(target_dir or "."): watcher.add(target_dir or ".")
+      
+      self._read_targets()
+      
+      # From here on we're updating our processed files and checkpoints in
+      # place rather than making new listings.
+      
+      while not self._is_stopped.is_set():
+        for path in watcher.get_changes():
+          if self._is_stopped.is_set(): break
+          normalized_path = os.path.normpath(path)
+          
+          if normalized_path in file_targets:
+            target = file_targets[normalized_path]
+            
+            if os.path.exists(target):
+              self._handle_file(target, self._processed_files, self._checkpoints)
+            else:
+              self._forget_file(target)
+          elif [d for d in directory_targets if normalized_path.startswith(d)]:
+            if os.path.isdir(path):
+              # new directory (or we lost track of events), read any files we
+              # haven't seen yet
+              
+              for root, _, files in os.walk(path, followlinks = self._follow_links):
+                watcher.add(root)
+                
+                for filename in files:
+                  self._handle_file(os.path.join(root, filename), self._processed_files, self._checkpoints)
+            elif os.path.isfile(path):
+              self._handle_file(path, self._processed_files, self._checkpoints)
+            elif not os.path.exists(path):
+              self._forget_file(path)
+    finally:
+      watcher.close()
+      self._iter_notice.set()
+  
+  def _read_targets(self):
+    new_processed_files, new_checkpoints = {}, {}
     remaining_files = list(self._targets)
     
     while remaining_files and not self._is_stopped.is_set():
@@ -342,105 +975,369 @@ class DescriptorReader:
       
       if os.path.isdir(target):
         # adds all of the files that it contains
-        for root, _, files in os.walk(target, followlinks = self._follow_links):
-          for filename in files:
-            self._handle_file(os.path.join(root, filename), new_processed_files)
-          
+        for path, path_stat in _iter_files(target, self._follow_links):
           # this can take a while if, say, we're including the root directory
           if self._is_stopped.is_set(): break
+          
+          self._handle_file(path, new_processed_files, new_checkpoints, path_stat)
       else:
-        self._handle_file(target, new_processed_files)
+        self._handle_file(target, new_processed_files, new_checkpoints)
     
     self._processed_files = new_processed_files
-    
-    if not self._is_stopped.is_set():
-      self._unreturned_descriptors.put(FINISHED)
-    
-    self._iter_notice.set()
+    self._checkpoints = new_checkpoints
+    self._read_stamps = dict((path, read_stamp) for (path, read_stamp) in self._read_stamps.items() if path in new_processed_files)
   
   def __iter__(self):
+    for batch in self.iter_batches():
+      for descriptor in batch:
+        yield descriptor
+  
+  def iter_batches(self, size = None):
+    """
+    Iterates over our descriptor data in lists rather than one at a time. This
+    is cheaper when processing a large number of descriptors.
+    
+    Lists contain up to the given number of descriptors, though we provide
+    smaller ones rather than wait when there's nothing more for us to read at
+    the moment. If a size isn't provided then we use the lists made by the
+    reader thread.
+    
+    :param int size: maximum number of descriptors in each list
+    
+    :returns: iterator for lists of descriptors
+    
+    :raises: ValueError if the size isn't positive
+    """
+    
+    if size is not None and size < 1:
+      raise ValueError("Batch size must be positive: %s" % size)
+    
     with self._iter_lock:
+      batch = []
+      
       while not self._is_stopped.is_set():
         try:
-          descriptor = self._unreturned_descriptors.get_nowait()
-          
-          if descriptor == FINISHED: break
-          else: yield descriptor
+          entry = self._unreturned_descriptors.get_nowait()
         except Queue.Empty:
-          self._iter_notice.wait()
-          self._iter_notice.clear()
+          if batch:
+            yield batch
+            batch = []
+          else:
+            self._iter_notice.wait()
+            self._iter_notice.clear()
+          
+          continue
+        
+        if entry == FINISHED:
+          if batch: yield batch
+          break
+        
+        with self._buffered_count_cond:
+          self._buffered_count = max(0, self._buffered_count - len(entry))
+          self._buffered_count_cond.notify_all()
+        
+        if size is None:
+          yield entry
+        else:
+          batch.extend(entry)
+          
+          while len(batch) >= size:
+            yield batch[:size]
+            batch = batch[size:]
   
-  def _handle_file(self, target, new_processed_files):
+  def _handle_file(self, target, new_processed_files, new_checkpoints, target_stat = None):
     # This is a file. Register its last modified timestamp and check if
-    # it's a file that we should skip.
+    # it's a file that we should skip. Our caller might already have its stat
+    # results from traversing the directory.
     
     try:
-      last_modified = int(os.stat(target).st_mtime)
+      if target_stat is None: target_stat = os.stat(target)
+      last_modified = int(target_stat.st_mtime)
       last_used = self._processed_files.get(target)
       new_processed_files[target] = last_modified
     except OSError, exc:
+      self._read_stamps.pop(target, None)
       self._notify_skip_listeners(target, ReadFailed(exc))
       return
     
-    if last_used and last_used >= last_modified:
+    # Checkpoints are discarded if the file has been replaced or truncated
+    # since we read it. Otherwise they're kept until we read further.
+    
+    checkpoint = self._checkpoints.get(target)
+    
+    if checkpoint:
+      _, inode, size = checkpoint
+      
+      if inode == target_stat.st_ino and size <= target_stat.st_size:
+        new_checkpoints[target] = checkpoint
+      else:
+        checkpoint = None
+        new_checkpoints.pop(target, None)
+    
+    read_stamp = (target_stat.st_mtime, target_stat.st_size, target_stat.st_ino)
+    is_changed = target in self._read_stamps and self._read_stamps[target] != read_stamp
+    
+    if last_used and last_used >= last_modified and not is_changed:
       self._notify_skip_listeners(target, AlreadyRead(last_modified, last_used))
       return
     
-    # The mimetypes module only checks the file extension. To actually
-    # check the content (like the 'file' command) we'd need something like
-    # pymagic (https://github.com/cloudburst/pymagic).
+    self._read_stamps[target] = read_stamp
+    
+    # Empty and special files have nothing for us to read, and reading them
+    # can block (like fifos and /proc/kmsg). Tor's appended files are simply
+    # empty until it has descriptors for them, but otherwise these aren't
+    # descriptor files.
+    
+    if target_stat.st_size == 0 or not stat.S_ISREG(target_stat.st_mode):
+      if stat.S_ISREG(target_stat.st_mode) and os.path.basename(target) in APPENDED_FILES:
+        return
+      
+      target_type = mimetypes.guess_type(target)
+      
+      if target_type[0] in (None, 'text/plain'):
+        self._notify_skip_listeners(target, UnrecognizedType(None))
+      else:
+        self._notify_skip_listeners(target, UnrecognizedType(target_type))
+      
+      return
     
-    target_type = mimetypes.guess_type(target)
+    try:
+      target_file = open(target)
+    except IOError, exc:
+      self._notify_skip_listeners(target, ReadFailed(exc))
+      return
     
-    # Checking if it's a tar file may fail due to permissions so failing back
-    # to the mime type...
-    # IOError: [Errno 13] Permission denied: '/vmlinuz.old'
+    # We open the file once, checking the magic numbers in its first few bytes
+    # to determine its type and then handing it to the parser. Only if that's
+    # inconclusive do we fall back to the file extension via mimetypes.
     
     try:
-      is_tar = tarfile.is_tarfile(target)
-    except IOError:
-      is_tar = target_type[0] == 'application/x-tar'
-    
-    if target_type[0] in (None, 'text/plain'):
-      # either '.txt' or an unknown type
-      self._handle_descriptor_file(target)
-    elif is_tar:
-      # handles gzip, bz2, and decompressed tarballs among others
-      self._handle_archive(target)
-    else:
-      self._notify_skip_listeners(target, UnrecognizedType(target_type))
+      try:
+        header = target_file.read(FILE_HEADER_SIZE)
+        target_file.seek(0)
+      except IOError, exc:
+        self._notify_skip_listeners(target, ReadFailed(exc))
+        return
+      
+      tar_magic_offset, tar_magic = TAR_MAGIC
+      
+      if header.startswith(stem.descriptor.cache.MAGIC):
+        # our own caches are read along with their archive
+        pass
+      elif header.startswith(COMPRESSION_MAGIC) or header[tar_magic_offset:tar_magic_offset + len(tar_magic)] == tar_magic:
+        # handles gzip, bz2, and decompressed tarballs among others
+        self._handle_archive(target, target_file)
+      elif header.startswith("@type "):
+        # metrics descriptor, annotated with its type
+        self._handle_descriptor_file(target, target_file, target_stat, checkpoint, new_checkpoints)
+      else:
+        target_type = mimetypes.guess_type(target)
+        
+        if target_type[0] in (None, 'text/plain'):
+          # either '.txt' or an unknown type
+          self._handle_descriptor_file(target, target_file, target_stat, checkpoint, new_checkpoints)
+        elif target_type[0] == 'application/x-tar':
+          # old tar formats lack the 'ustar' magic
+          self._handle_archive(target, target_file)
+        else:
+          self._notify_skip_listeners(target, UnrecognizedType(target_type))
+    finally:
+      target_file.close()
   
-  def _handle_descriptor_file(self, target):
+  def _forget_file(self, target):
+    """
+    Drops what we've recorded about a file that has been removed, so these
+    don't accumulate while we're watching files that come and go.
+    
+    :param str target: path of the file that was removed
+    """
+    
+    self._processed_files.pop(target, None)
+    self._checkpoints.pop(target, None)
+    self._read_stamps.pop(target, None)
+  
+  def _handle_descriptor_file(self, target, target_file, target_stat, checkpoint, new_checkpoints):
+    # For files that tor appends to we resume from the end of the last
+    # descriptor we read, checkpointing as we go.
+    
+    is_appended = os.path.basename(target) in APPENDED_FILES
+    content_filter = self._get_content_filter()
+    
     try:
-      with open(target) as target_file:
-        for desc in stem.descriptor.parse_file(target, target_file):
-          if self._is_stopped.is_set(): return
-          self._unreturned_descriptors.put(desc)
-          self._iter_notice.set()
+      if is_appended and checkpoint:
+        target_file.seek(checkpoint[0])
+      
+      for desc in stem.descriptor.parse_file(target, target_file, self._validate, content_filter):
+        if self._is_stopped.is_set(): return
+        self._enqueue_descriptor(desc)
+        
+        if is_appended:
+          new_checkpoints[target] = (target_file.tell(), target_stat.st_ino, target_stat.st_size)
+      
+      # descriptors that we skipped can follow the last one we provided
+      
+      if is_appended and content_filter and target_file.tell():
+        new_checkpoints[target] = (target_file.tell(), target_stat.st_ino, target_stat.st_size)
     except TypeError, exc:
       self._notify_skip_listeners(target, UnrecognizedType(None))
     except ValueError, exc:
       self._notify_skip_listeners(target, ParsingFailure(exc))
     except IOError, exc:
       self._notify_skip_listeners(target, ReadFailed(exc))
+    finally:
+      # provides the descriptors we read prior to any failure
+      self._flush_batch()
   
-  def _handle_archive(self, target):
+  def _handle_archive(self, target, target_file):
+    cache_path = target + CACHE_SUFFIX
+    
+    if self._use_cache and stem.descriptor.cache.is_current(cache_path, target):
+      if self._read_cache(target, cache_path): return
+    
+    # Caches are only written when we're fully validating since they're
+    # provided for any validation level. They need to have every descriptor
+    # so when writing one we filter after parsing rather than before.
+    
+    cache_file = None
+    content_filter = self._get_content_filter()
+    
+    if self._use_cache and self._validate == stem.descriptor.ValidationLevel.FULL:
+      try:
+        cache_file = open(cache_path + ".tmp", "wb")
+        stem.descriptor.cache.dump([], cache_file)
+      except IOError:
+        cache_file = None # unable to write a cache, maybe the directory is read-only
+    
+    is_cache_complete = False
+    
     try:
-      with tarfile.open(target) as tar_file:
+      # compressed files that aren't tarballs aren't something we can read
+      
+      try:
+        tar_file = tarfile.open(fileobj = target_file)
+      except tarfile.ReadError:
+        self._notify_skip_listeners(target, UnrecognizedType(mimetypes.guess_type(target)))
+        return
+      
+      with tar_file:
         for tar_entry in tar_file:
           if tar_entry.isfile():
             entry = tar_file.extractfile(tar_entry)
             
-            for desc in stem.descriptor.parse_file(target, entry):
+            for desc in stem.descriptor.parse_file(target, entry, self._validate, None if cache_file else content_filter):
               if self._is_stopped.is_set(): return
-              self._unreturned_descriptors.put(desc)
-              self._iter_notice.set()
+              
+              if cache_file:
+                cache_file.write(stem.descriptor.cache.serialize(desc))
+                if content_filter and not content_filter(str(desc)): continue
+              
+              self._enqueue_descriptor(desc)
             
             entry.close()
-    except TypeError, exc:
+      
+      is_cache_complete = True
+    except (TypeError, tarfile.TarError), exc:
       self._notify_skip_listeners(target, ParsingFailure(exc))
     except IOError, exc:
       self._notify_skip_listeners(target, ReadFailed(exc))
+    finally:
+      # provides the descriptors we read prior to any failure
+      self._flush_batch()
+      
+      if cache_file:
+        try:
+          cache_file.close()
+          
+          if is_cache_complete:
+            os.rename(cache_path + ".tmp", cache_path)
+          else:
+            os.remove(cache_path + ".tmp")
+        except (IOError, OSError), exc:
+          log.info("Unable to write a descriptor cache to %s: %s" % (cache_path, exc))
+  
+  def _read_cache(self, target, cache_path):
+    # Provides the descriptors from an archive's cache. If the cache can't be
+    # read before we've provided anything then this returns False so our
+    # caller can read the archive instead.
+    
+    content_filter = self._get_content_filter()
+    is_started = False
+    
+    try:
+      with open(cache_path, "rb") as cache_file:
+        for desc in stem.descriptor.cache.load(cache_file):
+          if self._is_stopped.is_set(): return True
+          is_started = True
+          
+          if content_filter and not content_filter(str(desc)): continue
+          self._enqueue_descriptor(desc)
+      
+      self._flush_batch()
+      return True
+    except (IOError, ValueError), exc:
+      if not is_started:
+        log.info("Unable to read the descriptor cache at %s, reading its archive instead: %s" % (cache_path, exc))
+        return False
+      
+      self._flush_batch()
+      self._notify_skip_listeners(target, ParsingFailure(exc))
+      return True
+  
+  def _get_content_filter(self):
+    # Functor for skipping descriptors prior to parsing them, this is None if
+    # we want all of them.
+    
+    if self._duplicate_filter is None and self._filter is None:
+      return None
+    else:
+      return self._is_wanted_content
+  
+  def _is_wanted_content(self, content):
+    # Filters first so descriptors that we don't want won't take space from
+    # the ones we're deduplicating.
+    
+    if self._filter is not None and not self._filter.is_content_match(content):
+      return False
+    elif self._duplicate_filter is not None and self._duplicate_filter.is_seen(content):
+      return False
+    else:
+      return True
+  
+  def _enqueue_descriptor(self, descriptor):
+    # only our filter's descriptor type might not have been checked prior to
+    # parsing, but checking the parsed descriptor is cheap
+    
+    if self._filter is not None and not self._filter.is_match(descriptor):
+      return
+    
+    # descriptors are only remembered once they've been parsed, so a malformed
+    # descriptor is read again if it's later fixed
+    
+    if self._duplicate_filter is not None:
+      self._duplicate_filter.add(str(descriptor))
+    
+    self._pending_batch.append(descriptor)
+    
+    if len(self._pending_batch) >= self._batch_size:
+      self._flush_batch()
+  
+  def _flush_batch(self):
+    # Provides the descriptors we've gathered to our caller, first waiting for
+    # room in our buffer if it's full.
+    
+    if not self._pending_batch: return
+    batch, self._pending_batch = self._pending_batch, []
+    
+    with self._buffered_count_cond:
+      while self._buffer_size > 0 and self._buffered_count + len(batch) > self._buffer_size:
+        if self._is_stopped.is_set(): return
+        self._buffered_count_cond.wait()
+      
+      if self._is_stopped.is_set(): return
+      self._buffered_count += len(batch)
+      self._unreturned_descriptors.put(batch)
+    
+    self._iter_notice.set()
   
   def _notify_skip_listeners(self, path, exception):
     for listener in self._skip_listeners:
@@ -453,3 +1350,191 @@ class DescriptorReader:
   def __exit__(self, exit_type, value, traceback):
     self.stop()
 
+def _iter_files(directory, follow_links):
+  """
+  Iterates over the files within a directory and its subdirectories, along
+  with their stat results. Each entry is only stat'ed once.
+  
+  :param str directory: directory to be iterated over
+  :param bool follow_links: determines if we'll follow symlinks to directories
+  
+  :returns: iterator of ``(path, stat result)`` tuples, the stat result is None if it can't be determined
+  """
+  
+  subdirectories = []
+  
+  try:
+    filenames = os.listdir(directory)
+  except OSError:
+    return
+  
+  for filename in filenames:
+    path = os.path.join(directory, filename)
+    
+    try:
+      entry_stat = os.lstat(path)
+      is_link = stat.S_ISLNK(entry_stat.st_mode)
+      if is_link: entry_stat = os.stat(path)
+    except OSError:
+      yield path, None # broken symlink or we lack permissions
+      continue
+    
+    if stat.S_ISDIR(entry_stat.st_mode):
+      if follow_links or not is_link:
+        subdirectories.append(path)
+    else:
+      yield path, entry_stat
+  
+  for subdirectory in subdirectories:
+    for entry in _iter_files(subdirectory, follow_links):
+      yield entry
+
+class _InotifyWatcher:
+  """
+  Notifies us of files that are written, moved, or removed in the directories
+  we're watching, using the Linux inotify API.
+  
+  :raises: OSError if inotify is unavailable
+  """
+  
+  def __init__(self):
+    try:
+      import ctypes
+      import ctypes.util
+      
+      self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno = True)
+      self._get_errno = ctypes.get_errno
+      inotify_fd = self._libc.inotify_init()
+    except (ImportError, OSError, AttributeError), exc:
+      raise OSError("inotify is unavailable: %s" % exc)
+    
+    if inotify_fd == -1:
+      error = self._get_errno()
+      raise OSError(error, os.strerror(error))
+    
+    self._inotify_fd = inotify_fd
+    self._interrupt_read, self._interrupt_write = os.pipe()
+    self._directories = {} # watch descriptor => directory path
+  
+  def add(self, path):
+    """
+    Watches a directory for files that are written, moved, or removed.
+    
+    :param str path: directory to be watched
+    """
+    
+    mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    watch_descriptor = self._libc.inotify_add_watch(self._inotify_fd, path, mask)
+    
+    if watch_descriptor == -1:
+      log.debug("Unable to watch %s for descriptor changes: %s" % (path, os.strerror(self._get_errno())))
+    else:
+      self._directories[watch_descriptor] = path
+  
+  def get_changes(self):
+    """
+    Blocks until there are changes or we're interrupted.
+    
+    :returns: list of the paths that were changed, if events were lost then this includes the directories we're watching so they can be checked
+    """
+    
+    try:
+      readable = select.select([self._inotify_fd, self._interrupt_read], [], [])[0]
+    except select.error, exc:
+      if exc.args[0] == errno.EINTR: return []
+      raise
+    
+    if not self._inotify_fd in readable: return []
+    
+    changes, content = [], os.read(self._inotify_fd, 65536)
+    
+    while content:
+      watch_descriptor, mask, _, name_length = INOTIFY_EVENT.unpack_from(content)
+      name = content[INOTIFY_EVENT.size:INOTIFY_EVENT.size + name_length].rstrip("\0")
+      content = content[INOTIFY_EVENT.size + name_length:]
+      
+      if mask & IN_Q_OVERFLOW:
+        changes += self._directories.values()
+      elif mask & IN_IGNORED:
+        self._directories.pop(watch_descriptor, None)
+      elif watch_descriptor in self._directories and name:
+        # files are read when they're closed rather than created
+        if mask & IN_CREATE and not mask & IN_ISDIR: continue
+        changes.append(os.path.join(self._directories[watch_descriptor], name))
+    
+    # dedupliates while retaining order
+    seen_changes = set()
+    return [path for path in changes if not (path in seen_changes or seen_changes.add(path))]
+  
+  def interrupt(self):
+    """
+    Wakes up get_changes() calls.
+    """
+    
+    try: os.write(self._interrupt_write, "x")
+    except OSError: pass # already closed
+  
+  def close(self):
+    for fd in (self._inotify_fd, self._interrupt_read, self._interrupt_write):
+      try: os.close(fd)
+      except OSError: pass
+
+class _PollingWatcher:
+  """
+  Portable alternative for the _InotifyWatcher that periodically checks the
+  modification time of files in the directories we're watching.
+  
+  :param int poll_interval: seconds between checks
+  """
+  
+  def __init__(self, poll_interval):
+    self._poll_interval = poll_interval
+    self._interrupted = threading.Event()
+    self._directories = {} # directory path => {file path => last modified}
+  
+  def add(self, path):
+    if not path in self._directories:
+      self._directories[path] = self._get_last_modified(path)
+  
+  def get_changes(self):
+    self._interrupted.wait(self._poll_interval)
+    if self._interrupted.is_set(): return []
+    
+    changes = []
+    
+    for directory, last_modified in self._directories.items():
+      current_last_modified = self._get_last_modified(directory)
+      
+      for path, timestamp in current_last_modified.items():
+        if not path in last_modified:
+          changes.append(path)
+        elif last_modified[path] != timestamp and not os.path.isdir(path):
+          changes.append(path) # directories are only of interest when they're new
+      
+      for path in last_modified:
+        if not path in current_last_modified:
+          changes.append(path) # removed
+      
+      self._directories[directory] = current_last_modified
+    
+    return changes
+  
+  def interrupt(self):
+    self._interrupted.set()
+  
+  def close(self):
+    pass
+  
+  def _get_last_modified(self, directory):
+    last_modified = {}
+    
+    try:
+      for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        
+        try: last_modified[path] = os.stat(path).st_mtime
+        except OSError: pass # removed while we were listing the directory
+    except OSError: pass # directory was removed or can't be read
+    
+    return last_modified
+
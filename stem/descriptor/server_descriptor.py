@@ -13,6 +13,9 @@ etc). This information is provided from a few sources...
 ::
 
   parse_file - Iterates over the server descriptors in a file.
+  get_digests - Iterates over the digests of the relay descriptors in a file.
+  verify_signatures - Checks the signatures of many relay descriptors.
+  
   ServerDescriptor - Tor server descriptor.
     |  |- RelayDescriptor - Server descriptor for a relay.
     |  |  +- is_valid - checks the signature against the descriptor content
@@ -30,10 +33,11 @@ etc). This information is provided from a few sources...
 import re
 import base64
 import hashlib
-import datetime
+import multiprocessing
 
 import stem.descriptor
 import stem.descriptor.extrainfo_descriptor
+import stem.exit_policy
 import stem.version
 import stem.util.log as log
 import stem.util.connection
@@ -74,18 +78,23 @@ SINGLE_FIELDS = (
   "allow-single-hop-exits",
 )
 
-def parse_file(descriptor_file, validate = True):
+PLATFORM_PATTERN = re.compile("^Tor (\S*).* on (.*)$")
+PROTOCOLS_PATTERN = re.compile("^Link (.*) Circuit (.*)$")
+
+def parse_file(descriptor_file, validate = True, content_filter = None):
   """
   Iterates over the server descriptors in a file. This can read either relay or
-  bridge server descriptors.
+  bridge server descriptors. Files that can be memory mapped are scanned for
+  descriptor boundaries rather than being read line by line.
   
   :param file descriptor_file: file with descriptor content
-  :param bool validate: checks the validity of the descriptor's content if True, skips these checks otherwise
+  :param bool,ValidationLevel validate: checks performed on the descriptor's content, True and False are aliases for FULL and NONE
+  :param functor content_filter: called with the content of each descriptor, descriptors are skipped without being parsed if this returns False
   
   :returns: iterator for ServerDescriptor instances in the file
   
   :raises:
-    * ValueError if the contents is malformed and validate is True
+    * ValueError if the contents is malformed and we're validating
     * IOError if the file can't be read
   """
   
@@ -114,6 +123,25 @@ def parse_file(descriptor_file, validate = True):
   #
   # Any annotations after the last server descriptor is ignored (never provided
   # to the caller).
+  #
+  # Regular files, such as the cached-descriptors, are memory mapped so we can
+  # find these boundaries without reading the file line by line.
+  
+  mapped_content = stem.descriptor._mmap_file(descriptor_file)
+  
+  if mapped_content:
+    try:
+      for annotation_start, start, end in stem.descriptor._get_descriptor_ranges(mapped_content, "router", "router-signature", descriptor_file.tell()):
+        annotations = map(str.strip, mapped_content[annotation_start:start].splitlines())
+        descriptor_text = mapped_content[start:end]
+        descriptor_file.seek(end)
+        
+        if content_filter and not content_filter(descriptor_text): continue
+        yield RelayDescriptor(descriptor_text, validate, annotations)
+    finally:
+      mapped_content.close()
+    
+    return
   
   while True:
     annotations = stem.descriptor._read_until_keyword("router", descriptor_file)
@@ -128,9 +156,365 @@ def parse_file(descriptor_file, validate = True):
       annotations = map(str.strip, annotations)
       
       descriptor_text = "".join(descriptor_content)
+      
+      if content_filter and not content_filter(descriptor_text): continue
       yield RelayDescriptor(descriptor_text, validate, annotations)
     else: break # done parsing descriptors
 
+def get_digests(descriptor_file):
+  """
+  Iterates over the digests of the relay server descriptors in a file. This is
+  far cheaper than parsing the descriptors to call their digest() method since
+  each descriptor is hashed where it resides in the file (memory mapped if
+  possible) rather than being copied out.
+  
+  :param file descriptor_file: file with relay descriptor content
+  
+  :returns: iterator for the str digest of each descriptor, as provided by :func:`stem.descriptor.server_descriptor.RelayDescriptor.digest`
+  
+  :raises: IOError if the file can't be read
+  """
+  
+  mapped_content = stem.descriptor._mmap_file(descriptor_file)
+  
+  if mapped_content:
+    content, offset = mapped_content, descriptor_file.tell()
+  else:
+    content, offset = descriptor_file.read(), 0
+  
+  try:
+    for _, start, end in stem.descriptor._get_descriptor_ranges(content, "router", "router-signature", offset):
+      yield base64.b64encode(_get_digest(content, start, end))
+  finally:
+    if mapped_content: mapped_content.close()
+
+def verify_signatures(descriptors, processes = 1):
+  """
+  Checks the signatures of a series of relay descriptors, as done by
+  :func:`stem.descriptor.server_descriptor.RelayDescriptor.is_valid`. This is
+  computationally expensive so with a large number of descriptors you might
+  want to spread the work over multiple processes.
+  
+  :param list descriptors: RelayDescriptor instances to be checked
+  :param int processes: number of processes to check the signatures with, this is done in our own process if one
+  
+  :returns: list of booleans for if each descriptor's signature matches its content
+  
+  :raises: ImportError if the rsa module is unavailable
+  """
+  
+  if not IS_RSA_AVAILABLE:
+    raise ImportError("Checking descriptor signatures requires the rsa module")
+  
+  # Only the parts of the descriptors that we need are passed to the pool
+  # since descriptors themselves are comparatively expensive to pickle.
+  
+  signed_content = []
+  
+  for desc in descriptors:
+    signed_content.append((desc.signing_key, desc.signature, base64.b64decode(desc.digest())))
+  
+  if processes > 1 and len(signed_content) > 1:
+    pool = multiprocessing.Pool(processes)
+    
+    try:
+      return pool.map(_verify_signature, signed_content)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    return map(_verify_signature, signed_content)
+
+def _get_digest(content, start = 0, end = None):
+  """
+  Provides the sha1 of a relay descriptor's signed content, which runs from its
+  'router' line through its 'router-signature' line. This is hashed in place,
+  without copying the content.
+  
+  :param str,mmap content: content with the descriptor
+  :param int start: position where the descriptor begins
+  :param int end: position where the descriptor ends, the end of the content if None
+  
+  :returns: str with the sha1 digest bytes
+  """
+  
+  if end is None: end = len(content)
+  
+  ending = "\nrouter-signature\n"
+  signed_end = content.find(ending, start, end)
+  signed_end = signed_end + len(ending) if signed_end != -1 else end
+  
+  return hashlib.sha1(buffer(content, start, signed_end - start)).digest()
+
+def _verify_signature(signed_content):
+  """
+  Checks that a signature is our signing key's PKCS#1 signature of a digest.
+  Tor signs the digest itself rather than a DER encoded DigestInfo, so this
+  can't be checked via rsa.verify().
+  
+  :param tuple signed_content: (signing key, signature, digest) for a descriptor
+  
+  :returns: True if the signature matches the digest, False otherwise
+  """
+  
+  signing_key, signature, digest = signed_content
+  
+  # without validation we may be missing our key or signature
+  if not signing_key or not signature: return False
+  
+  try:
+    public_key = rsa.PublicKey.load_pkcs1(signing_key)
+    
+    # base64 encoded bytes of our signature without newlines nor the
+    # "-----[BEGIN|END] SIGNATURE-----" header/footer
+    
+    sig_content = "".join(signature.splitlines()[1:-1])
+    sig_bytes = base64.b64decode(sig_content)
+  except Exception:
+    return False
+  
+  # Decrypts the signature with the signing key, which should provide the
+  # digest with PKCS#1 padding (0x00 0x01 0xFF... 0x00 <digest>).
+  
+  key_length = (public_key.n.bit_length() + 7) / 8
+  decrypted = pow(int(sig_bytes.encode("hex") or "0", 16), public_key.e, public_key.n)
+  decrypted_bytes = ("%0*x" % (key_length * 2, decrypted)).decode("hex")
+  
+  padding_length = key_length - len(digest) - 3
+  expected_bytes = "\x00\x01" + "\xff" * padding_length + "\x00" + digest
+  
+  return decrypted_bytes == expected_bytes
+
+# Parsers for the lines of server descriptors. These are called via
+# stem.descriptor._parse_entries() with the descriptor, the line's keyword,
+# its (value, pgp block) tuples, the original line, and if we're validating.
+
+def _parse_router_line(descriptor, keyword, values, line, validate):
+  # "router" nickname address ORPort SocksPort DirPort
+  router_comp = values[0][0].split()
+  
+  if len(router_comp) < 5:
+    if not validate: return
+    raise ValueError("Router line must have five values: %s" % line)
+  
+  if validate:
+    if not stem.util.tor_tools.is_valid_nickname(router_comp[0]):
+      raise ValueError("Router line entry isn't a valid nickname: %s" % router_comp[0])
+    elif not stem.util.connection.is_valid_ip_address(router_comp[1]):
+      raise ValueError("Router line entry isn't a valid IPv4 address: %s" % router_comp[1])
+    elif not stem.util.connection.is_valid_port(router_comp[2], allow_zero = True):
+      raise ValueError("Router line's ORPort is invalid: %s" % router_comp[2])
+    elif not stem.util.connection.is_valid_port(router_comp[3], allow_zero = True):
+      raise ValueError("Router line's SocksPort is invalid: %s" % router_comp[3])
+    elif not stem.util.connection.is_valid_port(router_comp[4], allow_zero = True):
+      raise ValueError("Router line's DirPort is invalid: %s" % router_comp[4])
+  elif not (router_comp[2].isdigit() and router_comp[3].isdigit() and router_comp[4].isdigit()):
+    return
+  
+  descriptor.nickname   = router_comp[0]
+  descriptor.address    = router_comp[1]
+  descriptor.or_port    = int(router_comp[2])
+  descriptor.socks_port = int(router_comp[3])
+  descriptor.dir_port   = int(router_comp[4])
+
+def _parse_bandwidth_line(descriptor, keyword, values, line, validate):
+  # "bandwidth" bandwidth-avg bandwidth-burst bandwidth-observed
+  bandwidth_comp = values[0][0].split()
+  
+  if len(bandwidth_comp) < 3:
+    if not validate: return
+    raise ValueError("Bandwidth line must have three values: %s" % line)
+  
+  if not bandwidth_comp[0].isdigit():
+    if not validate: return
+    raise ValueError("Bandwidth line's average rate isn't numeric: %s" % bandwidth_comp[0])
+  elif not bandwidth_comp[1].isdigit():
+    if not validate: return
+    raise ValueError("Bandwidth line's burst rate isn't numeric: %s" % bandwidth_comp[1])
+  elif not bandwidth_comp[2].isdigit():
+    if not validate: return
+    raise ValueError("Bandwidth line's observed rate isn't numeric: %s" % bandwidth_comp[2])
+  
+  descriptor.average_bandwidth  = int(bandwidth_comp[0])
+  descriptor.burst_bandwidth    = int(bandwidth_comp[1])
+  descriptor.observed_bandwidth = int(bandwidth_comp[2])
+
+def _parse_platform_line(descriptor, keyword, values, line, validate):
+  # "platform" string
+  
+  descriptor.platform = values[0][0]
+  
+  # This line can contain any arbitrary data, but tor seems to report its
+  # version followed by the os like the following...
+  # platform Tor 0.2.2.35 (git-73ff13ab3cc9570d) on Linux x86_64
+  #
+  # There's no guarantee that we'll be able to pick these out the
+  # version, but might as well try to save our caller the effot.
+  
+  platform_match = PLATFORM_PATTERN.match(descriptor.platform)
+  
+  if platform_match:
+    version_str, descriptor.operating_system = platform_match.groups()
+    
+    try:
+      descriptor.tor_version = stem.version.Version(version_str)
+    except ValueError: pass
+
+def _parse_published_line(descriptor, keyword, values, line, validate):
+  # "published" YYYY-MM-DD HH:MM:SS
+  
+  try:
+    descriptor.published = stem.descriptor._parse_timestamp(values[0][0])
+  except ValueError:
+    if validate:
+      raise ValueError("Published line's time wasn't parseable: %s" % line)
+
+def _parse_fingerprint_line(descriptor, keyword, values, line, validate):
+  # This is fourty hex digits split into space separated groups of four.
+  # Checking that we match this pattern.
+  
+  value = values[0][0]
+  fingerprint = value.replace(" ", "")
+  
+  if validate:
+    for grouping in value.split(" "):
+      if len(grouping) != 4:
+        raise ValueError("Fingerprint line should have groupings of four hex digits: %s" % value)
+    
+    if not stem.util.tor_tools.is_valid_fingerprint(fingerprint):
+      raise ValueError("Tor relay fingerprints consist of fourty hex digits: %s" % value)
+  
+  descriptor.fingerprint = fingerprint
+
+def _parse_hibernating_line(descriptor, keyword, values, line, validate):
+  # "hibernating" 0|1 (in practice only set if one)
+  
+  value = values[0][0]
+  
+  if validate and not value in ("0", "1"):
+    raise ValueError("Hibernating line had an invalid value, must be zero or one: %s" % value)
+  
+  descriptor.hibernating = value == "1"
+
+def _parse_allow_single_hop_exits_line(descriptor, keyword, values, line, validate):
+  descriptor.allow_single_hop_exits = True
+
+def _parse_caches_extra_info_line(descriptor, keyword, values, line, validate):
+  descriptor.extra_info_cache = True
+
+def _parse_extra_info_digest_line(descriptor, keyword, values, line, validate):
+  # this is fourty hex digits which just so happens to be the same a
+  # fingerprint
+  
+  value = values[0][0]
+  
+  if validate and not stem.util.tor_tools.is_valid_fingerprint(value):
+    raise ValueError("Extra-info digests should consist of fourty hex digits: %s" % value)
+  
+  descriptor.extra_info_digest = value
+
+def _parse_hidden_service_dir_line(descriptor, keyword, values, line, validate):
+  value = values[0][0]
+  
+  if value:
+    descriptor.hidden_service_dir = value.split(" ")
+  else:
+    descriptor.hidden_service_dir = ["2"]
+
+def _parse_uptime_line(descriptor, keyword, values, line, validate):
+  # We need to be tolerant of negative uptimes to accomidate a past tor
+  # bug...
+  #
+  # Changes in version 0.1.2.7-alpha - 2007-02-06
+  #  - If our system clock jumps back in time, don't publish a negative
+  #    uptime in the descriptor. Also, don't let the global rate limiting
+  #    buckets go absurdly negative.
+  #
+  # After parsing all of the attributes we'll double check that negative
+  # uptimes only occured prior to this fix.
+  
+  value = values[0][0]
+  
+  try:
+    descriptor.uptime = int(value)
+  except ValueError:
+    if not validate: return
+    raise ValueError("Uptime line must have an integer value: %s" % value)
+
+def _parse_contact_line(descriptor, keyword, values, line, validate):
+  descriptor.contact = values[0][0]
+
+def _parse_protocols_line(descriptor, keyword, values, line, validate):
+  protocols_match = PROTOCOLS_PATTERN.match(values[0][0])
+  
+  if protocols_match:
+    link_versions, circuit_versions = protocols_match.groups()
+    descriptor.link_protocols = link_versions.split(" ")
+    descriptor.circuit_protocols = circuit_versions.split(" ")
+  elif validate:
+    raise ValueError("Protocols line did not match the expected pattern: %s" % line)
+
+def _parse_family_line(descriptor, keyword, values, line, validate):
+  descriptor.family = values[0][0].split(" ")
+
+def _parse_eventdns_line(descriptor, keyword, values, line, validate):
+  descriptor.eventdns = values[0][0] == "1"
+
+def _parse_key_line(descriptor, keyword, values, line, validate):
+  # "onion-key", "signing-key", or "router-signature" followed by a block
+  
+  block_contents = values[0][1]
+  
+  if validate and not block_contents:
+    if keyword == "router-signature":
+      raise ValueError("Router signature line must be followed by a signature block: %s" % line)
+    elif keyword == "onion-key":
+      raise ValueError("Onion key line must be followed by a public key: %s" % line)
+    else:
+      raise ValueError("Signing key line must be followed by a public key: %s" % line)
+  
+  if keyword == "onion-key":
+    descriptor.onion_key = block_contents
+  elif keyword == "signing-key":
+    descriptor.signing_key = block_contents
+  else:
+    descriptor.signature = block_contents
+
+def _parse_router_digest_line(descriptor, keyword, values, line, validate):
+  value = values[0][0]
+  
+  if validate and not stem.descriptor.SHA1_HEX.match(value):
+    raise ValueError("Router digest line had an invalid sha1 digest: %s" % line)
+  
+  descriptor._digest = value
+
+def _parse_or_address_line(descriptor, keyword, values, line, validate):
+  or_address_entries = [value for (value, _) in values]
+  
+  for entry in or_address_entries:
+    line = "%s %s" % (keyword, entry)
+    
+    if not ":" in entry:
+      if not validate: continue
+      else: raise ValueError("or-address line missing a colon: %s" % line)
+    
+    div = entry.rfind(":")
+    address, ports = entry[:div], entry[div+1:]
+    is_ipv6 = address.startswith("[") and address.endswith("]")
+    if is_ipv6: address = address[1:-1] # remove brackets
+    
+    if not ((not is_ipv6 and stem.util.connection.is_valid_ip_address(address)) or
+           (is_ipv6 and stem.util.connection.is_valid_ipv6_address(address))):
+      if not validate: continue
+      else: raise ValueError("or-address line has a malformed address: %s" % line)
+    
+    for port in ports.split(","):
+      if not stem.util.connection.is_valid_port(port):
+        if not validate: break
+        else: raise ValueError("or-address line has malformed ports: %s" % line)
+      
+      descriptor.address_alt.append((address, int(port), is_ipv6))
+
 class ServerDescriptor(stem.descriptor.Descriptor):
   """
   Common parent for server descriptors.
@@ -168,15 +552,38 @@ class ServerDescriptor(stem.descriptor.Descriptor):
   
   :var datetime read_history_end: end of the sampling interval
   :var int read_history_interval: seconds per interval
-  :var list read_history_values: bytes read during each interval
+  :var array read_history_values: bytes read during each interval
   
   :var datetime write_history_end: end of the sampling interval
   :var int write_history_interval: seconds per interval
-  :var list write_history_values: bytes written during each interval
+  :var array write_history_values: bytes written during each interval
   
   **\*** attribute is either required when we're parsed with validation or has a default value, others are left as None if undefined
   """
   
+  # Parsers for the lines we recognize. Subclasses extend this with the lines
+  # particular to them.
+  
+  _PARSER_FOR_KEYWORD = {
+    "router": _parse_router_line,
+    "bandwidth": _parse_bandwidth_line,
+    "platform": _parse_platform_line,
+    "published": _parse_published_line,
+    "fingerprint": _parse_fingerprint_line,
+    "hibernating": _parse_hibernating_line,
+    "allow-single-hop-exits": _parse_allow_single_hop_exits_line,
+    "caches-extra-info": _parse_caches_extra_info_line,
+    "extra-info-digest": _parse_extra_info_digest_line,
+    "hidden-service-dir": _parse_hidden_service_dir_line,
+    "uptime": _parse_uptime_line,
+    "contact": _parse_contact_line,
+    "protocols": _parse_protocols_line,
+    "family": _parse_family_line,
+    "eventdns": _parse_eventdns_line,
+    "read-history": stem.descriptor.extrainfo_descriptor._parse_history_line,
+    "write-history": stem.descriptor.extrainfo_descriptor._parse_history_line,
+  }
+  
   def __init__(self, raw_contents, validate = True, annotations = None):
     """
     Server descriptor constructor, created from an individual relay's
@@ -185,13 +592,14 @@ class ServerDescriptor(stem.descriptor.Descriptor):
     
     By default this validates the descriptor's content as it's parsed. This
     validation can be disables to either improve performance or be accepting of
-    malformed data.
+    malformed data. Checking only the descriptor's STRUCTURE skips the bulk of
+    this cost while still catching truncated content.
     
     :param str raw_contents: descriptor content provided by the relay
-    :param bool validate: checks the validity of the descriptor's content if True, skips these checks otherwise
+    :param bool,ValidationLevel validate: checks performed on the descriptor's content, True and False are aliases for FULL and NONE
     :param list annotations: lines that appeared prior to the descriptor
     
-    :raises: ValueError if the contents is malformed and validate is True
+    :raises: ValueError if the contents is malformed and we're validating
     """
     
     stem.descriptor.Descriptor.__init__(self, raw_contents)
@@ -210,7 +618,7 @@ class ServerDescriptor(stem.descriptor.Descriptor):
     self.operating_system = None
     self.uptime = None
     self.contact = None
-    self.exit_policy = [] # should be an ExitPolicy instance when we have the class...
+    self.exit_policy = None
     self.family = []
     
     self.average_bandwidth = None
@@ -247,10 +655,26 @@ class ServerDescriptor(stem.descriptor.Descriptor):
     # influences the resulting exit policy, but for everything else the order
     # does not matter so breaking it into key / value pairs.
     
-    entries, first_keyword, last_keyword, self.exit_policy = \
-      stem.descriptor._get_descriptor_components(raw_contents, validate, ("accept", "reject"))
+    validation_level = stem.descriptor._get_validation_level(validate)
+    validate = validation_level == stem.descriptor.ValidationLevel.FULL
+    check_structure = validation_level != stem.descriptor.ValidationLevel.NONE
+    
+    entries, first_keyword, last_keyword, policy = \
+      stem.descriptor._get_descriptor_components(raw_contents, check_structure, ("accept", "reject"))
+    
+    policy_rules = []
+    
+    for rule in policy:
+      try:
+        policy_rules.append(stem.exit_policy.ExitPolicyRule(rule))
+      except ValueError:
+        if validate: raise
+        self._unrecognized_lines.append(rule)
+    
+    self.exit_policy = stem.exit_policy.ExitPolicy(*policy_rules)
+    
     self._parse(entries, validate)
-    if validate: self._check_constraints(entries, first_keyword, last_keyword)
+    if check_structure: self._check_constraints(entries, first_keyword, last_keyword)
   
   def digest(self):
     """
@@ -317,185 +741,7 @@ class ServerDescriptor(stem.descriptor.Descriptor):
     :raises: ValueError if an error occures in validation
     """
     
-    for keyword, values in entries.items():
-      # most just work with the first (and only) value
-      value, block_contents = values[0]
-      
-      line = "%s %s" % (keyword, value) # original line
-      if block_contents: line += "\n%s" % block_contents
-      
-      if keyword == "router":
-        # "router" nickname address ORPort SocksPort DirPort
-        router_comp = value.split()
-        
-        if len(router_comp) < 5:
-          if not validate: continue
-          raise ValueError("Router line must have five values: %s" % line)
-        
-        if validate:
-          if not stem.util.tor_tools.is_valid_nickname(router_comp[0]):
-            raise ValueError("Router line entry isn't a valid nickname: %s" % router_comp[0])
-          elif not stem.util.connection.is_valid_ip_address(router_comp[1]):
-            raise ValueError("Router line entry isn't a valid IPv4 address: %s" % router_comp[1])
-          elif not stem.util.connection.is_valid_port(router_comp[2], allow_zero = True):
-            raise ValueError("Router line's ORPort is invalid: %s" % router_comp[2])
-          elif not stem.util.connection.is_valid_port(router_comp[3], allow_zero = True):
-            raise ValueError("Router line's SocksPort is invalid: %s" % router_comp[3])
-          elif not stem.util.connection.is_valid_port(router_comp[4], allow_zero = True):
-            raise ValueError("Router line's DirPort is invalid: %s" % router_comp[4])
-        elif not (router_comp[2].isdigit() and router_comp[3].isdigit() and router_comp[4].isdigit()):
-          continue
-        
-        self.nickname   = router_comp[0]
-        self.address    = router_comp[1]
-        self.or_port    = int(router_comp[2])
-        self.socks_port = int(router_comp[3])
-        self.dir_port   = int(router_comp[4])
-      elif keyword == "bandwidth":
-        # "bandwidth" bandwidth-avg bandwidth-burst bandwidth-observed
-        bandwidth_comp = value.split()
-        
-        if len(bandwidth_comp) < 3:
-          if not validate: continue
-          raise ValueError("Bandwidth line must have three values: %s" % line)
-        
-        if not bandwidth_comp[0].isdigit():
-          if not validate: continue
-          raise ValueError("Bandwidth line's average rate isn't numeric: %s" % bandwidth_comp[0])
-        elif not bandwidth_comp[1].isdigit():
-          if not validate: continue
-          raise ValueError("Bandwidth line's burst rate isn't numeric: %s" % bandwidth_comp[1])
-        elif not bandwidth_comp[2].isdigit():
-          if not validate: continue
-          raise ValueError("Bandwidth line's observed rate isn't numeric: %s" % bandwidth_comp[2])
-        
-        self.average_bandwidth  = int(bandwidth_comp[0])
-        self.burst_bandwidth    = int(bandwidth_comp[1])
-        self.observed_bandwidth = int(bandwidth_comp[2])
-      elif keyword == "platform":
-        # "platform" string
-        
-        self.platform = value
-        
-        # This line can contain any arbitrary data, but tor seems to report its
-        # version followed by the os like the following...
-        # platform Tor 0.2.2.35 (git-73ff13ab3cc9570d) on Linux x86_64
-        #
-        # There's no guarantee that we'll be able to pick these out the
-        # version, but might as well try to save our caller the effot.
-        
-        platform_match = re.match("^Tor (\S*).* on (.*)$", self.platform)
-        
-        if platform_match:
-          version_str, self.operating_system = platform_match.groups()
-          
-          try:
-            self.tor_version = stem.version.Version(version_str)
-          except ValueError: pass
-      elif keyword == "published":
-        # "published" YYYY-MM-DD HH:MM:SS
-        
-        try:
-          self.published = datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
-        except ValueError:
-          if validate:
-            raise ValueError("Published line's time wasn't parseable: %s" % line)
-      elif keyword == "fingerprint":
-        # This is fourty hex digits split into space separated groups of four.
-        # Checking that we match this pattern.
-        
-        fingerprint = value.replace(" ", "")
-        
-        if validate:
-          for grouping in value.split(" "):
-            if len(grouping) != 4:
-              raise ValueError("Fingerprint line should have groupings of four hex digits: %s" % value)
-          
-          if not stem.util.tor_tools.is_valid_fingerprint(fingerprint):
-            raise ValueError("Tor relay fingerprints consist of fourty hex digits: %s" % value)
-        
-        self.fingerprint = fingerprint
-      elif keyword == "hibernating":
-        # "hibernating" 0|1 (in practice only set if one)
-        
-        if validate and not value in ("0", "1"):
-          raise ValueError("Hibernating line had an invalid value, must be zero or one: %s" % value)
-        
-        self.hibernating = value == "1"
-      elif keyword == "allow-single-hop-exits":
-        self.allow_single_hop_exits = True
-      elif keyword == "caches-extra-info":
-        self.extra_info_cache = True
-      elif keyword == "extra-info-digest":
-        # this is fourty hex digits which just so happens to be the same a
-        # fingerprint
-        
-        if validate and not stem.util.tor_tools.is_valid_fingerprint(value):
-          raise ValueError("Extra-info digests should consist of fourty hex digits: %s" % value)
-        
-        self.extra_info_digest = value
-      elif keyword == "hidden-service-dir":
-        if value:
-          self.hidden_service_dir = value.split(" ")
-        else:
-          self.hidden_service_dir = ["2"]
-      elif keyword == "uptime":
-        # We need to be tolerant of negative uptimes to accomidate a past tor
-        # bug...
-        # 
-        # Changes in version 0.1.2.7-alpha - 2007-02-06
-        #  - If our system clock jumps back in time, don't publish a negative
-        #    uptime in the descriptor. Also, don't let the global rate limiting
-        #    buckets go absurdly negative.
-        #
-        # After parsing all of the attributes we'll double check that negative
-        # uptimes only occured prior to this fix.
-        
-        try:
-          self.uptime = int(value)
-        except ValueError:
-          if not validate: continue
-          raise ValueError("Uptime line must have an integer value: %s" % value)
-      elif keyword == "contact":
-        self.contact = value
-      elif keyword == "protocols":
-        protocols_match = re.match("^Link (.*) Circuit (.*)$", value)
-        
-        if protocols_match:
-          link_versions, circuit_versions = protocols_match.groups()
-          self.link_protocols = link_versions.split(" ")
-          self.circuit_protocols = circuit_versions.split(" ")
-        elif validate:
-          raise ValueError("Protocols line did not match the expected pattern: %s" % line)
-      elif keyword == "family":
-        self.family = value.split(" ")
-      elif keyword == "eventdns":
-        self.eventdns = value == "1"
-      elif keyword in ("read-history", "write-history"):
-        try:
-          timestamp, interval, remainder = \
-            stem.descriptor.extrainfo_descriptor._parse_timestamp_and_interval(keyword, value)
-          
-          try:
-            if remainder:
-              history_values = [int(entry) for entry in remainder.split(",")]
-            else:
-              history_values = []
-          except ValueError:
-            raise ValueError("%s line has non-numeric values: %s" % (keyword, line))
-          
-          if keyword == "read-history":
-            self.read_history_end = timestamp
-            self.read_history_interval = interval
-            self.read_history_values = history_values
-          else:
-            self.write_history_end = timestamp
-            self.write_history_interval = interval
-            self.write_history_values = history_values
-        except ValueError, exc:
-          if validate: raise exc
-      else:
-        self._unrecognized_lines.append(line)
+    stem.descriptor._parse_entries(self, entries, validate, self._PARSER_FOR_KEYWORD)
     
     # if we have a negative uptime and a tor version that shouldn't exhibit
     # this bug then fail validation
@@ -558,6 +804,12 @@ class RelayDescriptor(ServerDescriptor):
   **\*** attribute is either required when we're parsed with validation or has a default value, others are left as None if undefined
   """
   
+  _PARSER_FOR_KEYWORD = dict(ServerDescriptor._PARSER_FOR_KEYWORD.items() + [
+    ("onion-key", _parse_key_line),
+    ("signing-key", _parse_key_line),
+    ("router-signature", _parse_key_line),
+  ])
+  
   def __init__(self, raw_contents, validate = True, annotations = None):
     self.onion_key = None
     self.signing_key = None
@@ -569,6 +821,8 @@ class RelayDescriptor(ServerDescriptor):
     # if we have a fingerprint then checks that our fingerprint is a hash of
     # our signing key
     
+    validate = stem.descriptor._get_validation_level(validate) == stem.descriptor.ValidationLevel.FULL
+    
     if IS_RSA_AVAILABLE and validate and self.fingerprint:
       pubkey = rsa.PublicKey.load_pkcs1(self.signing_key)
       der_encoded = pubkey.save_pkcs1(format = "DER")
@@ -579,68 +833,26 @@ class RelayDescriptor(ServerDescriptor):
   
   def is_valid(self):
     """
-    Validates that our content matches our signature.
+    Validates that our content matches our signature. To check many
+    descriptors use :func:`stem.descriptor.server_descriptor.verify_signatures`
+    instead.
     
     :returns: True if our signature matches our content, False otherwise
-    """
-    
-    raise NotImplementedError # TODO: finish implementing
-    
-    # without validation we may be missing our signature
-    if not self.signature: return False
-    
-    # gets base64 encoded bytes of our signature without newlines nor the
-    # "-----[BEGIN|END] SIGNATURE-----" header/footer
-    
-    sig_content = self.signature.replace("\n", "")[25:-23]
-    sig_bytes = base64.b64decode(sig_content)
     
-    # TODO: Decrypt the signature bytes with the signing key and remove
-    # the PKCS1 padding to get the original message, and encode the message
-    # in hex and compare it to the digest of the descriptor.
+    :raises: ImportError if the rsa module is unavailable
+    """
     
-    return True
+    return verify_signatures([self])[0]
   
   def digest(self):
     if self._digest is None:
-      # our digest is calculated from everything except our signature
-      raw_content, ending = str(self), "\nrouter-signature\n"
-      raw_content = raw_content[:raw_content.find(ending) + len(ending)]
+      # our digest is calculated from everything except our signature, and
+      # is only done once since our content doesn't change
       
-      digest_sha1 = hashlib.sha1(raw_content).digest()
-      self._digest = base64.b64encode(digest_sha1)
+      self._digest = base64.b64encode(_get_digest(str(self)))
     
     return self._digest
   
-  def _parse(self, entries, validate):
-    entries = dict(entries) # shallow copy since we're destructive
-    
-    # handles fields only in server descriptors
-    for keyword, values in entries.items():
-      value, block_contents = values[0]
-      line = "%s %s" % (keyword, value)
-      
-      if keyword == "onion-key":
-        if validate and not block_contents:
-          raise ValueError("Onion key line must be followed by a public key: %s" % line)
-        
-        self.onion_key = block_contents
-        del entries["onion-key"]
-      elif keyword == "signing-key":
-        if validate and not block_contents:
-          raise ValueError("Signing key line must be followed by a public key: %s" % line)
-        
-        self.signing_key = block_contents
-        del entries["signing-key"]
-      elif keyword == "router-signature":
-        if validate and not block_contents:
-          raise ValueError("Router signature line must be followed by a signature block: %s" % line)
-        
-        self.signature = block_contents
-        del entries["router-signature"]
-    
-    ServerDescriptor._parse(self, entries, validate)
-  
   def _required_fields(self):
     return REQUIRED_FIELDS
   
@@ -660,6 +872,11 @@ class BridgeDescriptor(ServerDescriptor):
   :var list address_alt: alternative for our address/or_port attributes, each entry is a tuple of the form ``(address (str), port (int), is_ipv6 (bool))``
   """
   
+  _PARSER_FOR_KEYWORD = dict(ServerDescriptor._PARSER_FOR_KEYWORD.items() + [
+    ("router-digest", _parse_router_digest_line),
+    ("or-address", _parse_or_address_line),
+  ])
+  
   def __init__(self, raw_contents, validate = True, annotations = None):
     self.address_alt = []
     self._digest = None
@@ -669,51 +886,6 @@ class BridgeDescriptor(ServerDescriptor):
   def digest(self):
     return self._digest
   
-  def _parse(self, entries, validate):
-    entries = dict(entries)
-    
-    # handles fields only in bridge descriptors
-    for keyword, values in entries.items():
-      value, block_contents = values[0]
-      line = "%s %s" % (keyword, value)
-      
-      if keyword == "router-digest":
-        if validate and not re.match("^[0-9a-fA-F]{40}$", value):
-          raise ValueError("Router digest line had an invalid sha1 digest: %s" % line)
-        
-        self._digest = value
-        del entries["router-digest"]
-      elif keyword == "or-address":
-        or_address_entries = [value for (value, _) in values]
-        
-        for entry in or_address_entries:
-          line = "%s %s" % (keyword, entry)
-          
-          if not ":" in entry:
-            if not validate: continue
-            else: raise ValueError("or-address line missing a colon: %s" % line)
-          
-          div = entry.rfind(":")
-          address, ports = entry[:div], entry[div+1:]
-          is_ipv6 = address.startswith("[") and address.endswith("]")
-          if is_ipv6: address = address[1:-1] # remove brackets
-          
-          if not ((not is_ipv6 and stem.util.connection.is_valid_ip_address(address)) or
-                 (is_ipv6 and stem.util.connection.is_valid_ipv6_address(address))):
-            if not validate: continue
-            else: raise ValueError("or-address line has a malformed address: %s" % line)
-          
-          for port in ports.split(","):
-            if not stem.util.connection.is_valid_port(port):
-              if not validate: break
-              else: raise ValueError("or-address line has malformed ports: %s" % line)
-            
-            self.address_alt.append((address, int(port), is_ipv6))
-        
-        del entries["or-address"]
-    
-    ServerDescriptor._parse(self, entries, validate)
-  
   def is_scrubbed(self):
     """
     Checks if we've been properly scrubbed in accordance with the bridge
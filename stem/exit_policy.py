@@ -0,0 +1,663 @@
+"""
+Representation of tor exit policies. These can be used to check if exiting to
+a destination is permissible or not. For instance...
+
+::
+
+  >>> policy = ExitPolicy("accept *:80", "accept *:443", "reject *:*")
+  >>> print policy
+  accept *:80, accept *:443, reject *:*
+  >>> print policy.summary()
+  accept 80,443
+  >>> policy.can_exit_to("75.119.206.243", 80)
+  True
+
+Rules are parsed once into integer addresses, masks, and port ranges. Policies
+then index their rules by the port ranges they cover, so checking a
+destination only involves the rules that apply to its port.
+
+To determine which relays can exit to a destination use an ExitPolicyIndex.
+This is populated with server descriptors, for instance from a
+:class:`stem.descriptor.reader.DescriptorReader`...
+
+::
+
+  index = ExitPolicyIndex()
+  
+  with DescriptorReader(["/home/atagar/.tor/cached-descriptors"]) as reader:
+    index.update(reader)
+  
+  for fingerprint in index.get_exits("75.119.206.243", 443):
+    print fingerprint
+
+**Module Overview:**
+
+::
+
+  ExitPolicy - Exit policy for a Tor relay
+    |- can_exit_to - check if exiting to this destination is allowed or not
+    |- is_exiting_allowed - check if any exiting is allowed
+    |- get_accepted_ports - port ranges that we can exit to
+    |- get_rejected_ports - port ranges that we can't exit to
+    |- summary - provides a short label, similar to a microdescriptor
+    |- __iter__ - iterates over our rules
+    +- __str__ - string representation
+  
+  ExitPolicyRule - Single rule of an exit policy chain
+    |- is_address_wildcard - checks if we'll accept any address
+    |- is_port_wildcard - checks if we'll accept any port
+    |- is_match - checks if we match a given destination
+    +- __str__ - string representation for this rule
+  
+  ExitPolicyIndex - Index of the exit policies for many relays
+    |- add - adds or replaces a relay's descriptor
+    |- update - adds a series of descriptors
+    |- remove - removes a relay from the index
+    |- get_exits - relays that can exit to a destination
+    +- get_exits_batch - relays that can exit to each of a series of destinations
+"""
+
+import bisect
+
+import stem.util.connection
+
+MIN_PORT, MAX_PORT = 1, 65535
+
+def _address_to_int(address):
+  """
+  Provides the integer representation of an IPv4 address.
+  
+  :param str,int address: address to be converted, this is provided back if it's already an integer
+  
+  :returns: int for the address
+  
+  :raises: ValueError if the address is malformed
+  """
+  
+  if isinstance(address, (int, long)):
+    return address
+  elif not stem.util.connection.is_valid_ip_address(address):
+    raise ValueError("'%s' isn't a valid IPv4 address" % address)
+  
+  octets = [int(entry) for entry in address.split(".")]
+  return (octets[0] << 24) | (octets[1] << 16) | (octets[2] << 8) | octets[3]
+
+def _int_to_address(value):
+  """
+  Provides the IPv4 address for its integer representation.
+  
+  :param int value: integer to be converted
+  
+  :returns: str with the address
+  """
+  
+  return ".".join([str((value >> shift) & 0xFF) for shift in (24, 16, 8, 0)])
+
+def _port_ranges(ports):
+  """
+  Merges a sorted series of (min_port, max_port) tuples, combining adjacent
+  ranges.
+  """
+  
+  merged = []
+  
+  for min_port, max_port in ports:
+    if merged and merged[-1][1] + 1 >= min_port:
+      merged[-1] = (merged[-1][0], max(merged[-1][1], max_port))
+    else:
+      merged.append((min_port, max_port))
+  
+  return merged
+
+class ExitPolicy:
+  """
+  Policy for the destinations that a relay allows or denies exiting to. This
+  is, in effect, an ordered listing of ExitPolicyRule entries where the first
+  rule that matches a destination determines if we can exit to it. If none
+  match then exiting is allowed.
+  
+  :param str,ExitPolicyRule rules: rules that make up this policy
+  
+  :raises: ValueError if a rule is malformed
+  """
+  
+  def __init__(self, *rules):
+    self._rules = []
+    
+    for rule in rules:
+      if isinstance(rule, ExitPolicyRule):
+        self._rules.append(rule)
+      else:
+        self._rules.append(ExitPolicyRule(rule))
+    
+    # Index of our rules by port, made on first use. This splits the port
+    # space into ranges such that the same rules apply to every port within
+    # them. Entries are the starting port of each range, and a tuple of...
+    #
+    #   * the (network, mask, is_accept) rules with a specific address that
+    #     apply before the verdict for all addresses is settled
+    #   * the verdict for any other address
+    
+    self._index_starts = None
+    self._index_entries = None
+  
+  def can_exit_to(self, address, port):
+    """
+    Checks if this policy allows exiting to a given destination or not.
+    
+    :param str,int address: IPv4 address, or its integer representation
+    :param int port: port of the destination
+    
+    :returns: True if exiting to this destination is allowed, False otherwise
+    
+    :raises: ValueError if the address or port are malformed
+    """
+    
+    address = _address_to_int(address)
+    
+    if not MIN_PORT <= port <= MAX_PORT:
+      raise ValueError("'%s' isn't a valid port" % port)
+    
+    if self._index_starts is None: self._build_index()
+    rules, default = self._index_entries[bisect.bisect_right(self._index_starts, port) - 1]
+    
+    for network, mask, is_accept in rules:
+      if address & mask == network:
+        return is_accept
+    
+    return default
+  
+  def is_exiting_allowed(self):
+    """
+    Provides True if the policy allows exiting whatsoever, False otherwise.
+    """
+    
+    if self._index_starts is None: self._build_index()
+    
+    for rules, default in self._index_entries:
+      if default or [rule for rule in rules if rule[2]]:
+        return True
+    
+    return False
+  
+  def get_accepted_ports(self):
+    """
+    Provides the ports that we allow exiting to. Like tor's policy summaries
+    this only considers rules that apply to any address, so a port is included
+    if it's accepted for destinations in general.
+    
+    :returns: list of (min_port, max_port) tuples for the port ranges we accept, inclusive
+    """
+    
+    return self._get_ports(True)
+  
+  def get_rejected_ports(self):
+    """
+    Provides the ports that we don't allow exiting to. This is the complement
+    of get_accepted_ports().
+    
+    :returns: list of (min_port, max_port) tuples for the port ranges we reject, inclusive
+    """
+    
+    return self._get_ports(False)
+  
+  def summary(self):
+    """
+    Provides a short description of our policy chain, similar to a
+    microdescriptor. This is the shorter of the ports we accept or reject, for
+    instance...
+    
+    ::
+    
+      >>> policy = ExitPolicy("accept *:80", "accept *:443", "reject *:*")
+      >>> policy.summary()
+      "accept 80,443"
+      
+      >>> policy = ExitPolicy("reject *:25", "reject *:119", "accept *:*")
+      >>> policy.summary()
+      "reject 25,119"
+    
+    :returns: str with a concise summary for our policy
+    """
+    
+    def label(ports):
+      entries = []
+      
+      for min_port, max_port in ports:
+        if min_port == max_port: entries.append(str(min_port))
+        else: entries.append("%i-%i" % (min_port, max_port))
+      
+      return ",".join(entries)
+    
+    accept_label = label(self.get_accepted_ports())
+    reject_label = label(self.get_rejected_ports())
+    
+    if not accept_label:
+      return "reject 1-65535"
+    elif reject_label and len(reject_label) < len(accept_label):
+      return "reject " + reject_label
+    else:
+      return "accept " + accept_label
+  
+  def _get_ports(self, is_accept):
+    if self._index_starts is None: self._build_index()
+    ports = []
+    
+    for i, (rules, default) in enumerate(self._index_entries):
+      if default == is_accept:
+        if i + 1 < len(self._index_starts): max_port = self._index_starts[i + 1] - 1
+        else: max_port = MAX_PORT
+        
+        ports.append((self._index_starts[i], max_port))
+    
+    return _port_ranges(ports)
+  
+  def _build_index(self):
+    boundaries = set([MIN_PORT])
+    
+    for rule in self._rules:
+      boundaries.add(max(MIN_PORT, rule.min_port))
+      if rule.max_port < MAX_PORT: boundaries.add(rule.max_port + 1)
+    
+    starts, entries = sorted(boundaries), []
+    
+    for port in starts:
+      rules, default = [], True
+      
+      for rule in self._rules:
+        if not rule.min_port <= port <= rule.max_port:
+          continue
+        elif rule.is_address_wildcard():
+          default = rule.is_accept
+          break # rules after this won't be reached
+        else:
+          rules.append((rule._address_int & rule._mask_int, rule._mask_int, rule.is_accept))
+      
+      entries.append((tuple(rules), default))
+    
+    self._index_starts, self._index_entries = starts, entries
+  
+  def __iter__(self):
+    for rule in self._rules:
+      yield rule
+  
+  def __len__(self):
+    return len(self._rules)
+  
+  def __str__(self):
+    return ", ".join([str(rule) for rule in self._rules])
+  
+  def __eq__(self, other):
+    if isinstance(other, ExitPolicy):
+      return [str(rule) for rule in self] == [str(rule) for rule in other]
+    else:
+      return False
+  
+  def __ne__(self, other):
+    return not self == other
+
+class ExitPolicyRule:
+  """
+  Single rule from an exit policy. These are chained together to form
+  complete policies that describe where a relay will and will not allow traffic
+  to exit.
+  
+  The format of these rules are formally described in the `dir-spec
+  <https://gitweb.torproject.org/torspec.git/blob/HEAD:/dir-spec.txt>`_ as an
+  'exitpattern'. Note that while these are similar to tor's man page entry for
+  ExitPolicies, it's not the exact same. An exitpattern is better defined and
+  stricter in what it'll accept. For instance, ports are not optional and it
+  does not contain the 'private' alias.
+  
+  :var bool is_accept: indicates if exiting is allowed or disallowed
+  :var str address: address that this rule is for, None if it's a wildcard
+  :var str mask: subnet mask for the address (ex. "255.255.255.0"), None if it's a wildcard
+  :var int masked_bits: number of bits the subnet mask represents, None if it's a wildcard or the mask can't be represented that way
+  :var int min_port: lower end of the port range that we include (inclusive)
+  :var int max_port: upper end of the port range that we include (inclusive)
+  
+  :param str rule: exit policy rule to be parsed
+  
+  :raises: ValueError if input isn't a valid tor exit policy rule
+  """
+  
+  def __init__(self, rule):
+    self.rule = rule
+    
+    if rule.startswith("accept "):
+      self.is_accept = True
+    elif rule.startswith("reject "):
+      self.is_accept = False
+    else:
+      raise ValueError("An exit policy must start with either 'accept' or 'reject': %s" % rule)
+    
+    exitpattern = rule[7:].strip()
+    
+    if not ":" in exitpattern:
+      raise ValueError("An exitpattern must be of the form 'addrspec:portspec': %s" % rule)
+    
+    addrspec, portspec = exitpattern.rsplit(":", 1)
+    
+    self._parse_addrspec(rule, addrspec)
+    self._parse_portspec(rule, portspec)
+  
+  def is_address_wildcard(self):
+    """
+    True if we'll match against any address, False otherwise.
+    
+    :returns: bool for if our address matching is a wildcard
+    """
+    
+    return self._mask_int == 0
+  
+  def is_port_wildcard(self):
+    """
+    True if we'll match against any port, False otherwise.
+    
+    :returns: bool for if our port matching is a wildcard
+    """
+    
+    return self.min_port in (0, 1) and self.max_port == MAX_PORT
+  
+  def is_match(self, address, port):
+    """
+    True if we match against the given destination, False otherwise.
+    
+    :param str,int address: IPv4 address, or its integer representation
+    :param int port: port of the destination
+    
+    :returns: bool indicating if we match against this destination
+    
+    :raises: ValueError if the address is malformed
+    """
+    
+    if not self.min_port <= port <= self.max_port:
+      return False
+    
+    address = _address_to_int(address)
+    return address & self._mask_int == self._address_int & self._mask_int
+  
+  def __str__(self):
+    return self.rule
+  
+  def _parse_addrspec(self, rule, addrspec):
+    if addrspec == "*":
+      self.address = None
+      self.mask = None
+      self.masked_bits = None
+      self._address_int = 0
+      self._mask_int = 0
+      return
+    
+    if "/" in addrspec:
+      address, mask = addrspec.split("/", 1)
+    else:
+      address, mask = addrspec, "32"
+    
+    if not stem.util.connection.is_valid_ip_address(address):
+      raise ValueError("Address isn't a valid IPv4 address: %s" % rule)
+    
+    if mask.isdigit() and 0 <= int(mask) <= 32:
+      masked_bits = int(mask)
+      mask_int = (0xFFFFFFFF << (32 - masked_bits)) & 0xFFFFFFFF
+      mask = _int_to_address(mask_int)
+    elif stem.util.connection.is_valid_ip_address(mask):
+      mask_int = _address_to_int(mask)
+      
+      # only masks of contiguous leading bits can be expressed as a bit count
+      inverted = ~mask_int & 0xFFFFFFFF
+      
+      if inverted & (inverted + 1) == 0:
+        masked_bits = 32 - bin(inverted).count("1")
+      else:
+        masked_bits = None
+    else:
+      raise ValueError("The address mask should be a bit count or an IPv4 address: %s" % rule)
+    
+    self.address = address
+    self.mask = mask
+    self.masked_bits = masked_bits
+    self._address_int = _address_to_int(address)
+    self._mask_int = mask_int
+  
+  def _parse_portspec(self, rule, portspec):
+    if portspec == "*":
+      self.min_port, self.max_port = 1, MAX_PORT
+    elif portspec.isdigit():
+      if not stem.util.connection.is_valid_port(portspec, allow_zero = True):
+        raise ValueError("'%s' isn't within a valid port range: %s" % (portspec, rule))
+      
+      self.min_port = self.max_port = int(portspec)
+    elif "-" in portspec:
+      min_port, max_port = portspec.split("-", 1)
+      
+      for port in (min_port, max_port):
+        if not stem.util.connection.is_valid_port(port, allow_zero = True):
+          raise ValueError("'%s' isn't within a valid port range: %s" % (portspec, rule))
+      
+      self.min_port, self.max_port = int(min_port), int(max_port)
+      
+      if self.min_port > self.max_port:
+        raise ValueError("Port range has a lower bound that's greater than its upper bound: %s" % rule)
+    else:
+      raise ValueError("Port value isn't a wildcard, integer, or range: %s" % rule)
+
+class ExitPolicyIndex:
+  """
+  Index of the exit policies for a set of relays, providing the relays that can
+  exit to a destination without checking each of their policies.
+  
+  Relays with the same policy (which is most of them) are grouped together. The
+  port space is split into ranges where the verdict of each policy's address
+  wildcard rules are the same, and for each of these we precompute the
+  policies that accept it. Rules for specific addresses are indexed by their
+  address prefix, so only the policies with a rule that covers the destination
+  need to be checked individually.
+  
+  This can be updated as new descriptors arrive. Adding a relay with a policy
+  we've seen before is cheap, but new policies cause the port index to be
+  rebuilt on our next query.
+  """
+  
+  def __init__(self):
+    self._relays = {}           # fingerprint => (published, policy key)
+    self._policies = {}         # policy key => ExitPolicy
+    self._policy_relays = {}    # policy key => set of fingerprints
+    
+    # Index built from our policies, made on first use after they change. The
+    # port ranges are like those of ExitPolicy, with the policy keys that
+    # accept each range. Address rules are {mask => {network => [(policy key,
+    # min_port, max_port)...]}}.
+    
+    self._port_starts = None
+    self._port_accepts = None
+    self._address_rules = None
+  
+  def add(self, descriptor):
+    """
+    Adds a relay to the index. If we already have this relay then its prior
+    descriptor is replaced, unless this one was published earlier.
+    
+    :param stem.descriptor.server_descriptor.ServerDescriptor descriptor: descriptor for the relay
+    
+    :returns: True if the descriptor was added, False if we have a more recent one
+    
+    :raises: ValueError if the descriptor lacks a fingerprint or exit policy
+    """
+    
+    fingerprint, policy = descriptor.fingerprint, descriptor.exit_policy
+    
+    if not fingerprint:
+      raise ValueError("Descriptors must have a fingerprint to be indexed")
+    elif policy is None:
+      raise ValueError("Descriptors must have an exit policy to be indexed")
+    
+    if fingerprint in self._relays:
+      prior_published = self._relays[fingerprint][0]
+      
+      if prior_published and descriptor.published and descriptor.published < prior_published:
+        return False
+      
+      self.remove(fingerprint)
+    
+    policy_key = str(policy)
+    self._relays[fingerprint] = (descriptor.published, policy_key)
+    
+    if not policy_key in self._policies:
+      self._policies[policy_key] = policy
+      self._policy_relays[policy_key] = set()
+      self._port_starts = None
+    
+    self._policy_relays[policy_key].add(fingerprint)
+    return True
+  
+  def update(self, descriptors):
+    """
+    Adds a series of descriptors to the index, such as those from a
+    :class:`stem.descriptor.reader.DescriptorReader`. Descriptors that aren't
+    for relays (like extra-info descriptors) are skipped.
+    
+    :param iterable descriptors: descriptors to be added
+    """
+    
+    for descriptor in descriptors:
+      if getattr(descriptor, "exit_policy", None) is not None and descriptor.fingerprint:
+        self.add(descriptor)
+  
+  def remove(self, fingerprint):
+    """
+    Removes a relay from the index.
+    
+    :param str fingerprint: relay to be removed
+    
+    :returns: True if the relay was removed, False if we didn't have it
+    """
+    
+    if not fingerprint in self._relays:
+      return False
+    
+    policy_key = self._relays.pop(fingerprint)[1]
+    self._policy_relays[policy_key].discard(fingerprint)
+    
+    if not self._policy_relays[policy_key]:
+      del self._policies[policy_key]
+      del self._policy_relays[policy_key]
+      self._port_starts = None
+    
+    return True
+  
+  def get_exits(self, address, port):
+    """
+    Provides the relays that can exit to a destination.
+    
+    :param str,int address: IPv4 address, or its integer representation
+    :param int port: port of the destination
+    
+    :returns: set with the fingerprints of relays that allow exiting to this destination
+    
+    :raises: ValueError if the address or port are malformed
+    """
+    
+    address = _address_to_int(address)
+    
+    if not MIN_PORT <= port <= MAX_PORT:
+      raise ValueError("'%s' isn't a valid port" % port)
+    
+    if self._port_starts is None: self._build_index()
+    accepting_policies = self._port_accepts[bisect.bisect_right(self._port_starts, port) - 1]
+    
+    # Policies with a rule for a network containing this address might not
+    # match the verdict of their wildcard rules, so checking them individually.
+    
+    candidates = set()
+    
+    for mask, networks in self._address_rules.items():
+      for policy_key, min_port, max_port in networks.get(address & mask, ()):
+        if min_port <= port <= max_port:
+          candidates.add(policy_key)
+    
+    if candidates:
+      accepting_policies = set(accepting_policies)
+      
+      for policy_key in candidates:
+        if self._policies[policy_key].can_exit_to(address, port):
+          accepting_policies.add(policy_key)
+        else:
+          accepting_policies.discard(policy_key)
+    
+    exits = set()
+    
+    for policy_key in accepting_policies:
+      exits.update(self._policy_relays[policy_key])
+    
+    return exits
+  
+  def get_exits_batch(self, destinations):
+    """
+    Provides the relays that can exit to each of a series of destinations.
+    
+    :param list destinations: (address, port) tuples to be checked
+    
+    :returns: dict mapping each (address, port) tuple to a set with the fingerprints of relays that can exit to it
+    
+    :raises: ValueError if an address or port is malformed
+    """
+    
+    results = {}
+    
+    for address, port in destinations:
+      if not (address, port) in results:
+        results[(address, port)] = self.get_exits(address, port)
+    
+    return results
+  
+  def __len__(self):
+    return len(self._relays)
+  
+  def __contains__(self, fingerprint):
+    return fingerprint in self._relays
+  
+  def _build_index(self):
+    boundaries = set([MIN_PORT])
+    address_rules = {}
+    
+    for policy_key, policy in self._policies.items():
+      if policy._index_starts is None: policy._build_index()
+      boundaries.update(policy._index_starts)
+      
+      for rule in policy:
+        if not rule.is_address_wildcard():
+          networks = address_rules.setdefault(rule._mask_int, {})
+          network = rule._address_int & rule._mask_int
+          networks.setdefault(network, []).append((policy_key, rule.min_port, rule.max_port))
+    
+    starts = sorted(boundaries)
+    accepts = [set() for _ in starts]
+    
+    for policy_key, policy in self._policies.items():
+      # walks over our port ranges alongside those of the policy
+      
+      policy_starts, policy_entries = policy._index_starts, policy._index_entries
+      policy_index = 0
+      
+      for i, port in enumerate(starts):
+        while policy_index + 1 < len(policy_starts) and policy_starts[policy_index + 1] <= port:
+          policy_index += 1
+        
+        if policy_entries[policy_index][1]:
+          accepts[i].add(policy_key)
+    
+    # adjacent port ranges commonly have the same policies, so sharing them
+    
+    port_accepts, last_accepts = [], None
+    
+    for policy_keys in accepts:
+      if policy_keys != last_accepts:
+        last_accepts = frozenset(policy_keys)
+      
+      port_accepts.append(last_accepts)
+    
+    self._port_starts = starts
+    self._port_accepts = port_accepts
+    self._address_rules = address_rules
+
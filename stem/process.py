@@ -7,24 +7,52 @@ Helper functions for working with tor as a process.
 :DEFAULT_INIT_TIMEOUT:
   number of seconds before we time out our attempt to start a tor instance
 
+:REPLACEMENT_ATTEMPTS:
+  number of times a TorProcessPool tries to start a replacement tor process
+  before giving up on it
+
 **Module Overview:**
 
 ::
 
   launch_tor             - starts up a tor process
   launch_tor_with_config - starts a tor process with a custom torrc
+  launch_tor_many        - concurrently starts several tor processes
+  
+  TorProcessPool - Pool of tor processes that are ready to be used.
+    |- start - launches the pool's tor processes
+    |- acquire - provides a tor process from the pool
+    |- release - returns a tor process to the pool
+    |- close - terminates the pool's tor processes
+    +- __enter__ / __exit__ - manages the pool's tor processes in the context
+  
+  TorInstance - Tor process that's provided by a TorProcessPool.
 """
 
+from __future__ import absolute_import
 import re
 import os
+import time
+import select
+import socket
+import shutil
 import signal
 import tempfile
+import threading
 import subprocess
 
+import stem.connection
+import stem.control
+import stem.socket
+import stem.util.log as log
 import stem.util.system
 
 NO_TORRC = "<no torrc>"
 DEFAULT_INIT_TIMEOUT = 90
+REPLACEMENT_ATTEMPTS = 3
+
+BOOTSTRAP_LINE = re.compile("Bootstrapped ([0-9]+)%: ")
+PROBLEM_LINE = re.compile("\[(warn|err)\] (.*)$")
 
 def launch_tor(tor_cmd = "tor", args = None, torrc_path = None, completion_percent = 100, init_msg_handler = None, timeout = DEFAULT_INIT_TIMEOUT):
   """
@@ -84,8 +112,6 @@ def launch_tor(tor_cmd = "tor", args = None, torrc_path = None, completion_perce
     signal.signal(signal.SIGALRM, timeout_handler)
     signal.alarm(timeout)
   
-  bootstrap_line = re.compile("Bootstrapped ([0-9]+)%: ")
-  problem_line = re.compile("\[(warn|err)\] (.*)$")
   last_problem = "Timed out"
   
   while True:
@@ -100,21 +126,16 @@ def launch_tor(tor_cmd = "tor", args = None, torrc_path = None, completion_perce
     if init_msg_handler: init_msg_handler(init_line)
     
     # return the process if we're done with bootstrapping
-    bootstrap_match = bootstrap_line.search(init_line)
-    problem_match = problem_line.search(init_line)
+    is_bootstrapped, problem = _parse_init_line(init_line, completion_percent)
     
-    if bootstrap_match and int(bootstrap_match.groups()[0]) >= completion_percent:
+    if is_bootstrapped:
       if temp_file:
         try: os.remove(temp_file)
         except: pass
       
       return tor_process
-    elif problem_match:
-      runlevel, msg = problem_match.groups()
-      
-      if not "see warnings above" in msg:
-        if ": " in msg: msg = msg.split(": ")[-1].strip()
-        last_problem = msg
+    elif problem:
+      last_problem = problem
 
 def launch_tor_with_config(config, tor_cmd = "tor", completion_percent = 100, init_msg_handler = None, timeout = DEFAULT_INIT_TIMEOUT):
   """
@@ -133,15 +154,567 @@ def launch_tor_with_config(config, tor_cmd = "tor", completion_percent = 100, in
   :raises: OSError if we either fail to create the tor process or reached a timeout without success
   """
   
+  torrc_path = _write_torrc(config)
+  
+  try:
+    return launch_tor(tor_cmd, None, torrc_path, completion_percent, init_msg_handler, timeout)
+  finally:
+    try: os.remove(torrc_path)
+    except: pass
+
+def launch_tor_many(configs, tor_cmd = "tor", completion_percent = 100, init_msg_handler = None, timeout = DEFAULT_INIT_TIMEOUT):
+  """
+  Concurrently initializes several tor processes, each with a customized
+  configuration like :func:`stem.process.launch_tor_with_config`. This
+  provides the processes as they finish bootstrapping, for instance...
+  
+  ::
+  
+    configs = [{"SocksPort": str(9050 + i), "DataDirectory": "/tmp/tor-%i" % i} for i in range(64)]
+    
+    for config, tor_process in stem.process.launch_tor_many(configs):
+      print "tor with SocksPort %s is ready" % config["SocksPort"]
+  
+  If any of the processes fails to start then those that haven't finished
+  bootstrapping are killed and we raise an OSError. Processes that we've
+  already provided are left running.
+  
+  Unlike launch_tor() this doesn't use SIGALRM for its timeouts, so it can be
+  used from any thread. This isn't available on Windows.
+  
+  :param list configs: configuration options for each tor process, such as ``{"ControlPort": "9051"}``
+  :param str tor_cmd: command for starting tor
+  :param int completion_percent: percent of bootstrap completion at which processes are provided
+  :param functor init_msg_handler: optional functor that will be provided with a process' config and initialization stdout as we get it
+  :param int timeout: time after which the attempt to start each tor process is aborted, no timeouts are applied if None
+  
+  :returns: iterator for ``(config, subprocess.Popen)`` tuples as each tor process finishes bootstrapping
+  
+  :raises: OSError if we either fail to create a tor process or reached a timeout without success
+  """
+  
+  return _launch_tor_many(configs, tor_cmd, completion_percent, init_msg_handler, timeout)
+
+def _launch_tor_many(configs, tor_cmd, completion_percent, init_msg_handler, timeout, interrupt_fd = None):
+  """
+  Implementation of :func:`stem.process.launch_tor_many`. If an interrupt_fd
+  is provided then we give up once it's readable, killing the processes that
+  haven't finished bootstrapping.
+  
+  :param int interrupt_fd: file descriptor that's readable when we should stop
+  
+  :raises: OSError if we fail to create a tor process, reached a timeout without success, or were interrupted
+  """
+  
+  if stem.util.system.is_windows():
+    raise OSError("launch_tor_many() is unavailable on Windows")
+  
+  pending = {} # stdout file descriptor => _PendingTorProcess
+  interrupt_fds = [interrupt_fd] if interrupt_fd is not None else []
+  
+  try:
+    for index, config in enumerate(configs):
+      launch = _PendingTorProcess(index, config)
+      launch.torrc_path = _write_torrc(config)
+      
+      try:
+        launch.tor_process = subprocess.Popen([tor_cmd, "-f", launch.torrc_path], stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+      except OSError:
+        launch.remove_torrc()
+        raise
+      
+      if timeout: launch.deadline = time.time() + timeout
+      pending[launch.tor_process.stdout.fileno()] = launch
+    
+    while pending:
+      deadlines = [launch.deadline for launch in pending.values() if launch.deadline]
+      wait_time = max(0, min(deadlines) - time.time()) if deadlines else None
+      
+      # the output of all our pending processes is watched with a single
+      # select() call
+      
+      readable_fds = select.select(pending.keys() + interrupt_fds, [], [], wait_time)[0]
+      
+      while readable_fds:
+        if interrupt_fd in readable_fds:
+          raise OSError("Interrupted while waiting for tor to bootstrap")
+        
+        for stdout_fd in readable_fds:
+          launch = pending[stdout_fd]
+          output = os.read(stdout_fd, 4096)
+          
+          if not output:
+            raise OSError("Process for configs[%i] terminated: %s" % (launch.index, launch.last_problem))
+          
+          launch.unread_output += output
+          
+          while "\n" in launch.unread_output:
+            init_line, launch.unread_output = launch.unread_output.split("\n", 1)
+            init_line = init_line.strip()
+            
+            if init_msg_handler: init_msg_handler(launch.config, init_line)
+            is_bootstrapped, problem = _parse_init_line(init_line, completion_percent)
+            
+            if is_bootstrapped:
+              del pending[stdout_fd]
+              launch.remove_torrc()
+              yield (launch.config, launch.tor_process)
+              break
+            elif problem:
+              launch.last_problem = problem
+        
+        # Our caller might have taken a while before asking for the next
+        # process. Output that arrived in the meantime is read before we check
+        # our deadlines so we don't kill processes that have finished.
+        
+        readable_fds = select.select(pending.keys() + interrupt_fds, [], [], 0)[0]
+      
+      current_time = time.time()
+      
+      for launch in pending.values():
+        if launch.deadline and current_time >= launch.deadline:
+          raise OSError("Process for configs[%i] reached a %i second timeout without success" % (launch.index, timeout))
+  finally:
+    # kills the processes that didn't finish bootstrapping
+    for launch in pending.values():
+      launch.tor_process.kill()
+      launch.tor_process.wait()
+      launch.remove_torrc()
+
+class TorInstance:
+  """
+  Tor process provided by a :class:`~stem.process.TorProcessPool`.
+  
+  :var subprocess.Popen tor_process: tor subprocess
+  :var stem.control.Controller controller: authenticated controller for the process, this is None when it isn't in use
+  :var dict config: configuration options the process was started with
+  :var int control_port: ControlPort of the process
+  :var int socks_port: SocksPort of the process
+  """
+  
+  def __init__(self, tor_process, config, control_port, socks_port):
+    self.tor_process = tor_process
+    self.controller = None
+    self.config = config
+    self.control_port = control_port
+    self.socks_port = socks_port
+  
+  def is_alive(self):
+    """
+    Checks if our tor process is still running.
+    
+    :returns: True if the process is running, False otherwise
+    """
+    
+    return self.tor_process.poll() is None
+  
+  def _terminate(self):
+    """
+    Closes our controller, kills our tor process, and removes its data
+    directory.
+    """
+    
+    if self.controller:
+      self.controller.close()
+      self.controller = None
+    
+    if self.is_alive():
+      self.tor_process.kill()
+      self.tor_process.wait()
+    
+    shutil.rmtree(self.config["DataDirectory"], True)
+
+class TorProcessPool:
+  """
+  Pool of bootstrapped tor processes, so callers that need tor (such as tests)
+  don't need to wait for it to start. Each instance is provided with an
+  authenticated controller, for instance...
+  
+  ::
+  
+    with TorProcessPool(4) as pool:
+      instance = pool.acquire()
+      
+      try:
+        print instance.controller.get_info("version")
+      finally:
+        pool.release(instance)
+  
+  Processes are reused when released, unless they've exited or the caller
+  asks for a fresh one, in which case they're replaced in the background. If
+  we're repeatedly unable to start a replacement then the pool shrinks, and
+  once it has no tor processes left acquiring one raises an OSError.
+  
+  Each tor process is given its own data directory, and ports starting at
+  base_port. If a base_port isn't provided then we pick ports that are free
+  when the pool starts. Cookie authentication is used unless the config says
+  otherwise.
+  
+  :param int size: number of tor processes to keep
+  :param dict config: configuration options for the tor processes, its ControlPort, SocksPort and DataDirectory are set by the pool
+  :param int base_port: first port used by the tor processes, each uses two (a ControlPort and SocksPort), free ports are used if None
+  :param str tor_cmd: command for starting tor
+  :param int completion_percent: percent of bootstrap completion at which tor processes are ready
+  :param int timeout: time after which the attempt to start a tor process is aborted, no timeouts are applied if None
+  """
+  
+  def __init__(self, size, config = None, base_port = None, tor_cmd = "tor", completion_percent = 100, timeout = DEFAULT_INIT_TIMEOUT):
+    self._config = dict(config) if config else {}
+    self._config.setdefault("CookieAuthentication", "1")
+    
+    self._tor_cmd = tor_cmd
+    self._completion_percent = completion_percent
+    self._timeout = timeout
+    
+    # (control port, socks port) for each of our tor processes, these are
+    # picked when we start if we weren't given a base_port
+    
+    self._size = size
+    self._ports = None
+    
+    if base_port is not None:
+      self._ports = [(base_port + 2 * i, base_port + 2 * i + 1) for i in range(size)]
+    
+    self._idle_instances = []
+    self._used_instances = []
+    self._pending_count = 0 # number of tor processes that we're starting
+    self._pool_cond = threading.Condition()
+    self._is_closed = True
+    
+    # Launches that are in progress, and a pipe for interrupting them when
+    # we're closed. Otherwise replacements could outlive the pool, leaving
+    # their tor process and files behind if the interpreter exits.
+    
+    self._launch_count = 0
+    self._interrupt_read, self._interrupt_write = None, None
+  
+  def start(self):
+    """
+    Launches the pool's tor processes, blocking until they've bootstrapped.
+    
+    :raises: OSError if we fail to start the tor processes
+    """
+    
+    ports = self._ports if self._ports else _get_free_ports(self._size)
+    
+    with self._pool_cond:
+      self._is_closed = False
+      self._pending_count += len(ports)
+      self._interrupt_read, self._interrupt_write = os.pipe()
+    
+    try:
+      self._launch(ports)
+    except OSError:
+      self.close()
+      raise
+    finally:
+      with self._pool_cond:
+        self._pending_count -= len(ports)
+        self._pool_cond.notify_all()
+  
+  def acquire(self, timeout = None):
+    """
+    Provides a tor process from the pool, waiting if they're all in use. The
+    process remains ours until we return it with :func:`~stem.process.TorProcessPool.release`.
+    
+    :param float timeout: seconds to wait for a tor process to be available, this waits indefinitely if None
+    
+    :returns: :class:`~stem.process.TorInstance` with an authenticated controller
+    
+    :raises: OSError if the pool is closed, has no tor processes left, or none of its tor processes were available within our timeout
+    """
+    
+    deadline = time.time() + timeout if timeout is not None else None
+    
+    while True:
+      with self._pool_cond:
+        while not self._idle_instances and not self._is_closed:
+          if not self._used_instances and not self._pending_count:
+            raise OSError("Tor process pool has no tor processes left")
+          
+          wait_time = deadline - time.time() if deadline is not None else None
+          
+          if wait_time is not None and wait_time <= 0:
+            raise OSError("No tor process became available within %0.1f seconds" % timeout)
+          
+          self._pool_cond.wait(wait_time)
+        
+        if self._is_closed:
+          raise OSError("Tor process pool is closed")
+        
+        instance = self._idle_instances.pop(0)
+        self._used_instances.append(instance)
+      
+      try:
+        instance.controller = _get_controller(instance.control_port)
+        return instance
+      except (stem.socket.SocketError, stem.connection.AuthenticationFailure), exc:
+        log.info("Unable to connect to our pooled tor process on port %i, replacing it: %s" % (instance.control_port, exc))
+        self.release(instance, False)
+  
+  def release(self, instance, reuse = True):
+    """
+    Returns a tor process to the pool. Its controller is closed, so
+    configuration changes made through it remain unless we ask for a fresh
+    process instead.
+    
+    :param stem.process.TorInstance instance: tor process to be returned
+    :param bool reuse: returns this tor process to the pool if True, otherwise it's terminated and replaced with a new process
+    """
+    
+    if instance.controller:
+      instance.controller.close()
+      instance.controller = None
+    
+    with self._pool_cond:
+      if instance in self._used_instances:
+        self._used_instances.remove(instance)
+      
+      if reuse and instance.is_alive() and not self._is_closed:
+        self._idle_instances.append(instance)
+        self._pool_cond.notify()
+        return
+      
+      is_replaced = not self._is_closed
+      
+      if is_replaced:
+        self._pending_count += 1
+    
+    instance._terminate()
+    
+    if is_replaced:
+      ports = (instance.control_port, instance.socks_port)
+      replacement_thread = threading.Thread(target = self._replace, args = (ports,), name = "Tor Process Pool")
+      replacement_thread.setDaemon(True)
+      replacement_thread.start()
+  
+  def close(self):
+    """
+    Terminates the pool's tor processes, including those in use. This blocks
+    until the processes we're starting have been stopped.
+    """
+    
+    with self._pool_cond:
+      self._is_closed = True
+      instances = self._idle_instances + self._used_instances
+      self._idle_instances, self._used_instances = [], []
+      self._pool_cond.notify_all()
+      
+      if self._interrupt_write is not None:
+        os.write(self._interrupt_write, "x")
+        
+        while self._launch_count:
+          self._pool_cond.wait()
+        
+        os.close(self._interrupt_read)
+        os.close(self._interrupt_write)
+        self._interrupt_read, self._interrupt_write = None, None
+    
+    for instance in instances:
+      instance._terminate()
+  
+  def _launch(self, ports):
+    """
+    Starts tor processes, adding them to the pool as they finish bootstrapping.
+    
+    :param list ports: (control port, socks port) tuples for the processes to be started
+    
+    :raises: OSError if we fail to start the tor processes or the pool is closed
+    """
+    
+    with self._pool_cond:
+      if self._is_closed:
+        raise OSError("Tor process pool is closed")
+      
+      self._launch_count += 1
+      interrupt_fd = self._interrupt_read
+    
+    configs, launched = [], set()
+    
+    try:
+      for control_port, socks_port in ports:
+        config = dict(self._config)
+        config["ControlPort"] = str(control_port)
+        config["SocksPort"] = str(socks_port)
+        config["DataDirectory"] = tempfile.mkdtemp(prefix = "tor-pool-")
+        configs.append(config)
+      
+      for config, tor_process in _launch_tor_many(configs, self._tor_cmd, self._completion_percent, None, self._timeout, interrupt_fd):
+        instance = TorInstance(tor_process, config, int(config["ControlPort"]), int(config["SocksPort"]))
+        launched.add(config["DataDirectory"])
+        
+        with self._pool_cond:
+          if self._is_closed:
+            instance._terminate()
+          else:
+            self._idle_instances.append(instance)
+            self._pool_cond.notify()
+    finally:
+      for config in configs:
+        if not config["DataDirectory"] in launched:
+          shutil.rmtree(config["DataDirectory"], True)
+      
+      with self._pool_cond:
+        self._launch_count -= 1
+        self._pool_cond.notify_all()
+  
+  def _replace(self, ports):
+    """
+    Starts a replacement tor process, retrying up to REPLACEMENT_ATTEMPTS
+    times. If these all fail then the pool is left a process smaller.
+    
+    :param tuple ports: (control port, socks port) of the process being replaced
+    """
+    
+    try:
+      for attempt in range(1, REPLACEMENT_ATTEMPTS + 1):
+        with self._pool_cond:
+          if self._is_closed: return
+        
+        try:
+          self._launch([ports])
+          return
+        except OSError, exc:
+          log.info("Unable to replace a tor process in our pool (attempt %i of %i): %s" % (attempt, REPLACEMENT_ATTEMPTS, exc))
+          
+          # the ports might have been taken, so try others if we picked them
+          
+          if not self._ports and attempt < REPLACEMENT_ATTEMPTS:
+            try:
+              ports = _get_free_ports(1)[0]
+            except OSError:
+              pass
+      
+      log.warn("Unable to replace a tor process in our pool after %i attempts, the pool now has one less process" % REPLACEMENT_ATTEMPTS)
+    finally:
+      with self._pool_cond:
+        self._pending_count -= 1
+        self._pool_cond.notify_all()
+  
+  def __enter__(self):
+    self.start()
+    return self
+  
+  def __exit__(self, exit_type, value, traceback):
+    self.close()
+
+class _PendingTorProcess:
+  """
+  Tor process that launch_tor_many() is waiting on to bootstrap.
+  """
+  
+  def __init__(self, index, config):
+    self.index = index
+    self.config = config
+    self.torrc_path = None
+    self.tor_process = None
+    self.deadline = None
+    self.unread_output = ""
+    self.last_problem = "Timed out"
+  
+  def remove_torrc(self):
+    if self.torrc_path:
+      try: os.remove(self.torrc_path)
+      except: pass
+      
+      self.torrc_path = None
+
+def _get_controller(control_port):
+  """
+  Provides an authenticated controller for a local tor process.
+  
+  :param int control_port: ControlPort of the tor process
+  
+  :returns: authenticated :class:`stem.control.Controller`
+  
+  :raises:
+    * :class:`stem.socket.SocketError` if we're unable to connect
+    * :class:`stem.connection.AuthenticationFailure` if we're unable to authenticate
+  """
+  
+  control_socket = stem.socket.ControlPort(control_port = control_port)
+  
+  try:
+    stem.connection.authenticate(control_socket)
+  except stem.connection.AuthenticationFailure:
+    control_socket.close()
+    raise
+  
+  return stem.control.Controller(control_socket)
+
+def _get_free_ports(count):
+  """
+  Provides ports that are currently free on localhost, as picked by the OS.
+  Another process could take them before tor does, so this is a best effort.
+  
+  :param int count: number of (control port, socks port) pairs to provide
+  
+  :returns: list of ``(control port, socks port)`` tuples
+  
+  :raises: OSError if we're unable to bind to a free port
+  """
+  
+  sockets = []
+  
+  try:
+    # sockets are kept open until we're done so each port is distinct
+    
+    for _ in range(2 * count):
+      port_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      sockets.append(port_socket)
+      port_socket.bind(("127.0.0.1", 0))
+    
+    ports = [port_socket.getsockname()[1] for port_socket in sockets]
+    return zip(ports[::2], ports[1::2])
+  except socket.error, exc:
+    raise OSError("Unable to find free ports: %s" % exc)
+  finally:
+    for port_socket in sockets:
+      port_socket.close()
+
+def _write_torrc(config):
+  """
+  Writes configuration options to a temporary torrc.
+  
+  :param dict config: configuration options, such as ``{"ControlPort": "9051"}``
+  
+  :returns: str with the path of the torrc
+  """
+  
   torrc_path = tempfile.mkstemp(prefix = "torrc-", text = True)[1]
   
   try:
     with open(torrc_path, "w") as torrc_file:
       for key, value in config.items():
         torrc_file.write("%s %s\n" % (key, value))
+  except:
+    os.remove(torrc_path)
+    raise
+  
+  return torrc_path
+
+def _parse_init_line(init_line, completion_percent):
+  """
+  Checks a line of tor's initialization output for if it's done bootstrapping
+  or reporting a problem.
+  
+  :param str init_line: line of tor's stdout
+  :param int completion_percent: percent of bootstrap completion at which we're done
+  
+  :returns: tuple of the form ``(is_bootstrapped, problem)``, where the problem is a str if this line reported one and None otherwise
+  """
+  
+  bootstrap_match = BOOTSTRAP_LINE.search(init_line)
+  problem_match = PROBLEM_LINE.search(init_line)
+  
+  if bootstrap_match and int(bootstrap_match.groups()[0]) >= completion_percent:
+    return (True, None)
+  elif problem_match:
+    runlevel, msg = problem_match.groups()
     
-    return launch_tor(tor_cmd, None, torrc_path, completion_percent, init_msg_handler, timeout)
-  finally:
-    try: os.remove(torrc_path)
-    except: pass
+    if not "see warnings above" in msg:
+      if ": " in msg: msg = msg.split(": ")[-1].strip()
+      return (False, msg)
+  
+  return (False, None)
 
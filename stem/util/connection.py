@@ -3,9 +3,32 @@ Connection and networking based utility functions. This will likely be expanded
 later to have all of `arm's functions
 <https://gitweb.torproject.org/arm.git/blob/HEAD:/src/util/connections.py>`_,
 but for now just moving the parts we need.
+
+**Module Overview:**
+
+::
+
+  is_valid_ip_address - checks if a string is a valid IPv4 address
+  is_valid_ipv6_address - checks if a string is a valid IPv6 address
+  is_valid_port - checks if something is a valid representation for a port
+  
+  ConnectionTracker - Tracks the connections of processes.
+    |- start - begins resolving connections in a background thread
+    |- stop - stops resolving connections
+    |- update - resolves connections and notifies listeners of changes
+    |- register_listener - notifies a functor of added or removed connections
+    |- get_connections - provides the connections we're tracking
+    |- get_first_seen - provides when a connection was first seen
+    +- __enter__ / __exit__ - manages the tracker thread in the context
 """
 
+import os
 import re
+import time
+import threading
+
+import stem.util.log as log
+import stem.util.proc
 
 def is_valid_ip_address(address):
   """
@@ -78,3 +101,193 @@ def is_valid_port(entry, allow_zero = False):
   
   return entry > 0 and entry < 65536
 
+class ConnectionTracker:
+  """
+  Tracks the connections of processes by periodically resolving them in a
+  background thread. Rather than the full listing of connections, listeners
+  are notified of those that were added or removed since the last time we
+  checked, so their work is proportional to what changed. For instance...
+  
+  ::
+  
+    def print_changes(added, removed):
+      for pid, conn in added:
+        print "new connection: %s:%i => %s:%i" % conn
+    
+    with ConnectionTracker(tor_pid) as tracker:
+      tracker.register_listener(print_changes)
+      time.sleep(60)
+  
+  Connections are ``(pid, (local_address, local_port, foreign_address,
+  foreign_port))`` tuples, with the connection as provided by
+  :func:`stem.util.proc.get_connections`.
+  
+  :param int,list pids: process id or list of process ids to track the connections of
+  :param float rate: seconds between resolving connections
+  """
+  
+  def __init__(self, pids, rate = 1):
+    if isinstance(pids, int): self._pids = [pids]
+    else: self._pids = list(pids)
+    
+    self._rate = rate
+    self._listeners = []
+    
+    # mapping of our current connections to the unix timestamp when we first
+    # saw them
+    
+    self._connections = {}
+    self._connections_lock = threading.RLock()
+    
+    self._tracker_thread = None
+    self._tracker_thread_lock = threading.RLock()
+    
+    self._is_stopped = threading.Event()
+    self._is_stopped.set()
+  
+  def register_listener(self, listener):
+    """
+    Registers a listener for changes in our connections. This listener is
+    expected to be a functor of the form...
+    
+    ::
+    
+      my_listener(added, removed)
+    
+    ... where added and removed are lists of connections. This is only called
+    when there are changes, and from the tracker's thread if it's running.
+    
+    :param functor listener: functor to be notified of connection changes
+    """
+    
+    self._listeners.append(listener)
+  
+  def get_connections(self):
+    """
+    Provides the connections we're currently tracking, along with when we
+    first saw them.
+    
+    :returns: dict mapping connections to the unix timestamp when they were first seen
+    """
+    
+    with self._connections_lock:
+      return dict(self._connections)
+  
+  def get_first_seen(self, pid, connection):
+    """
+    Provides when we first saw a connection.
+    
+    :param int pid: process id that the connection belongs to
+    :param tuple connection: connection tuple, as provided by :func:`stem.util.proc.get_connections`
+    
+    :returns: unix timestamp when the connection was first seen, None if it isn't one of our current connections
+    """
+    
+    with self._connections_lock:
+      return self._connections.get((pid, tuple(connection)))
+  
+  def update(self):
+    """
+    Resolves the connections of our processes, and notifies listeners of
+    those that were added or removed since our last update. This is done
+    periodically by our thread when it's running, but can also be called
+    directly.
+    
+    Processes that we're unable to read keep their prior connections unless
+    they've exited, so a brief failure doesn't report all of their connections
+    as removed and then added again.
+    
+    :returns: tuple of the form ``(added, removed)`` with lists of the connections that have changed
+    
+    :raises: IOError if our connections can't be resolved
+    """
+    
+    resolved = stem.util.proc.get_connections_by_pid(self._pids)
+    
+    current = set()
+    
+    for pid, connections in resolved.items():
+      for conn in connections:
+        current.add((pid, conn))
+    
+    # processes that get_connections_by_pid() couldn't read, and have exited
+    
+    exited_pids = set([pid for pid in self._pids if not pid in resolved and not _is_running(pid)])
+    
+    with self._connections_lock:
+      now = time.time()
+      added = [conn for conn in current if not conn in self._connections]
+      removed = [conn for conn in self._connections if (conn[0] in resolved and not conn in current) or conn[0] in exited_pids]
+      
+      for conn in removed:
+        del self._connections[conn]
+      
+      for conn in added:
+        self._connections[conn] = now
+    
+    # A listener that raises shouldn't keep the rest from being notified or
+    # stop our thread.
+    
+    if added or removed:
+      for listener in self._listeners:
+        try:
+          listener(added, removed)
+        except Exception, exc:
+          log.warn("Connection listener %s raised an exception: %s" % (listener, exc))
+    
+    return (added, removed)
+  
+  def start(self):
+    """
+    Starts resolving our connections in a background thread.
+    
+    :raises: ValueError if we're already running
+    """
+    
+    with self._tracker_thread_lock:
+      if self._tracker_thread:
+        raise ValueError("Already running, you need to call stop() first")
+      
+      self._is_stopped.clear()
+      self._tracker_thread = threading.Thread(target = self._track_connections, name = "Connection Tracker")
+      self._tracker_thread.setDaemon(True)
+      self._tracker_thread.start()
+  
+  def stop(self):
+    """
+    Stops resolving our connections.
+    """
+    
+    with self._tracker_thread_lock:
+      self._is_stopped.set()
+      
+      if self._tracker_thread:
+        self._tracker_thread.join()
+        self._tracker_thread = None
+  
+  def _track_connections(self):
+    while not self._is_stopped.is_set():
+      try:
+        self.update()
+      except IOError, exc:
+        log.debug("Unable to resolve connections for %s: %s" % (", ".join(map(str, self._pids)), exc))
+      
+      self._is_stopped.wait(self._rate)
+  
+  def __enter__(self):
+    self.start()
+    return self
+  
+  def __exit__(self, exit_type, value, traceback):
+    self.stop()
+
+def _is_running(pid):
+  """
+  Checks if a process is still running.
+  
+  :param int pid: process id of the process to check
+  
+  :returns: True if the process exists, False otherwise
+  """
+  
+  return os.path.exists("/proc/%i" % pid)
@@ -5,6 +5,11 @@ over lookups via system utilities (ps, netstat, etc). For instance, resolving
 connections this way cuts the runtime by around 90% verses the alternatives.
 These functions may not work on all platforms (only Linux?).
 
+Connections are resolved through the kernel's sock_diag netlink interface when
+it's available, which is far quicker than reading the /proc/net tables for
+processes with many sockets. If netlink can't be used then we fall back to
+reading /proc/net instead.
+
 The method for reading these files (and a little code) are borrowed from
 `psutil <https://code.google.com/p/psutil/>`_, which was written by Jay Loden,
 Dave Daeschler, Giampaolo Rodola' and is under the BSD license.
@@ -21,14 +26,26 @@ Dave Daeschler, Giampaolo Rodola' and is under the BSD license.
   get_memory_usage - provides the memory usage of a process
   get_stats - queries statistics about a process
   get_connections - provides the connections made by a process
+  get_connections_by_pid - provides the connections made by several processes
+  get_pids_by_name - provides the processes with a given name
+  get_pids_by_port - provides the processes listening on a given port
+  get_pids_by_open_file - provides the processes with a given file open
+  
+  ProcessSampler - Periodically samples the statistics of processes.
+    +- sample - provides the current statistics of our processes
+  
+  ProcessSample - Statistics of a process at a point in time.
 """
 
 import os
 import sys
+import errno
 import time
+import struct
 import socket
 import base64
 import platform
+import threading
 
 import stem.util.enum
 import stem.util.log as log
@@ -37,10 +54,47 @@ import stem.util.log as log
 IS_PROC_AVAILABLE, SYS_START_TIME, SYS_PHYSICAL_MEMORY = None, None, None
 CLOCK_TICKS = None
 
+# /proc/net tables with connection information, the IPv6 tables are absent
+# if the system lacks IPv6 support
+PROC_NET_TABLES = ("/proc/net/tcp", "/proc/net/udp", "/proc/net/tcp6", "/proc/net/udp6")
+
+# Seconds that we reuse the contents of the /proc/net tables for, and our
+# snapshot of them as a (unix timestamp, entries) tuple.
+PROC_NET_CACHE_TTL = 1
+PROC_NET_SNAPSHOT, PROC_NET_SNAPSHOT_LOCK = None, threading.RLock()
+
+# Whether connections can be queried via netlink. This is None until we first
+# try, and can be set to False to always read the /proc/net tables instead.
+NETLINK_AVAILABLE = None
+
+# sock_diag netlink constants (linux/netlink.h, linux/sock_diag.h, and
+# linux/inet_diag.h)
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST, NLM_F_DUMP = 0x1, 0x300
+NLMSG_ERROR, NLMSG_DONE = 0x2, 0x3
+TCP_ESTABLISHED_STATES, ALL_STATES = 1 << 1, 0xffffffff
+
+# netlink message header (length, type, flags, sequence, port id)
+NLMSG_HEADER = struct.Struct("=IHHII")
+
+# inet_diag_req_v2 (family, protocol, extensions, padding, states) followed by
+# a zeroed socket id so we match all sockets
+INET_DIAG_REQ = struct.Struct("=BBBBI48x")
+
+# inet_diag_msg fields that we use (source port, destination port, source
+# address, destination address, and inode). Ports and addresses are in network
+# byte order, and left packed until we need them.
+INET_DIAG_MSG = struct.Struct("=4x2s2s16s16s28xI")
+
 # os.sysconf is only defined on unix
 try: CLOCK_TICKS = os.sysconf(os.sysconf_names["SC_CLK_TCK"])
 except AttributeError: pass
 
+# bytes in a memory page, used for the resident size in /proc/<pid>/stat
+try: PAGE_SIZE = os.sysconf(os.sysconf_names["SC_PAGE_SIZE"])
+except AttributeError: PAGE_SIZE = None
+
 Stat = stem.util.enum.Enum(("COMMAND", "command"), ("CPU_UTIME", "utime"),
                  ("CPU_STIME", "stime"), ("START_TIME", "start time"))
 
@@ -232,7 +286,7 @@ def get_stats(pid, *stat_types):
     stat_comp.append(stat_line[cmd_start + 1:cmd_end])
     stat_comp += stat_line[cmd_end + 1:].split()
   
-  if len(stat_comp) != 44 and _is_float(stat_comp[13], stat_comp[14], stat_comp[21]):
+  if len(stat_comp) < 44 or not _is_float(stat_comp[13], stat_comp[14], stat_comp[21]):
     exc = IOError("stat file had an unexpected format: %s" % stat_path)
     _log_failure(parameter, exc)
     raise exc
@@ -274,11 +328,428 @@ def get_connections(pid):
   """
   
   if pid == 0: return []
+  connections = get_connections_by_pid([pid])
+  
+  # get_connections_by_pid() omits processes that it can't read
+  
+  if not pid in connections:
+    exc = IOError("unable to read the connections of process %s" % pid)
+    _log_failure("process connections", exc)
+    raise exc
+  
+  return connections[pid]
+
+def get_connections_by_pid(pids):
+  """
+  Queries the connections of several processes. This reads the /proc/net
+  contents once for all of them, so it's far quicker than calling
+  get_connections() for each.
+  
+  The /proc/net contents are shared by concurrent callers and reused for up to
+  PROC_NET_CACHE_TTL seconds, so several monitors polling together only read
+  them once.
+  
+  Processes with file descriptors that can't be read (such as those that have
+  exited or belong to another user) are logged and omitted from our results,
+  rather than failing the whole batch.
+  
+  :param list pids: process ids of the processes to be queried
+  
+  :returns: dict mapping each pid to its listing of connection tuples, as provided by get_connections()
+  
+  :raises: IOError if it can't be determined
+  """
   
-  # fetches the inode numbers for socket file descriptors
   start_time, parameter = time.time(), "process connections"
-  inodes = []
-  for fd in os.listdir("/proc/%s/fd" % pid):
+  results, socket_inodes = {}, []
+  
+  for pid in pids:
+    if pid == 0:
+      results[pid] = []
+      continue
+    
+    try:
+      socket_inodes.append((pid, _get_socket_inodes(pid, parameter)))
+      results[pid] = []
+    except IOError:
+      pass # failure has already been logged
+  
+  if not any(inodes for _, inodes in socket_inodes):
+    # unable to fetch any connections for these processes
+    return results
+  
+  # check for the connection information from the /proc/net contents
+  proc_net_entries = _get_proc_net_entries(parameter)
+  addresses = {}
+  
+  try:
+    for pid, inodes in socket_inodes:
+      for inode in inodes:
+        entry = proc_net_entries.get(inode)
+        if entry is None: continue
+        
+        # processes commonly have many connections from the same local address
+        for addr in entry:
+          if not addr in addresses:
+            if isinstance(addr, tuple): addresses[addr] = _decode_netlink_address(addr)
+            else: addresses[addr] = _decode_proc_address_encoding(addr)
+        
+        results[pid].append(addresses[entry[0]] + addresses[entry[1]])
+  except (TypeError, ValueError), exc:
+    exc = IOError("unable to parse the /proc/net contents: %s" % exc)
+    _log_failure(parameter, exc)
+    raise exc
+  
+  if NETLINK_AVAILABLE: _log_runtime(parameter, "netlink sock_diag", start_time)
+  else: _log_runtime(parameter, "/proc/net/[tcp|udp|tcp6|udp6]", start_time)
+  
+  return results
+
+def get_pids_by_name(process_name):
+  """
+  Provides the processes with a given name. Like pgrep this matches against
+  the process' command name, which the kernel truncates to fifteen characters.
+  
+  :param str process_name: process name to look for
+  
+  :returns: list of pids (ints) for the processes with that name
+  
+  :raises: IOError if the running processes can't be listed
+  """
+  
+  start_time, parameter = time.time(), "pids by name"
+  results = []
+  
+  for pid in _get_pids(parameter):
+    try:
+      with open("/proc/%i/comm" % pid) as comm_file:
+        if comm_file.read().rstrip("\n") == process_name:
+          results.append(pid)
+    except IOError:
+      pass # process exited while we were reading
+  
+  _log_runtime(parameter, "/proc/[pid]/comm", start_time)
+  return results
+
+def get_pids_by_port(port, pids = None):
+  """
+  Provides the processes with a tcp socket listening on a given port. This
+  only includes processes whose file descriptors we can read.
+  
+  :param int,str port: port to look for
+  :param list pids: processes to check, this checks all of them if None
+  
+  :returns: list of pids (ints) for the processes listening on that port
+  
+  :raises: IOError if the /proc/net tables or running processes can't be read
+  """
+  
+  start_time, parameter = time.time(), "pids by port"
+  port_suffix, socket_links = ":%04X" % int(port), set()
+  
+  for proc_file_path in ("/proc/net/tcp", "/proc/net/tcp6"):
+    try:
+      with open(proc_file_path) as proc_file:
+        lines = proc_file.read().splitlines()[1:] # skip the first line
+    except IOError, exc:
+      if exc.errno == errno.ENOENT and proc_file_path.endswith("6"):
+        continue # ipv6 is unavailable
+      
+      exc = IOError("unable to read '%s': %s" % (proc_file_path, exc))
+      _log_failure(parameter, exc)
+      raise exc
+    
+    for line in lines:
+      line_comp = line.split()
+      
+      # the listening state is "0A", and the port's the end of the local address
+      if len(line_comp) >= 10 and line_comp[3] == "0A" and line_comp[1].endswith(port_suffix):
+        socket_links.add("socket:[%s]" % line_comp[9])
+  
+  results = _get_pids_with_fd(socket_links, parameter, pids) if socket_links else []
+  _log_runtime(parameter, "/proc/net/[tcp|tcp6] and /proc/[pid]/fd", start_time)
+  return results
+
+def get_pids_by_open_file(path, pids = None):
+  """
+  Provides the processes with a given file open. This can be a regular file
+  or a unix socket (such as tor's ControlSocket), and only includes processes
+  whose file descriptors we can read.
+  
+  :param str path: location of the file to look for
+  :param list pids: processes to check, this checks all of them if None
+  
+  :returns: list of pids (ints) for the processes with that file open
+  
+  :raises: IOError if the running processes can't be listed
+  """
+  
+  start_time, parameter = time.time(), "pids by open file"
+  path = os.path.realpath(path)
+  fd_links = set([path])
+  
+  # File descriptors for unix sockets link to the socket's inode rather than
+  # its path. The paths of sockets are in /proc/net/unix, of the form...
+  # Num       RefCount Protocol Flags    Type St Inode Path
+  # 0000000000000000: 00000002 00000000 00010000 0001 01 18734 /var/run/tor/control
+  
+  try:
+    with open("/proc/net/unix") as unix_file:
+      for line in unix_file.read().splitlines()[1:]:
+        line_comp = line.split(None, 7)
+        
+        if len(line_comp) == 8 and line_comp[7] == path:
+          fd_links.add("socket:[%s]" % line_comp[6])
+  except IOError:
+    pass # not a unix socket
+  
+  results = _get_pids_with_fd(fd_links, parameter, pids)
+  _log_runtime(parameter, "/proc/net/unix and /proc/[pid]/fd", start_time)
+  return results
+
+class ProcessSample:
+  """
+  Statistics of a process at a point in time, as provided by a
+  :class:`~stem.util.proc.ProcessSampler`.
+  
+  :var int pid: process id
+  :var float timestamp: unix timestamp when the sample was taken
+  :var str command: command name under which the process is running
+  :var str state: single character for the process state, such as 'R' (running) or 'S' (sleeping)
+  :var int uid: effective user id that the process is running under
+  :var float start_time: unix timestamp for when the process began
+  :var float cpu_utime: seconds that the process has spent in user mode
+  :var float cpu_stime: seconds that the process has spent in kernel mode
+  :var float cpu_percent: percentage of a cpu used since our prior sample of the process (this can exceed 100 on multi-core systems), None if this is the first sample
+  :var int threads: number of threads in the process
+  :var int resident_size: bytes of memory the process has resident
+  :var int virtual_size: bytes of virtual memory the process has
+  :var int read_bytes: bytes the process has read from storage, None if unavailable
+  :var int write_bytes: bytes the process has written to storage, None if unavailable
+  """
+  
+  def __init__(self, pid, timestamp):
+    self.pid = pid
+    self.timestamp = timestamp
+    self.command = None
+    self.state = None
+    self.uid = None
+    self.start_time = None
+    self.cpu_utime = None
+    self.cpu_stime = None
+    self.cpu_percent = None
+    self.threads = None
+    self.resident_size = None
+    self.virtual_size = None
+    self.read_bytes = None
+    self.write_bytes = None
+
+class ProcessSampler:
+  """
+  Samples the statistics of several processes, for instance to monitor their
+  resource usage. This reads each process' /proc/<pid>/stat (and optionally
+  /proc/<pid>/io) once per sample and provides numeric values, which is far
+  cheaper than calling get_stats(), get_memory_usage() and get_uid() for each
+  of them.
+  
+  ::
+  
+    sampler = ProcessSampler(tor_pids)
+    
+    while True:
+      for pid, sample in sampler.sample().items():
+        print "%i: %s%% cpu, %i bytes" % (pid, sample.cpu_percent, sample.resident_size)
+      
+      time.sleep(1)
+  
+  :param int,list pids: process id or list of process ids to be sampled
+  :param bool include_io: reads the io statistics of the processes, this is an extra file read per process and usually only available for our own processes
+  """
+  
+  def __init__(self, pids, include_io = False):
+    if isinstance(pids, int): self._pids = [pids]
+    else: self._pids = list(pids)
+    
+    self._include_io = include_io
+    self._prior_samples = {}
+  
+  def sample(self):
+    """
+    Provides the current statistics of our processes. Processes that can't be
+    read (for instance, because they've exited) are omitted.
+    
+    :returns: dict mapping pids to their :class:`~stem.util.proc.ProcessSample`
+    
+    :raises: IOError if the clock ticks or page size of this system are unknown
+    """
+    
+    if CLOCK_TICKS is None:
+      raise IOError("Unable to look up SC_CLK_TCK")
+    elif PAGE_SIZE is None:
+      raise IOError("Unable to look up SC_PAGE_SIZE")
+    
+    start_time, parameter = time.time(), "process samples"
+    samples = {}
+    
+    for pid in self._pids:
+      try:
+        sample = self._get_sample(pid, parameter)
+      except IOError:
+        continue
+      
+      prior = self._prior_samples.get(pid)
+      
+      # the prior sample might be of an earlier process with the same pid
+      if prior and prior.start_time == sample.start_time and sample.timestamp > prior.timestamp:
+        cpu_time = (sample.cpu_utime + sample.cpu_stime) - (prior.cpu_utime + prior.cpu_stime)
+        sample.cpu_percent = 100.0 * cpu_time / (sample.timestamp - prior.timestamp)
+      
+      samples[pid] = sample
+    
+    self._prior_samples = samples
+    _log_runtime(parameter, "/proc/[pid]/[stat|io]", start_time)
+    return samples
+  
+  def _get_sample(self, pid, parameter):
+    stat_path = "/proc/%s/stat" % pid
+    
+    try:
+      with open(stat_path) as stat_file:
+        stat_line = stat_file.read()
+      
+      uid = _get_owner(pid)
+    except (IOError, OSError), exc:
+      exc = IOError("unable to read %s: %s" % (stat_path, exc))
+      _log_failure(parameter, exc)
+      raise exc
+    
+    sample = ProcessSample(pid, time.time())
+    sample.uid = uid
+    
+    # The stat file contains a single line of the form...
+    # 8438 (tor) S 8407 8438 8407 34818 8438 4202496...
+    #
+    # The command can include spaces and parentheses, so the fields begin
+    # after the last parenthesis.
+    
+    try:
+      cmd_start, cmd_end = stat_line.index("("), stat_line.rindex(")")
+      stat_comp = stat_line[cmd_end + 1:].split()
+      
+      sample.command = stat_line[cmd_start + 1:cmd_end]
+      sample.state = stat_comp[0]
+      sample.cpu_utime = float(stat_comp[11]) / CLOCK_TICKS
+      sample.cpu_stime = float(stat_comp[12]) / CLOCK_TICKS
+      sample.threads = int(stat_comp[17])
+      sample.start_time = float(stat_comp[19]) / CLOCK_TICKS + get_system_start_time()
+      sample.virtual_size = int(stat_comp[20])
+      sample.resident_size = int(stat_comp[21]) * PAGE_SIZE
+    except (ValueError, IndexError):
+      exc = IOError("stat file had an unexpected format: %s" % stat_path)
+      _log_failure(parameter, exc)
+      raise exc
+    
+    if self._include_io:
+      try:
+        with open("/proc/%s/io" % pid) as io_file:
+          for line in io_file:
+            if line.startswith("read_bytes:"):
+              sample.read_bytes = int(line.split()[1])
+            elif line.startswith("write_bytes:"):
+              sample.write_bytes = int(line.split()[1])
+      except (IOError, ValueError, IndexError):
+        pass # io statistics are often restricted to the process' owner
+    
+    return sample
+
+def _get_owner(pid):
+  """
+  Provides the effective user id of a process, from the ownership of its proc
+  directory.
+  
+  :param int pid: process id of the process to be queried
+  
+  :returns: int with the user id of the process
+  
+  :raises: OSError if the process doesn't exist
+  """
+  
+  return os.stat("/proc/%s" % pid).st_uid
+
+def _get_pids(parameter):
+  """
+  Provides the pids of the running processes.
+  
+  :param str parameter: description of the proc attribute being fetch
+  
+  :returns: list of pids (ints)
+  
+  :raises: IOError if /proc can't be read
+  """
+  
+  try:
+    return [int(entry) for entry in os.listdir("/proc") if entry.isdigit()]
+  except OSError, exc:
+    exc = IOError("unable to list the running processes: %s" % exc)
+    _log_failure(parameter, exc)
+    raise exc
+
+def _get_pids_with_fd(fd_links, parameter, pids = None):
+  """
+  Provides the processes with a file descriptor linking to one of the given
+  destinations. Processes we can't read the file descriptors of are skipped.
+  
+  :param set fd_links: file descriptor destinations to look for
+  :param str parameter: description of the proc attribute being fetch
+  :param list pids: processes to check, this checks all of them if None
+  
+  :returns: list of pids (ints) with a matching file descriptor
+  
+  :raises: IOError if the running processes can't be listed
+  """
+  
+  results = []
+  
+  for pid in (_get_pids(parameter) if pids is None else pids):
+    fd_dir = "/proc/%i/fd" % pid
+    
+    try:
+      fds = os.listdir(fd_dir)
+    except OSError:
+      continue # process exited or belongs to another user
+    
+    for fd in fds:
+      try:
+        if os.readlink(os.path.join(fd_dir, fd)) in fd_links:
+          results.append(pid)
+          break
+      except OSError:
+        pass # file descriptor was closed
+  
+  return results
+
+def _get_socket_inodes(pid, parameter):
+  """
+  Provides the inodes of a process' sockets.
+  
+  :param int pid: process id of the process to be queried
+  :param str parameter: description of the proc attribute being fetch
+  
+  :returns: set with the inode numbers (as strings) of the process' sockets
+  
+  :raises: IOError if its file descriptors can't be read
+  """
+  
+  inodes = set()
+  
+  try:
+    fds = os.listdir("/proc/%s/fd" % pid)
+  except OSError, exc:
+    exc = IOError("unable to read the file descriptors of process %s: %s" % (pid, exc))
+    _log_failure(parameter, exc)
+    raise exc
+  
+  for fd in fds:
     fd_path = "/proc/%s/fd/%s" % (pid, fd)
     
     try:
@@ -286,48 +757,209 @@ def get_connections(pid):
       fd_name = os.readlink(fd_path)
       
       if fd_name.startswith('socket:['):
-        inodes.append(fd_name[8:-1])
-    except OSError:
+        inodes.add(fd_name[8:-1])
+    except OSError, exc:
+      # file descriptors can be closed while we're reading them (including
+      # the one used to list the directory)
+      
+      if exc.errno == errno.ENOENT: continue
+      
       # most likely couldn't be read due to permissions
       exc = IOError("unable to determine file descriptor destination: %s" % fd_path)
       _log_failure(parameter, exc)
       raise exc
   
-  if not inodes:
-    # unable to fetch any connections for this process
-    return []
+  return inodes
+
+def _get_proc_net_entries(parameter):
+  """
+  Provides the system's connections, via netlink if it's available and the
+  /proc/net tables otherwise. These are cached for PROC_NET_CACHE_TTL seconds,
+  and concurrent callers wait for a single read of the tables rather than each
+  reading them.
   
-  # check for the connection information from the /proc/net contents
-  conn = []
-  for proc_file_path in ("/proc/net/tcp", "/proc/net/udp"):
-    try:
-      proc_file = open(proc_file_path)
-      proc_file.readline() # skip the first line
+  :param str parameter: description of the proc attribute being fetch
+  
+  :returns: dict mapping socket inodes (strings) to their ``(local_address, foreign_address)`` entries, which are encoded as in either the /proc/net tables or netlink
+  
+  :raises: IOError if the tables can't be read or parsed
+  """
+  
+  global PROC_NET_SNAPSHOT, NETLINK_AVAILABLE
+  
+  with PROC_NET_SNAPSHOT_LOCK:
+    if PROC_NET_SNAPSHOT:
+      snapshot_time, entries = PROC_NET_SNAPSHOT
+      
+      if 0 <= time.time() - snapshot_time < PROC_NET_CACHE_TTL:
+        return entries
+    
+    snapshot_time, entries = time.time(), None
+    
+    if NETLINK_AVAILABLE is not False:
+      try:
+        entries = _get_netlink_entries()
+        NETLINK_AVAILABLE = True
+      except IOError, exc:
+        log.debug("Unable to query connections via netlink, falling back to /proc/net: %s" % exc)
+        NETLINK_AVAILABLE = False
+    
+    if entries is None:
+      entries = {}
+      
+      for proc_file_path in PROC_NET_TABLES:
+        entries.update(_read_proc_net_table(proc_file_path, parameter))
+    
+    PROC_NET_SNAPSHOT = (snapshot_time, entries)
+    return entries
+
+def _read_proc_net_table(proc_file_path, parameter):
+  """
+  Reads the connections from a /proc/net table. The table is read in full then
+  scanned once, and addresses are left encoded since we only need those of
+  the sockets we're looking for. IPv6 tables are skipped if they don't exist.
+  
+  :param str proc_file_path: path of the /proc/net table to be read
+  :param str parameter: description of the proc attribute being fetch
+  
+  :returns: dict mapping socket inodes (strings) to their ``(local_address, foreign_address)`` entries
+  
+  :raises: IOError if the table can't be read or parsed
+  """
+  
+  try:
+    with open(proc_file_path) as proc_file:
+      lines = proc_file.read().splitlines()[1:] # skip the first line
+  except IOError, exc:
+    if exc.errno == errno.ENOENT and proc_file_path.endswith("6"):
+      return {} # ipv6 is unavailable
+    
+    exc = IOError("unable to read '%s': %s" % (proc_file_path, exc))
+    _log_failure(parameter, exc)
+    raise exc
+  
+  # tcp connections are skipped if they aren't yet established
+  is_tcp = proc_file_path.endswith(("/tcp", "/tcp6"))
+  
+  entries = {}
+  
+  try:
+    for line in lines:
+      _, l_addr, f_addr, status, _, _, _, _, _, inode = line.split(None, 10)[:10]
+      
+      if is_tcp and status != "01":
+        continue
+      
+      entries[inode] = (l_addr, f_addr)
+  except Exception, exc:
+    exc = IOError("unable to parse '%s': %s" % (proc_file_path, exc))
+    _log_failure(parameter, exc)
+    raise exc
+  
+  return entries
+
+def _get_netlink_entries():
+  """
+  Queries the system's established tcp and udp connections via the sock_diag
+  netlink interface. Unlike the /proc/net tables this is a binary format so
+  the kernel doesn't need to render, nor us parse, text for each socket.
+  
+  :returns: dict mapping socket inodes (strings) to their ``(local_address, foreign_address)`` entries, each a ``(family, packed_address, packed_port)`` tuple
+  
+  :raises: IOError if netlink is unavailable or provides an error
+  """
+  
+  if not hasattr(socket, "AF_NETLINK"):
+    raise IOError("netlink sockets are unavailable on this platform")
+  
+  queries = (
+    (socket.AF_INET, socket.IPPROTO_TCP, TCP_ESTABLISHED_STATES),
+    (socket.AF_INET, socket.IPPROTO_UDP, ALL_STATES),
+    (socket.AF_INET6, socket.IPPROTO_TCP, TCP_ESTABLISHED_STATES),
+    (socket.AF_INET6, socket.IPPROTO_UDP, ALL_STATES),
+  )
+  
+  entries = {}
+  
+  try:
+    netlink_socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG)
+  except socket.error, exc:
+    raise IOError("unable to open a sock_diag netlink socket: %s" % exc)
+  
+  try:
+    for sequence, (family, protocol, states) in enumerate(queries, 1):
+      request = INET_DIAG_REQ.pack(family, protocol, 0, 0, states)
+      header = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(request), SOCK_DIAG_BY_FAMILY, NLM_F_REQUEST | NLM_F_DUMP, sequence, 0)
       
-      for line in proc_file:
-        _, l_addr, f_addr, status, _, _, _, _, _, inode = line.split()[:10]
+      try:
+        netlink_socket.send(header + request)
+        
+        while not _read_sock_diag_response(netlink_socket.recv(65536), family, entries):
+          pass
+      except IOError, exc:
+        # skips the IPv6 tables if the system lacks IPv6 support
+        if family == socket.AF_INET6 and exc.errno in (errno.ENOENT, errno.EAFNOSUPPORT):
+          continue
         
-        if inode in inodes:
-          # if a tcp connection, skip if it isn't yet established
-          if proc_file_path.endswith("/tcp") and status != "01":
-            continue
-          
-          local_ip, local_port = _decode_proc_address_encoding(l_addr)
-          foreign_ip, foreign_port = _decode_proc_address_encoding(f_addr)
-          conn.append((local_ip, local_port, foreign_ip, foreign_port))
+        raise IOError("unable to query sock_diag: %s" % exc)
+  finally:
+    netlink_socket.close()
+  
+  return entries
+
+def _read_sock_diag_response(data, family, entries):
+  """
+  Parses the inet_diag_msg entries of a sock_diag netlink response.
+  
+  :param str data: netlink messages to be parsed
+  :param int family: address family that we requested
+  :param dict entries: mapping of socket inodes to connections that we add to
+  
+  :returns: True if this was the end of the response, False if there's more to be read
+  
+  :raises: IOError if the response is malformed or an error
+  """
+  
+  offset = 0
+  
+  while offset + NLMSG_HEADER.size <= len(data):
+    msg_length, msg_type = NLMSG_HEADER.unpack_from(data, offset)[:2]
+    msg_offset = offset + NLMSG_HEADER.size
+    
+    if msg_length < NLMSG_HEADER.size or offset + msg_length > len(data):
+      raise IOError("malformed netlink message")
+    elif msg_type == NLMSG_DONE:
+      return True
+    elif msg_type == NLMSG_ERROR:
+      error = struct.unpack_from("=i", data, msg_offset)[0]
+      raise IOError(-error, os.strerror(-error))
+    elif msg_type == SOCK_DIAG_BY_FAMILY:
+      if msg_length - NLMSG_HEADER.size < INET_DIAG_MSG.size:
+        raise IOError("malformed inet_diag message")
       
-      proc_file.close()
-    except IOError, exc:
-      exc = IOError("unable to read '%s': %s" % (proc_file_path, exc))
-      _log_failure(parameter, exc)
-      raise exc
-    except Exception, exc:
-      exc = IOError("unable to parse '%s': %s" % (proc_file_path, exc))
-      _log_failure(parameter, exc)
-      raise exc
+      local_port, foreign_port, local_addr, foreign_addr, inode = INET_DIAG_MSG.unpack_from(data, msg_offset)
+      entries[str(inode)] = ((family, local_addr, local_port), (family, foreign_addr, foreign_port))
+    
+    # messages are aligned to four bytes
+    offset += (msg_length + 3) & ~3
   
-  _log_runtime(parameter, "/proc/net/[tcp|udp]", start_time)
-  return conn
+  return False
+
+def _decode_netlink_address(addr):
+  """
+  Translates an address from a sock_diag response to a human readable form.
+  
+  :param tuple addr: address family, packed address, and packed port
+  
+  :returns: tuple of the form ``(addr, port)``, with addr as a string and port an int
+  """
+  
+  family, ip, port = addr
+  
+  if family == socket.AF_INET:
+    ip = ip[:4] # IPv4 addresses only use the first four bytes
+  
+  return (socket.inet_ntop(family, ip), struct.unpack("!H", port)[0])
 
 def _decode_proc_address_encoding(addr):
   """
@@ -338,10 +970,13 @@ def _decode_proc_address_encoding(addr):
   ::
   
     "0500000A:0016" -> ("10.0.0.5", 22)
+    "0000000000000000FFFF00000100007F:235B" -> ("::ffff:127.0.0.1", 9051)
   
   :param str addr: proc address entry to be decoded
   
   :returns: tuple of the form ``(addr, port)``, with addr as a string and port an int
+  
+  :raises: ValueError if the address is malformed
   """
   
   ip, port = addr.split(':')
@@ -352,20 +987,29 @@ def _decode_proc_address_encoding(addr):
   if sys.version_info >= (3,):
     ip = ip.encode('ascii')
   
-  # The IPv4 address portion is a little-endian four-byte hexadecimal number.
-  # That is, the least significant byte is listed first, so we need to reverse
-  # the order of the bytes to convert it to an IP address.
+  # The address is a series of four-byte words (one for IPv4 and four for
+  # IPv6), each a hexadecimal number in the host's byte order. On little
+  # endian systems that means the least significant byte of each word is
+  # listed first, so we need to reverse the bytes within each word to convert
+  # it to an IP address.
   #
   # This needs to account for the endian ordering as per...
   # http://code.google.com/p/psutil/issues/detail?id=201
   # https://trac.torproject.org/projects/tor/ticket/4777
   
-  if sys.byteorder == 'little':
-    ip = socket.inet_ntop(socket.AF_INET, base64.b16decode(ip)[::-1])
+  ip = base64.b16decode(ip)
+  
+  if len(ip) == 4:
+    family = socket.AF_INET
+  elif len(ip) == 16:
+    family = socket.AF_INET6
   else:
-    ip = socket.inet_ntop(socket.AF_INET, base64.b16decode(ip))
+    raise ValueError("'%s' isn't an IPv4 or IPv6 address" % addr)
+  
+  word_count = len(ip) / 4
+  ip = struct.pack(">%iI" % word_count, *struct.unpack("=%iI" % word_count, ip))
   
-  return (ip, port)
+  return (socket.inet_ntop(family, ip), port)
 
 def _is_float(*value):
   try:
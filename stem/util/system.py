@@ -17,22 +17,40 @@ best-effort, providing None if the lookup fails.
   get_bsd_jail_id - provides the BSD jail id a given process is running within
   expand_path - expands relative paths and ~ entries
   call - runs the given system command and provides back the results
+  call_many - concurrently runs commands, providing the first valid result
 """
 
 import os
 import time
+import Queue
 import platform
+import threading
 import subprocess
 
 import stem.util.proc
 import stem.util.log as log
 
-# Mapping of commands to if they're available or not. This isn't always
-# reliable, failing for some special commands. For these the cache is
+# Mapping of commands to if they're available or not. Our PATH lookups aren't
+# always reliable, failing for some special commands. For these the cache is
 # prepopulated to skip lookups.
 
 CMD_AVAILABLE_CACHE = {"ulimit": True}
 
+# Index of the files in our PATH directories, which is rebuilt if the PATH or
+# the modification time of its directories change. We check for changes at
+# most every PATH_INDEX_TTL seconds.
+
+PATH_INDEX, PATH_INDEX_LOCK = None, threading.RLock()
+PATH_INDEX_TTL = 1
+
+# Pids that we've resolved, mapping lookups (such as ("name", "tor")) to a
+# (pid, start time) tuple. Entries are only used while a process with that pid
+# and start time is running, so we don't mistake a process that reused the pid
+# for the one we resolved. This requires proc to check the start time.
+
+PID_CACHE = {}
+PID_CACHE_LOCK = threading.RLock()
+
 IS_RUNNING_PS_LINUX      = "ps -A co command"
 IS_RUNNING_PS_BSD        = "ps -ao ucomm="
 GET_PID_BY_NAME_PGREP    = "pgrep -x %s"
@@ -48,6 +66,19 @@ GET_CWD_PWDX             = "pwdx %s"
 GET_CWD_LSOF             = "lsof -a -p %s -d cwd -Fn"
 GET_BSD_JAIL_ID_PS       = "ps -p %s -o jid"
 
+# seconds that we wait for the commands used to resolve pids
+RESOLVER_TIMEOUT = 5
+
+# Processes of our in-flight call() invocations, mapping the thread waiting on
+# them to their subprocess.Popen. This lets call_many() kill the commands that
+# it no longer needs. Threads started by call_many() are also mapped to an
+# event that's set once their command is no longer needed, so commands that
+# haven't yet started are killed too.
+
+RUNNING_CALLS = {}
+CALL_CANCELLATIONS = {}
+RUNNING_CALLS_LOCK = threading.RLock()
+
 def is_windows():
   """
   Checks if we are running on Windows.
@@ -73,28 +104,36 @@ def is_available(command, cached=True):
   than one command is present (for instance "ls -a | grep foo") then this
   just checks the first.
   
+  Lookups use an index of the PATH directories' contents, which is rebuilt
+  when they change. Changes are checked for at most every PATH_INDEX_TTL
+  seconds, or with every lookup if cached is False.
+  
   :param str command: command to search for
   :param bool cached: makes use of available cached results if True
   
   :returns: True if an executable we can use by that name exists in the PATH, False otherwise
   """
   
+  global PATH_INDEX
+  
   if " " in command: command = command.split(" ")[0]
   
   if cached and command in CMD_AVAILABLE_CACHE:
     return CMD_AVAILABLE_CACHE[command]
-  else:
-    cmd_exists = False
-    for path in os.environ["PATH"].split(os.pathsep):
-      cmd_path = os.path.join(path, command)
-      if is_windows(): cmd_path += ".exe"
-      
-      if os.path.exists(cmd_path) and os.access(cmd_path, os.X_OK):
-        cmd_exists = True
-        break
+  
+  if is_windows(): command += ".exe"
+  
+  if os.path.dirname(command):
+    # paths rather than command names are checked directly
+    return os.path.exists(command) and os.access(command, os.X_OK)
+  
+  with PATH_INDEX_LOCK:
+    path_env = os.environ.get("PATH", "")
     
-    CMD_AVAILABLE_CACHE[command] = cmd_exists
-    return cmd_exists
+    if not PATH_INDEX or not PATH_INDEX.is_current(path_env, 0 if not cached else PATH_INDEX_TTL):
+      PATH_INDEX = _PathIndex(path_env)
+    
+    return PATH_INDEX.is_available(command)
 
 def is_running(command):
   """
@@ -142,13 +181,30 @@ def get_pid_by_name(process_name):
   
   ::
   
-    1. pgrep -x <name>
-    2. pidof <name>
-    3. ps -o pid -C <name> (linux)
+    1. /proc/*/comm (linux)
+    2. pgrep -x <name>
+    3. pidof <name>
+    4. ps -o pid -C <name> (linux)
        ps axc | egrep " <name>$" (bsd)
-    4. lsof -tc <name>
+    5. lsof -tc <name>
+  
+  Results with multiple instances of the process are discarded. Proc is
+  checked first, but the commands are then ran concurrently and we use the
+  first to provide a pid. That is, whichever command answers first is used
+  rather than the first in the order above. Results aren't cached since we
+  can't check that a process is still the only one with its name without
+  listing them all again.
+  
+  :param str process_name: process name for which to fetch the pid
+  
+  :returns: int with the process id, None if it can't be determined
+  """
   
-  Results with multiple instances of the process are discarded.
+  return _resolve_pid(("name", process_name), stem.util.proc.get_pids_by_name, _get_pid_by_name_from_commands, process_name, False)
+
+def _get_pid_by_name_from_commands(process_name):
+  """
+  Resolves the process id for a running process via system commands.
   
   :param str process_name: process name for which to fetch the pid
   
@@ -163,12 +219,14 @@ def get_pid_by_name(process_name):
   #   3283
   #   3392
   
+  # These commands are ran concurrently, using the first that provides a pid.
+  # This is a list of (command, parser) tuples where the parser provides the
+  # pid from the command's output, or None if it's invalid.
+  
+  resolvers = []
+  
   if is_available("pgrep"):
-    results = call(GET_PID_BY_NAME_PGREP % process_name)
-    
-    if results and len(results) == 1:
-      pid = results[0].strip()
-      if pid.isdigit(): return int(pid)
+    resolvers.append((GET_PID_BY_NAME_PGREP % process_name, _parse_single_pid))
   
   # attempts to resolve using pidof, failing if:
   # - we're running on bsd (command unavailable)
@@ -178,11 +236,7 @@ def get_pid_by_name(process_name):
   #   3392 3283
   
   if is_available("pidof"):
-    results = call(GET_PID_BY_NAME_PIDOF % process_name)
-    
-    if results and len(results) == 1 and len(results[0].split()) == 1:
-      pid = results[0].strip()
-      if pid.isdigit(): return int(pid)
+    resolvers.append((GET_PID_BY_NAME_PIDOF % process_name, _parse_single_pid))
   
   # attempts to resolve using ps, failing if:
   # - system's ps variant doesn't handle these flags (none known at the moment)
@@ -192,7 +246,7 @@ def get_pid_by_name(process_name):
   #     PID
   #    3283
   #    3392
-  #   
+  #
   #   atagar$ ps axc
   #     PID   TT  STAT      TIME COMMAND
   #       1   ??  Ss     9:00.22 launchd
@@ -203,23 +257,22 @@ def get_pid_by_name(process_name):
   if is_available("ps"):
     if not is_bsd():
       # linux variant of ps
-      results = call(GET_PID_BY_NAME_PS_LINUX % process_name)
+      def _parse_ps_linux(results):
+        if len(results) == 2:
+          return _parse_pid(results[1])
       
-      if results and len(results) == 2:
-        pid = results[1].strip()
-        if pid.isdigit(): return int(pid)
+      resolvers.append((GET_PID_BY_NAME_PS_LINUX % process_name, _parse_ps_linux))
     
     if is_bsd():
       # bsd variant of ps
-      results = call(GET_PID_BY_NAME_PS_BSD)
-      
-      if results:
+      def _parse_ps_bsd(results):
         # filters results to those with our process name
         results = [r for r in results if r.endswith(" %s" % process_name)]
         
         if len(results) == 1 and len(results[0].split()) > 0:
-          pid = results[0].split()[0]
-          if pid.isdigit(): return int(pid)
+          return _parse_pid(results[0].split()[0])
+      
+      resolvers.append((GET_PID_BY_NAME_PS_BSD, _parse_ps_bsd))
   
   # resolves using lsof which works on both Linux and BSD, only failing if:
   # - lsof is unavailable (not included by default on OpenBSD)
@@ -236,14 +289,14 @@ def get_pid_by_name(process_name):
   #   2561
   
   if is_available("lsof"):
-    results = call(GET_PID_BY_NAME_LSOF % process_name)
-    
-    if results and len(results) == 1:
-      pid = results[0].strip()
-      if pid.isdigit(): return int(pid)
+    resolvers.append((GET_PID_BY_NAME_LSOF % process_name, _parse_single_pid))
   
-  log.debug("failed to resolve a pid for '%s'" % process_name)
-  return None
+  pid = _call_resolvers(resolvers)
+  
+  if pid is None:
+    log.debug("failed to resolve a pid for '%s'" % process_name)
+  
+  return pid
 
 def get_pid_by_port(port):
   """
@@ -252,11 +305,28 @@ def get_pid_by_port(port):
   
   ::
   
-    1. netstat -npltu | grep 127.0.0.1:<port>
-    2. sockstat -4l -P tcp -p <port>
-    3. lsof -wnP -iTCP -sTCP:LISTEN | grep ":<port>"
+    1. /proc/net/tcp and /proc/*/fd (linux)
+    2. netstat -npltu | grep 127.0.0.1:<port>
+    3. sockstat -4l -P tcp -p <port>
+    4. lsof -wnP -iTCP -sTCP:LISTEN | grep ":<port>"
   
-  Most queries limit results to listening TCP connections.
+  Most queries limit results to listening TCP connections. Proc is checked
+  first, but the commands are then ran concurrently and we use the first to
+  provide a pid. That is, whichever command answers first is used rather than
+  the first in the order above. Resolved pids are cached while the process is
+  running and listening on the port.
+  
+  :param int port: port where the process we're looking for is listening
+  
+  :returns: int with the process id, None if it can't be determined
+  """
+  
+  return _resolve_pid(("port", port), stem.util.proc.get_pids_by_port, _get_pid_by_port_from_commands, port)
+
+def _get_pid_by_port_from_commands(port):
+  """
+  Resolves the process id for a process with the given port via system
+  commands.
   
   :param int port: port where the process we're looking for is listening
   
@@ -283,17 +353,20 @@ def get_pid_by_port(port):
   #   udp        0      0 0.0.0.0:5353            0.0.0.0:*                  -
   #   udp6       0      0 fe80::7ae4:ff:fe2f::123 :::*                       -
   
+  # These commands are ran concurrently, using the first that provides a pid.
+  
+  resolvers = []
+  
   if is_available("netstat"):
-    results = call(GET_PID_BY_PORT_NETSTAT)
-    
-    if results:
+    def _parse_netstat(results):
       # filters to results with our port
       results = [r for r in results if "127.0.0.1:%s" % port in r]
       
       if len(results) == 1 and len(results[0].split()) == 7:
         results = results[0].split()[6] # process field (ex. "7184/tor")
-        pid = results[:results.find("/")]
-        if pid.isdigit(): return int(pid)
+        return _parse_pid(results[:results.find("/")])
+    
+    resolvers.append((GET_PID_BY_PORT_NETSTAT, _parse_netstat))
   
   # attempts to resolve using sockstat, failing if:
   # - sockstat doesn't accept the -4 flag (BSD only)
@@ -309,7 +382,7 @@ def get_pid_by_port(port):
   #   # TODO: We need an example for the actual command we're using. I'm
   #   # suspecting that replacing the grep with checking the local port works,
   #   # but should double check.
-  #   
+  #
   #   # sockstat -4 | grep tor
   #   _tor     tor        4397  7  tcp4   51.64.7.84:9050    *:*
   #   _tor     tor        4397  8  udp4   51.64.7.84:53      *:*
@@ -318,15 +391,14 @@ def get_pid_by_port(port):
   #   _tor     tor        4397  20 tcp4   51.64.7.84:51946   32.83.7.104:443
   
   if is_available("sockstat"):
-    results = call(GET_PID_BY_PORT_SOCKSTAT % port)
-    
-    if results:
+    def _parse_sockstat(results):
       # filters to results where this is the local port
       results = [r for r in results if (len(r.split()) == 7 and (":%s" % port) in r.split()[5])]
       
       if len(results) == 1:
-        pid = results[0].split()[2]
-        if pid.isdigit(): return int(pid)
+        return _parse_pid(results[0].split()[2])
+    
+    resolvers.append((GET_PID_BY_PORT_SOCKSTAT % port, _parse_sockstat))
   
   # resolves using lsof which works on both Linux and BSD, only failing if:
   # - lsof is unavailable (not included by default on OpenBSD)
@@ -346,17 +418,16 @@ def get_pid_by_port(port):
   #   tor     1745 atagar    6u  IPv4  14229      0t0  TCP 127.0.0.1:9051 (LISTEN)
   
   if is_available("lsof"):
-    results = call(GET_PID_BY_PORT_LSOF)
-    
-    if results:
+    def _parse_lsof(results):
       # filters to results with our port
       results = [r for r in results if (len(r.split()) == 10 and (":%s" % port) in r.split()[8])]
       
       if len(results) == 1:
-        pid = results[0].split()[1]
-        if pid.isdigit(): return int(pid)
+        return _parse_pid(results[0].split()[1])
+    
+    resolvers.append((GET_PID_BY_PORT_LSOF, _parse_lsof))
   
-  return None # all queries failed
+  return _call_resolvers(resolvers)
 
 def get_pid_by_open_file(path):
   """
@@ -365,7 +436,23 @@ def get_pid_by_open_file(path):
   
   ::
   
-    lsof -w <path>
+    1. /proc/net/unix and /proc/*/fd (linux)
+    2. lsof -w <path>
+  
+  Resolved pids are cached while the process is running and has the file
+  open.
+  
+  :param str path: location of the socket file to query against
+  
+  :returns: int with the process id, None if it can't be determined
+  """
+  
+  return _resolve_pid(("open file", path), stem.util.proc.get_pids_by_open_file, _get_pid_by_open_file_from_commands, path)
+
+def _get_pid_by_open_file_from_commands(path):
+  """
+  Resolves the process id for a process with the given open file via system
+  commands.
   
   :param str path: location of the socket file to query against
   
@@ -469,7 +556,7 @@ def get_bsd_jail_id(pid):
   # Output when called from a FreeBSD jail or when Tor isn't jailed:
   #   JID
   #    0
-  # 
+  #
   # Otherwise it's something like:
   #   JID
   #    1
@@ -524,6 +611,195 @@ def expand_path(path, cwd = None):
     
     return relative_path.rstrip("/")
 
+def _resolve_pid(lookup, proc_resolver, command_resolver, arg, is_cached = True):
+  """
+  Resolves a pid from our cache, then proc, and finally system commands.
+  
+  :param tuple lookup: key for this lookup in our PID_CACHE
+  :param functor proc_resolver: proc function that provides a list of matching pids, if cached this must also accept a list of pids to check
+  :param functor command_resolver: function that resolves the pid via system commands
+  :param object arg: argument for the resolvers
+  :param bool is_cached: caches our result if True
+  
+  :returns: int with the process id, None if it can't be determined
+  """
+  
+  if is_cached:
+    pid = _get_cached_pid(lookup, proc_resolver, arg)
+    if pid is not None: return pid
+  else:
+    pid = None
+  
+  if stem.util.proc.is_available():
+    try:
+      pids = proc_resolver(arg)
+      
+      if len(pids) == 1:
+        pid = pids[0]
+      elif len(pids) > 1:
+        log.debug("multiple processes match our %s lookup for '%s': %s" % (lookup[0], arg, ", ".join(map(str, pids))))
+        return None
+    except IOError:
+      pass
+  
+  if pid is None:
+    pid = command_resolver(arg)
+  
+  if pid is not None and is_cached:
+    start_time = _get_start_time(pid)
+    
+    if start_time is not None:
+      with PID_CACHE_LOCK:
+        PID_CACHE[lookup] = (pid, start_time)
+  
+  return pid
+
+class _PathIndex:
+  """
+  Listing of the files in our PATH directories. Whether they're executable is
+  checked on each lookup since a chmod doesn't change the directory's mtime.
+  
+  :param str path_env: PATH that we're indexing
+  """
+  
+  def __init__(self, path_env):
+    self._path_env = path_env
+    self._last_checked = time.time()
+    self._mtimes = {} # directory => last modified timestamp
+    self._commands = {} # command name => list of paths with it
+    
+    for directory in path_env.split(os.pathsep):
+      if directory in self._mtimes: continue
+      
+      try:
+        self._mtimes[directory] = os.stat(directory).st_mtime
+        
+        for entry in os.listdir(directory):
+          self._commands.setdefault(entry, []).append(os.path.join(directory, entry))
+      except OSError:
+        self._mtimes[directory] = None # directory doesn't exist or can't be read
+  
+  def is_current(self, path_env, ttl):
+    """
+    Checks if this index is up to date.
+    
+    :param str path_env: current PATH
+    :param float ttl: seconds since we last checked our directories where we presume we're up to date
+    
+    :returns: True if this index reflects the PATH, False otherwise
+    """
+    
+    if path_env != self._path_env:
+      return False
+    elif time.time() - self._last_checked < ttl:
+      return True
+    
+    for directory, mtime in self._mtimes.items():
+      try:
+        if os.stat(directory).st_mtime != mtime: return False
+      except OSError:
+        if mtime is not None: return False
+    
+    self._last_checked = time.time()
+    return True
+  
+  def is_available(self, command):
+    """
+    Checks if an executable by this name is in our PATH.
+    
+    :param str command: name of the command
+    
+    :returns: True if the command is available, False otherwise
+    """
+    
+    return any(os.access(path, os.X_OK) for path in self._commands.get(command, []))
+
+def _call_resolvers(resolvers):
+  """
+  Concurrently runs commands for resolving a pid, providing the first result.
+  
+  :param list resolvers: (command, parser) tuples, where the parser provides a pid from the command's output
+  
+  :returns: int with the process id, None if it can't be determined
+  """
+  
+  if not resolvers: return None
+  
+  parsers = dict(resolvers)
+  commands = [command for command, _ in resolvers]
+  
+  return call_many(commands, lambda command, results: parsers[command](results), RESOLVER_TIMEOUT)
+
+def _parse_pid(value):
+  """
+  Provides a pid from command output.
+  
+  :param str value: output that should be a pid
+  
+  :returns: int with the pid, None if the value isn't a pid
+  """
+  
+  value = value.strip()
+  return int(value) if value.isdigit() else None
+
+def _parse_single_pid(results):
+  """
+  Provides the pid from command output that should be a single pid, such as
+  that of pgrep.
+  
+  :param list results: lines of output from the command
+  
+  :returns: int with the pid, None if the output isn't a single pid
+  """
+  
+  if len(results) == 1:
+    return _parse_pid(results[0])
+
+def _get_cached_pid(lookup, proc_resolver, arg):
+  """
+  Provides the pid from our cache for a lookup if that process is still
+  running, and still matches the lookup. The later is checked via proc for
+  just that process, which is far cheaper than checking all of them.
+  
+  :param tuple lookup: key for the lookup in our PID_CACHE
+  :param functor proc_resolver: proc function that provides the matching pids among those it's given
+  :param object arg: argument for the resolver
+  
+  :returns: int with the cached process id, None if we don't have it
+  """
+  
+  with PID_CACHE_LOCK:
+    if not lookup in PID_CACHE: return None
+    pid, start_time = PID_CACHE[lookup]
+    
+    if _get_start_time(pid) == start_time:
+      try:
+        if proc_resolver(arg, [pid]) == [pid]:
+          return pid
+      except IOError:
+        pass
+    
+    # process exited, no longer matches, or the pid was reused
+    
+    del PID_CACHE[lookup]
+    return None
+
+def _get_start_time(pid):
+  """
+  Provides when a process started, which along with its pid uniquely
+  identifies it.
+  
+  :param int pid: process id of the process to be queried
+  
+  :returns: str with the unix timestamp when the process started, None if it can't be determined
+  """
+  
+  if stem.util.proc.is_available():
+    try: return stem.util.proc.get_stats(pid, stem.util.proc.Stat.START_TIME)[0]
+    except IOError: pass
+  
+  return None
+
 def call(command, suppress_exc = True):
   """
   Issues a command in a subprocess, blocking until completion and returning the
@@ -540,7 +816,21 @@ def call(command, suppress_exc = True):
   
   try:
     start_time = time.time()
-    stdout, stderr = subprocess.Popen(command.split(), stdout = subprocess.PIPE, stderr = subprocess.PIPE).communicate()
+    process = subprocess.Popen(command.split(), stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    
+    with RUNNING_CALLS_LOCK:
+      RUNNING_CALLS[threading.current_thread()] = process
+      is_cancelled = CALL_CANCELLATIONS.get(threading.current_thread())
+      
+      if is_cancelled and is_cancelled.is_set():
+        process.kill() # call_many() was done with us before we started
+    
+    try:
+      stdout, stderr = process.communicate()
+    finally:
+      with RUNNING_CALLS_LOCK:
+        del RUNNING_CALLS[threading.current_thread()]
+    
     stdout, stderr = stdout.strip(), stderr.strip()
     runtime = time.time() - start_time
     
@@ -562,3 +852,76 @@ def call(command, suppress_exc = True):
     if suppress_exc: return None
     else: raise exc
 
+def call_many(commands, parser = None, timeout = None):
+  """
+  Concurrently issues several commands, providing the first valid result. This
+  is for when there's several ways of determining something, where rather than
+  trying each in turn we can run them all and take whichever answers first.
+  Once we have a result (or time out) the commands still running are killed,
+  and those that haven't started yet are never ran.
+  
+  :param list commands: commands to be issued
+  :param functor parser: functor of the form ``my_parser(command, results)`` that provides the result for a command's output, or None if it's invalid (by default the output of the first command that provides any is used)
+  :param float timeout: seconds to wait for the commands, this waits indefinitely if None
+  
+  :returns: result of the parser for the first command that provides a valid one, None if none of them do
+  """
+  
+  if parser is None:
+    parser = lambda command, results: results if results else None
+  
+  results_queue, call_threads = Queue.Queue(), []
+  is_cancelled = threading.Event()
+  
+  def _call(command):
+    try:
+      with RUNNING_CALLS_LOCK:
+        if is_cancelled.is_set(): return
+      
+      results_queue.put((command, call(command)))
+    finally:
+      with RUNNING_CALLS_LOCK:
+        del CALL_CANCELLATIONS[threading.current_thread()]
+  
+  for command in commands:
+    call_thread = threading.Thread(target = _call, args = (command,), name = "System call (%s)" % command)
+    call_thread.setDaemon(True)
+    
+    with RUNNING_CALLS_LOCK:
+      CALL_CANCELLATIONS[call_thread] = is_cancelled
+    
+    call_thread.start()
+    call_threads.append(call_thread)
+  
+  deadline = time.time() + timeout if timeout is not None else None
+  
+  try:
+    for _ in call_threads:
+      if deadline is None:
+        command, results = results_queue.get()
+      else:
+        try:
+          command, results = results_queue.get(True, max(0, deadline - time.time()))
+        except Queue.Empty:
+          log.debug("System calls timed out after %0.2f seconds: %s" % (timeout, ", ".join(commands)))
+          break
+      
+      if results is not None:
+        result = parser(command, results)
+        if result is not None: return result
+  finally:
+    # kills the commands that are still running, and keeps the rest from
+    # starting
+    
+    with RUNNING_CALLS_LOCK:
+      is_cancelled.set()
+      
+      for call_thread in call_threads:
+        process = RUNNING_CALLS.get(call_thread)
+        
+        if process:
+          try: process.kill()
+          except OSError: pass # already finished
+  
+  return None
+
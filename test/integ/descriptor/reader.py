@@ -5,11 +5,18 @@ Integration tests for stem.descriptor.reader.
 import os
 import sys
 import time
+import gzip
+import datetime
+import mimetypes
+import shutil
 import signal
 import tarfile
 import unittest
+import threading
 
 import stem.descriptor.reader
+import stem.descriptor.server_descriptor
+import test.mocking as mocking
 import test.runner
 
 BASIC_LISTING = """
@@ -209,6 +216,27 @@ class TestDescriptorReader(unittest.TestCase):
       time.sleep(0.01)
       self.assertTrue(reader.get_buffered_descriptor_count() <= 2)
   
+  def test_iter_batches(self):
+    """
+    Reads descriptors in batches, checking that we get the same descriptors as
+    when iterating over them individually.
+    """
+    
+    expected_results = _get_raw_tar_descriptors()
+    test_path = os.path.join(DESCRIPTOR_TEST_DATA, "descriptor_archive.tar")
+    
+    with stem.descriptor.reader.DescriptorReader(test_path, buffer_size = 3) as reader:
+      read_descriptors = []
+      
+      for batch in reader.iter_batches(2):
+        self.assertTrue(1 <= len(batch) <= 2)
+        read_descriptors += [str(desc) for desc in batch]
+      
+      self.assertEquals(expected_results, read_descriptors)
+    
+    reader = stem.descriptor.reader.DescriptorReader(test_path)
+    self.assertRaises(ValueError, reader.iter_batches(0).next)
+  
   def test_persistence_path(self):
     """
     Check that the persistence_path argument loads and saves a a processed
@@ -238,6 +266,221 @@ class TestDescriptorReader(unittest.TestCase):
     reader = stem.descriptor.reader.DescriptorReader(descriptor_path, persistence_path = persistence_path)
     with reader: self.assertEqual(0, len(list(reader)))
   
+  def test_appended_file_checkpoints(self):
+    """
+    Checks that when descriptors are appended to a cached-descriptors file we
+    only read the new ones, and that we start over if the file is rewritten.
+    """
+    
+    descriptor_path = os.path.join(DESCRIPTOR_TEST_DATA, "example_descriptor")
+    
+    with open(descriptor_path) as descriptor_file:
+      descriptor_file.readline() # strip header
+      descriptor_contents = descriptor_file.read()
+    
+    cached_path = test.runner.get_runner().get_test_dir("cached-descriptors")
+    
+    def write_cached_descriptors(descriptor_count, mode, modification_time):
+      with open(cached_path, mode) as cached_file:
+        for i in xrange(descriptor_count):
+          cached_file.write("@downloaded-at 2012-03-14 16:31:05\n%s" % descriptor_contents)
+      
+      os.utime(cached_path, (modification_time, modification_time))
+    
+    try:
+      write_cached_descriptors(2, "w", 1000)
+      reader = stem.descriptor.reader.DescriptorReader(cached_path)
+      with reader: self.assertEquals(2, len(list(reader)))
+      
+      cached_size = os.stat(cached_path).st_size
+      checkpoint = reader.get_checkpoints()[cached_path]
+      self.assertEquals((cached_size, cached_size), (checkpoint[0], checkpoint[2]))
+      
+      # persisting the checkpoint, then appending a descriptor
+      
+      persistence_path = _get_processed_files_path()
+      stem.descriptor.reader.save_processed_files(persistence_path, reader.get_processed_files(), reader.get_checkpoints())
+      write_cached_descriptors(1, "a", 2000)
+      
+      reader = stem.descriptor.reader.DescriptorReader(cached_path, persistence_path = persistence_path)
+      self.assertEquals({cached_path: checkpoint}, reader.get_checkpoints())
+      with reader: self.assertEquals(1, len(list(reader)))
+      
+      # rewriting the file with less content makes us read it from the start
+      
+      write_cached_descriptors(1, "w", 3000)
+      with reader: self.assertEquals(1, len(list(reader)))
+    finally:
+      if os.path.exists(cached_path):
+        os.remove(cached_path)
+  
+  def test_partially_valid_file(self):
+    """
+    Reads a file where a valid descriptor is followed by a malformed one,
+    checking that we're provided the valid descriptor and told of the failure.
+    """
+    
+    descriptor_path = os.path.join(DESCRIPTOR_TEST_DATA, "example_descriptor")
+    
+    with open(descriptor_path) as descriptor_file:
+      descriptor_file.readline() # strip header
+      descriptor_contents = descriptor_file.read()
+    
+    cached_path = test.runner.get_runner().get_test_dir("cached-descriptors")
+    
+    try:
+      with open(cached_path, "w") as cached_file:
+        cached_file.write(descriptor_contents)
+        cached_file.write("router malformed_descriptor\n")
+      
+      skip_listener = SkipListener()
+      reader = stem.descriptor.reader.DescriptorReader(cached_path)
+      reader.register_skip_listener(skip_listener.listener)
+      with reader: read_descriptors = [str(desc) for desc in reader]
+      
+      self.assertEquals([descriptor_contents], read_descriptors)
+      self.assertEquals(1, len(skip_listener.results))
+      
+      skipped_path, skip_exception = skip_listener.results[0]
+      self.assertEqual(cached_path, skipped_path)
+      self.assertTrue(isinstance(skip_exception, stem.descriptor.reader.ParsingFailure))
+    finally:
+      if os.path.exists(cached_path):
+        os.remove(cached_path)
+  
+  def test_watch(self):
+    """
+    Watches a directory, checking that we're provided the descriptors of files
+    that are added to it.
+    """
+    
+    descriptor_path = os.path.join(DESCRIPTOR_TEST_DATA, "example_descriptor")
+    
+    with open(descriptor_path) as descriptor_file:
+      descriptor_file.readline() # strip header
+      descriptor_contents = descriptor_file.read()
+    
+    watched_dir = test.runner.get_runner().get_test_dir("watched_descriptors")
+    if not os.path.exists(watched_dir): os.makedirs(os.path.join(watched_dir, "subdir"))
+    shutil.copy(descriptor_path, os.path.join(watched_dir, "initial_descriptor"))
+    
+    reader = stem.descriptor.reader.DescriptorReader(watched_dir)
+    reader.watch(poll_interval = 0.1)
+    
+    # stops the reader if we don't get the descriptors we're waiting for
+    stop_timer = threading.Timer(5, reader.stop)
+    stop_timer.setDaemon(True)
+    stop_timer.start()
+    
+    try:
+      read_descriptors = []
+      
+      for descriptor in reader:
+        read_descriptors.append(str(descriptor))
+        
+        if len(read_descriptors) == 1:
+          shutil.copy(descriptor_path, os.path.join(watched_dir, "subdir", "added_descriptor"))
+        elif len(read_descriptors) == 2:
+          break
+      
+      self.assertEquals([descriptor_contents, descriptor_contents], read_descriptors)
+      self.assertEquals(2, len(reader.get_processed_files()))
+    finally:
+      stop_timer.cancel()
+      stop_timer.join()
+      reader.stop()
+      shutil.rmtree(watched_dir)
+  
+  def test_watch_rewritten_file(self):
+    """
+    Watches a file that's rewritten within the same second that we read it.
+    """
+    
+    descriptor_path = os.path.join(DESCRIPTOR_TEST_DATA, "example_descriptor")
+    
+    with open(descriptor_path) as descriptor_file:
+      descriptor_file.readline() # strip header
+      descriptor_contents = descriptor_file.read()
+    
+    watched_dir = test.runner.get_runner().get_test_dir("watched_descriptors")
+    if not os.path.exists(watched_dir): os.makedirs(watched_dir)
+    watched_path = os.path.join(watched_dir, "rewritten_descriptor")
+    
+    last_modified = int(time.time())
+    shutil.copy(descriptor_path, watched_path)
+    os.utime(watched_path, (last_modified, last_modified + 0.1))
+    
+    reader = stem.descriptor.reader.DescriptorReader(watched_dir)
+    reader.watch(poll_interval = 0.1)
+    
+    stop_timer = threading.Timer(5, reader.stop)
+    stop_timer.setDaemon(True)
+    stop_timer.start()
+    
+    try:
+      read_descriptors = []
+      
+      for descriptor in reader:
+        read_descriptors.append(str(descriptor))
+        
+        if len(read_descriptors) == 1:
+          shutil.copy(descriptor_path, watched_path)
+          os.utime(watched_path, (last_modified, last_modified + 0.5))
+        elif len(read_descriptors) == 2:
+          break
+      
+      self.assertEquals([descriptor_contents, descriptor_contents], read_descriptors)
+    finally:
+      stop_timer.cancel()
+      stop_timer.join()
+      reader.stop()
+      shutil.rmtree(watched_dir)
+  
+  def test_watch_removed_file(self):
+    """
+    Watches a directory where a file we've read is removed, checking that we
+    forget about it.
+    """
+    
+    descriptor_path = os.path.join(DESCRIPTOR_TEST_DATA, "example_descriptor")
+    watched_dir = test.runner.get_runner().get_test_dir("watched_descriptors")
+    if not os.path.exists(watched_dir): os.makedirs(watched_dir)
+    watched_path = os.path.join(watched_dir, "removed_descriptor")
+    shutil.copy(descriptor_path, watched_path)
+    
+    for watcher in ("inotify", "polling"):
+      if watcher == "polling":
+        mocking.mock(stem.descriptor.reader._InotifyWatcher, mocking.raise_exception(OSError("inotify is unavailable")))
+      
+      reader = stem.descriptor.reader.DescriptorReader(watched_dir)
+      reader.watch(poll_interval = 0.1)
+      
+      try:
+        iter(reader).next()
+        
+        # processed files are updated after we've finished reading them
+        
+        for _ in xrange(50):
+          if reader.get_processed_files(): break
+          time.sleep(0.1)
+        
+        self.assertEquals([watched_path], reader.get_processed_files().keys())
+        
+        os.remove(watched_path)
+        
+        for _ in xrange(50):
+          if not reader.get_processed_files(): break
+          time.sleep(0.1)
+        
+        self.assertEquals({}, reader.get_processed_files())
+        self.assertEquals({}, reader._read_stamps)
+      finally:
+        reader.stop()
+        mocking.revert_mocking()
+        shutil.copy(descriptor_path, watched_path)
+    
+    shutil.rmtree(watched_dir)
+  
   def test_archived_uncompressed(self):
     """
     Checks that we can read descriptors from an uncompressed archive.
@@ -274,6 +517,139 @@ class TestDescriptorReader(unittest.TestCase):
       read_descriptors = [str(desc) for desc in list(reader)]
       self.assertEquals(expected_results, read_descriptors)
   
+  def test_archived_without_extension(self):
+    """
+    Checks that we recognize archives by their contents rather than their file
+    extension.
+    """
+    
+    expected_results = _get_raw_tar_descriptors()
+    test_path = test.runner.get_runner().get_test_dir("descriptor_archive")
+    shutil.copyfile(os.path.join(DESCRIPTOR_TEST_DATA, "descriptor_archive.tar.gz"), test_path)
+    
+    try:
+      with stem.descriptor.reader.DescriptorReader(test_path) as reader:
+        read_descriptors = [str(desc) for desc in list(reader)]
+        self.assertEquals(expected_results, read_descriptors)
+    finally:
+      os.remove(test_path)
+  
+  def test_deduplicate(self):
+    """
+    Reads several archives with the same descriptors, checking that we only
+    provide the first copy of each and persist what we've seen.
+    """
+    
+    expected_results = _get_raw_tar_descriptors()
+    test_paths = [os.path.join(DESCRIPTOR_TEST_DATA, "descriptor_archive.tar%s" % suffix) for suffix in ("", ".gz", ".bz2")]
+    persistence_path = _get_processed_files_path()
+    
+    reader = stem.descriptor.reader.DescriptorReader(test_paths, persistence_path = persistence_path, deduplicate = True)
+    
+    with reader:
+      read_descriptors = [str(desc) for desc in list(reader)]
+      self.assertEquals(expected_results, read_descriptors)
+    
+    self.assertEquals(len(expected_results), len(reader.get_seen_digests()))
+    
+    # a new reader that's given the persisted digests has nothing left to provide
+    
+    test_path = test.runner.get_runner().get_test_dir("descriptor_archive")
+    shutil.copyfile(test_paths[0], test_path)
+    
+    try:
+      reader = stem.descriptor.reader.DescriptorReader(test_path, persistence_path = persistence_path, deduplicate = True)
+      with reader: self.assertEquals(0, len(list(reader)))
+    finally:
+      os.remove(test_path)
+  
+  def test_deduplicate_malformed(self):
+    """
+    Deduplicates a descriptor that fails to parse, checking that it isn't
+    remembered as having been read.
+    """
+    
+    with open(os.path.join(DESCRIPTOR_TEST_DATA, "example_descriptor")) as descriptor_file:
+      descriptor_contents = descriptor_file.read()
+    
+    test_path = test.runner.get_runner().get_test_dir("malformed_descriptor")
+    
+    try:
+      with open(test_path, "w") as test_file:
+        test_file.write(descriptor_contents.replace("bandwidth 153600 256000 104590", "bandwidth 153600 blarg"))
+      
+      skip_listener = SkipListener()
+      reader = stem.descriptor.reader.DescriptorReader(test_path, deduplicate = True)
+      reader.register_skip_listener(skip_listener.listener)
+      with reader: self.assertEquals(0, len(list(reader)))
+      
+      self.assertEquals(1, len(skip_listener.results))
+      self.assertTrue(isinstance(skip_listener.results[0][1], stem.descriptor.reader.ParsingFailure))
+      self.assertEquals([], reader.get_seen_digests())
+    finally:
+      os.remove(test_path)
+  
+  def test_filter(self):
+    """
+    Reads an archive and descriptor files, only providing those that match a
+    filter.
+    """
+    
+    test_paths = [os.path.join(DESCRIPTOR_TEST_DATA, filename) for filename in ("descriptor_archive.tar", "example_descriptor", "extrainfo_descriptor")]
+    
+    descriptor_filter = stem.descriptor.reader.DescriptorFilter(nicknames = ["Amunet1", "caerSidi", "NINJA"])
+    
+    with stem.descriptor.reader.DescriptorReader(test_paths, filter = descriptor_filter) as reader:
+      self.assertEquals(["Amunet1", "caerSidi", "NINJA"], [desc.nickname for desc in reader])
+    
+    descriptor_filter = stem.descriptor.reader.DescriptorFilter(
+      published_before = datetime.datetime(2012, 3, 1, 12),
+      descriptor_types = [stem.descriptor.server_descriptor.RelayDescriptor],
+    )
+    
+    with stem.descriptor.reader.DescriptorReader(test_paths, filter = descriptor_filter) as reader:
+      self.assertEquals(["Amunet11", "Amunet3"], [desc.nickname for desc in reader])
+  
+  def test_cache(self):
+    """
+    Reads an archive with use_cache, checking that later runs read its cache
+    rather than the archive.
+    """
+    
+    expected_results = _get_raw_tar_descriptors()
+    test_path = test.runner.get_runner().get_test_dir("descriptor_archive.tar.gz")
+    cache_path = test_path + stem.descriptor.reader.CACHE_SUFFIX
+    shutil.copyfile(os.path.join(DESCRIPTOR_TEST_DATA, "descriptor_archive.tar.gz"), test_path)
+    os.utime(test_path, (1000, 1000))
+    
+    try:
+      with stem.descriptor.reader.DescriptorReader(test_path, use_cache = True) as reader:
+        initial_descriptors = list(reader)
+      
+      self.assertEquals(expected_results, [str(desc) for desc in initial_descriptors])
+      self.assertTrue(os.path.exists(cache_path))
+      
+      # the archive is no longer readable, but our cache is still newer
+      
+      with open(test_path, "w") as test_file:
+        test_file.write("not an archive")
+      
+      os.utime(test_path, (1000, 1000))
+      
+      with stem.descriptor.reader.DescriptorReader(test_path, use_cache = True) as reader:
+        cached_descriptors = list(reader)
+      
+      self.assertEquals(expected_results, [str(desc) for desc in cached_descriptors])
+      
+      for initial_desc, cached_desc in zip(initial_descriptors, cached_descriptors):
+        self.assertEquals(initial_desc.nickname, cached_desc.nickname)
+        self.assertEquals(initial_desc.published, cached_desc.published)
+        self.assertEquals(initial_desc.exit_policy, cached_desc.exit_policy)
+        self.assertEquals(test_path, cached_desc.get_path())
+    finally:
+      for path in (test_path, cache_path):
+        if os.path.exists(path): os.remove(path)
+  
   def test_stop(self):
     """
     Runs a DescriptorReader over the root directory, then checks that calling
@@ -396,6 +772,40 @@ class TestDescriptorReader(unittest.TestCase):
       if os.path.exists(test_path):
         os.remove(test_path)
   
+  def test_skip_listener_unreadable_contents(self):
+    """
+    Listens for empty files and compressed files that aren't tarballs, which
+    are skipped as unrecognized types.
+    """
+    
+    test_dir = test.runner.get_runner().get_test_dir("unreadable_contents")
+    empty_path = os.path.join(test_dir, "empty_descriptor")
+    gzip_path = os.path.join(test_dir, "compressed_descriptor.gz")
+    
+    try:
+      os.makedirs(test_dir)
+      open(empty_path, "w").close()
+      
+      gzip_file = gzip.open(gzip_path, "w")
+      gzip_file.write("test data for test_skip_listener_unreadable_contents()")
+      gzip_file.close()
+      
+      skip_listener = SkipListener()
+      reader = stem.descriptor.reader.DescriptorReader(test_dir)
+      reader.register_skip_listener(skip_listener.listener)
+      with reader: self.assertEquals([], list(reader))
+      
+      skipped = dict(skip_listener.results)
+      self.assertEquals(2, len(skipped))
+      
+      self.assertTrue(isinstance(skipped[empty_path], stem.descriptor.reader.UnrecognizedType))
+      self.assertEqual(None, skipped[empty_path].mime_type)
+      
+      self.assertTrue(isinstance(skipped[gzip_path], stem.descriptor.reader.UnrecognizedType))
+      self.assertEqual(mimetypes.guess_type(gzip_path), skipped[gzip_path].mime_type)
+    finally:
+      shutil.rmtree(test_dir, True)
+  
   def test_skip_listener_read_failure(self):
     """
     Listens for a file that's skipped because we lack read permissions.
@@ -4,9 +4,11 @@ Integration tests for stem.descriptor.server_descriptor.
 
 import os
 import datetime
+import StringIO
 import unittest
 
 import stem.control
+import stem.exit_policy
 import stem.version
 import stem.descriptor.server_descriptor
 import test.runner
@@ -78,7 +80,7 @@ Qlx9HNCqCY877ztFRC624ja2ql6A2hBcuoYMbkHjcQ4=
     self.assertEquals(153600, desc.average_bandwidth)
     self.assertEquals(256000, desc.burst_bandwidth)
     self.assertEquals(104590, desc.observed_bandwidth)
-    self.assertEquals(["reject *:*"], desc.exit_policy)
+    self.assertEquals(stem.exit_policy.ExitPolicy("reject *:*"), desc.exit_policy)
     self.assertEquals(expected_onion_key, desc.onion_key)
     self.assertEquals(expected_signing_key, desc.signing_key)
     self.assertEquals(expected_signature, desc.signature)
@@ -131,10 +133,10 @@ Qlx9HNCqCY877ztFRC624ja2ql6A2hBcuoYMbkHjcQ4=
     # the initial contents for the line and parsed values.
     
     read_values_start = [20774, 489973, 510022, 511163, 20949]
-    self.assertEquals(read_values_start, desc.read_history_values[:5])
+    self.assertEquals(read_values_start, list(desc.read_history_values[:5]))
     
     write_values_start = [81, 8848, 8927, 8927, 83, 8848, 8931, 8929, 81, 8846]
-    self.assertEquals(write_values_start, desc.write_history_values[:10])
+    self.assertEquals(write_values_start, list(desc.write_history_values[:10]))
   
   def test_cached_descriptor(self):
     """
@@ -170,6 +172,80 @@ Qlx9HNCqCY877ztFRC624ja2ql6A2hBcuoYMbkHjcQ4=
           
           self.fail("Unrecognized descriptor content: %s" % unrecognized_lines)
   
+  def test_get_digests(self):
+    """
+    Checks that get_digests() provides the same digests as parsed descriptors.
+    """
+    
+    descriptor_path = test.integ.descriptor.get_resource("example_descriptor")
+    
+    with open(descriptor_path) as descriptor_file:
+      expected_digests = [desc.digest() for desc in stem.descriptor.server_descriptor.parse_file(descriptor_file)]
+    
+    with open(descriptor_path) as descriptor_file:
+      self.assertEquals(expected_digests, list(stem.descriptor.server_descriptor.get_digests(descriptor_file)))
+    
+    with open(descriptor_path) as descriptor_file:
+      descriptor_file = StringIO.StringIO(descriptor_file.read())
+      self.assertEquals(expected_digests, list(stem.descriptor.server_descriptor.get_digests(descriptor_file)))
+  
+  def test_is_valid(self):
+    """
+    Checks the signature of a descriptor from metrics, and one whose content
+    has been altered.
+    """
+    
+    if not stem.descriptor.server_descriptor.IS_RSA_AVAILABLE:
+      self.skipTest("(rsa module unavailable)")
+    
+    descriptor_path = test.integ.descriptor.get_resource("example_descriptor")
+    
+    with open(descriptor_path) as descriptor_file:
+      desc = stem.descriptor.server_descriptor.parse_file(descriptor_file).next()
+    
+    altered_desc = stem.descriptor.server_descriptor.RelayDescriptor(str(desc).replace("caerSidi", "caerSidj"), False)
+    
+    self.assertTrue(desc.is_valid())
+    self.assertFalse(altered_desc.is_valid())
+    self.assertEquals([True, False, True], stem.descriptor.server_descriptor.verify_signatures([desc, altered_desc, desc], 2))
+  
+  def test_mapped_cached_descriptors(self):
+    """
+    Parses a cached-descriptors file with annotations, checking that reading it
+    through a memory map provides the same descriptors as reading it line by
+    line.
+    """
+    
+    descriptor_path = test.integ.descriptor.get_resource("example_descriptor")
+    
+    with open(descriptor_path) as descriptor_file:
+      descriptor_file.readline() # strip header
+      descriptor_contents = descriptor_file.read()
+    
+    cached_contents = "@downloaded-at 2012-03-14 16:31:05\n@source \"145.53.65.130\"\n%s@downloaded-at 2012-03-15 16:31:05\n%s@trailing-annotation\n" % (descriptor_contents, descriptor_contents)
+    cached_path = test.runner.get_runner().get_test_dir("mapped_cached_descriptors")
+    
+    with open(cached_path, "w") as cached_file:
+      cached_file.write(cached_contents)
+    
+    try:
+      with open(cached_path) as cached_file:
+        mapped_descriptors = list(stem.descriptor.server_descriptor.parse_file(cached_file))
+        self.assertEquals(cached_contents.find("@trailing-annotation"), cached_file.tell())
+      
+      read_descriptors = list(stem.descriptor.server_descriptor.parse_file(StringIO.StringIO(cached_contents)))
+      
+      self.assertEquals(2, len(mapped_descriptors))
+      self.assertEquals(["@downloaded-at 2012-03-14 16:31:05", "@source \"145.53.65.130\""], mapped_descriptors[0].get_annotation_lines())
+      self.assertEquals(["@downloaded-at 2012-03-15 16:31:05"], mapped_descriptors[1].get_annotation_lines())
+      
+      for mapped_desc, read_desc in zip(mapped_descriptors, read_descriptors):
+        self.assertEquals(str(read_desc), str(mapped_desc))
+        self.assertEquals(read_desc.get_annotation_lines(), mapped_desc.get_annotation_lines())
+        self.assertEquals("caerSidi", mapped_desc.nickname)
+    finally:
+      os.remove(cached_path)
+  
   def test_non_ascii_descriptor(self):
     """
     Parses a descriptor with non-ascii content.
@@ -208,7 +284,7 @@ Qlx9HNCqCY877ztFRC624ja2ql6A2hBcuoYMbkHjcQ4=
     self.assertEquals(81920, desc.average_bandwidth)
     self.assertEquals(102400, desc.burst_bandwidth)
     self.assertEquals(84275, desc.observed_bandwidth)
-    self.assertEquals(["reject *:*"], desc.exit_policy)
+    self.assertEquals(stem.exit_policy.ExitPolicy("reject *:*"), desc.exit_policy)
     self.assertEquals([], desc.get_unrecognized_lines())
   
   def test_cr_in_contact_line(self):
@@ -306,7 +382,7 @@ Qlx9HNCqCY877ztFRC624ja2ql6A2hBcuoYMbkHjcQ4=
     self.assertEquals(409600, desc.average_bandwidth)
     self.assertEquals(819200, desc.burst_bandwidth)
     self.assertEquals(5120, desc.observed_bandwidth)
-    self.assertEquals(["reject *:*"], desc.exit_policy)
+    self.assertEquals(stem.exit_policy.ExitPolicy("reject *:*"), desc.exit_policy)
     self.assertEquals("006FD96BA35E7785A6A3B8B75FE2E2435A13BDB4", desc.digest())
     self.assertEquals([], desc.get_unrecognized_lines())
 
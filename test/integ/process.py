@@ -3,6 +3,8 @@ Tests the stem.process functions with various use cases.
 """
 
 import time
+import shutil
+import tempfile
 import unittest
 
 import stem.socket
@@ -39,6 +41,83 @@ class TestProcess(unittest.TestCase):
       if control_socket: control_socket.close()
       tor_process.kill()
   
+  def test_launch_tor_many(self):
+    """
+    Exercises launch_tor_many by starting a couple tor instances at once.
+    """
+    
+    test.runner.only_run_once(self, "test_launch_tor_many")
+    
+    configs = [
+      {'SocksPort': '2777', 'ControlPort': '2778', 'DataDirectory': tempfile.mkdtemp()},
+      {'SocksPort': '2779', 'ControlPort': '2780', 'DataDirectory': tempfile.mkdtemp()},
+    ]
+    
+    tor_processes = []
+    
+    try:
+      for config, tor_process in stem.process.launch_tor_many(configs, completion_percent = 5):
+        tor_processes.append(tor_process)
+        
+        control_socket = stem.socket.ControlPort(control_port = int(config['ControlPort']))
+        control_socket.close()
+      
+      self.assertEquals(2, len(tor_processes))
+    finally:
+      for tor_process in tor_processes:
+        tor_process.kill()
+      
+      for config in configs:
+        shutil.rmtree(config['DataDirectory'], True)
+  
+  def test_launch_tor_many_with_timeout(self):
+    """
+    Runs launch_tor_many where it times out before completing.
+    """
+    
+    test.runner.only_run_once(self, "test_launch_tor_many_with_timeout")
+    
+    start_time = time.time()
+    self.assertRaises(OSError, list, stem.process.launch_tor_many([{'SocksPort': '2777'}], "tor", 100, None, 2))
+    runtime = time.time() - start_time
+    
+    if not (runtime > 2 and runtime < 3):
+      self.fail("Test should have taken 2-3 seconds, took %i instead" % runtime)
+  
+  def test_tor_process_pool(self):
+    """
+    Acquires and releases tor processes from a TorProcessPool.
+    """
+    
+    test.runner.only_run_once(self, "test_tor_process_pool")
+    
+    with stem.process.TorProcessPool(2, completion_percent = 5) as pool:
+      first_instance = pool.acquire()
+      second_instance = pool.acquire()
+      
+      self.assertNotEqual(first_instance.control_port, second_instance.control_port)
+      self.assertTrue(first_instance.controller.get_info("version"))
+      self.assertRaises(OSError, pool.acquire, 0.1)
+      
+      # reused processes are provided again, with a new controller
+      
+      pool.release(first_instance)
+      self.assertEquals(None, first_instance.controller)
+      self.assertEquals(first_instance, pool.acquire())
+      self.assertTrue(first_instance.controller.get_info("version"))
+      
+      # fresh processes are replaced in the background
+      
+      pool.release(second_instance, False)
+      self.assertFalse(second_instance.is_alive())
+      
+      replacement = pool.acquire(stem.process.DEFAULT_INIT_TIMEOUT)
+      self.assertNotEqual(second_instance, replacement)
+      self.assertEquals(second_instance.control_port, replacement.control_port)
+    
+    self.assertFalse(first_instance.is_alive())
+    self.assertFalse(replacement.is_alive())
+  
   def test_launch_tor_with_timeout(self):
     """
     Runs launch_tor where it times out before completing.
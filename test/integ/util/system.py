@@ -4,9 +4,12 @@ that we're running.
 """
 
 import os
+import shutil
 import getpass
+import tempfile
 import unittest
 
+import stem.util.proc
 import stem.util.system
 import test.runner
 import test.mocking as mocking
@@ -49,6 +52,8 @@ class TestSystem(unittest.TestCase):
         ps_results = stem.util.system.call(stem.util.system.GET_PID_BY_NAME_PS_BSD)
         results = [r for r in ps_results if r.endswith(" tor")]
         self.is_extra_tor_running = len(results) > 1
+    
+    stem.util.system.PID_CACHE.clear()
   
   def tearDown(self):
     mocking.revert_mocking()
@@ -64,6 +69,32 @@ class TestSystem(unittest.TestCase):
     # but it would be kinda weird if this did...
     self.assertFalse(stem.util.system.is_available("blarg_and_stuff"))
   
+  def test_is_available_path_changes(self):
+    """
+    Checks that stem.util.system.is_available notices commands that are added
+    to our PATH.
+    """
+    
+    test_dir = tempfile.mkdtemp()
+    command_path = os.path.join(test_dir, "stem_test_command")
+    original_path = os.environ.get("PATH", "")
+    
+    try:
+      os.environ["PATH"] = os.pathsep.join((original_path, test_dir))
+      self.assertFalse(stem.util.system.is_available("stem_test_command"))
+      
+      open(command_path, "w").close()
+      self.assertFalse(stem.util.system.is_available("stem_test_command", False))
+      
+      os.chmod(command_path, 0755)
+      self.assertTrue(stem.util.system.is_available("stem_test_command", False))
+      
+      os.environ["PATH"] = original_path
+      self.assertFalse(stem.util.system.is_available("stem_test_command"))
+    finally:
+      os.environ["PATH"] = original_path
+      shutil.rmtree(test_dir)
+  
   def test_is_running(self):
     """
     Checks the stem.util.system.is_running function.
@@ -96,6 +127,7 @@ class TestSystem(unittest.TestCase):
       self.skipTest("(pgrep unavailable)")
     
     pgrep_prefix = stem.util.system.GET_PID_BY_NAME_PGREP % ""
+    mocking.mock(stem.util.proc.is_available, mocking.return_false())
     mocking.mock(stem.util.system.call, filter_system_call([pgrep_prefix]))
     
     tor_pid = test.runner.get_runner().get_pid()
@@ -112,6 +144,7 @@ class TestSystem(unittest.TestCase):
       self.skipTest("(pidof unavailable)")
     
     pidof_prefix = stem.util.system.GET_PID_BY_NAME_PIDOF % ""
+    mocking.mock(stem.util.proc.is_available, mocking.return_false())
     mocking.mock(stem.util.system.call, filter_system_call([pidof_prefix]))
     
     tor_pid = test.runner.get_runner().get_pid()
@@ -130,6 +163,7 @@ class TestSystem(unittest.TestCase):
       self.skipTest("(linux only)")
     
     ps_prefix = stem.util.system.GET_PID_BY_NAME_PS_LINUX % ""
+    mocking.mock(stem.util.proc.is_available, mocking.return_false())
     mocking.mock(stem.util.system.call, filter_system_call([ps_prefix]))
     
     tor_pid = test.runner.get_runner().get_pid()
@@ -148,6 +182,7 @@ class TestSystem(unittest.TestCase):
       self.skipTest("(bsd only)")
     
     ps_prefix = stem.util.system.GET_PID_BY_NAME_PS_BSD
+    mocking.mock(stem.util.proc.is_available, mocking.return_false())
     mocking.mock(stem.util.system.call, filter_system_call([ps_prefix]))
     
     tor_pid = test.runner.get_runner().get_pid()
@@ -167,6 +202,7 @@ class TestSystem(unittest.TestCase):
       self.skipTest("(DisableDebuggerAttachment is set)")
     
     lsof_prefix = stem.util.system.GET_PID_BY_NAME_LSOF % ""
+    mocking.mock(stem.util.proc.is_available, mocking.return_false())
     mocking.mock(stem.util.system.call, filter_system_call([lsof_prefix]))
     
     tor_pid = test.runner.get_runner().get_pid()
@@ -203,6 +239,7 @@ class TestSystem(unittest.TestCase):
       self.skipTest("(DisableDebuggerAttachment is set)")
     
     netstat_prefix = stem.util.system.GET_PID_BY_PORT_NETSTAT
+    mocking.mock(stem.util.proc.is_available, mocking.return_false())
     mocking.mock(stem.util.system.call, filter_system_call([netstat_prefix]))
     
     tor_pid = test.runner.get_runner().get_pid()
@@ -224,6 +261,7 @@ class TestSystem(unittest.TestCase):
       self.skipTest("(DisableDebuggerAttachment is set)")
     
     sockstat_prefix = stem.util.system.GET_PID_BY_PORT_SOCKSTAT % ""
+    mocking.mock(stem.util.proc.is_available, mocking.return_false())
     mocking.mock(stem.util.system.call, filter_system_call([sockstat_prefix]))
     
     tor_pid = test.runner.get_runner().get_pid()
@@ -243,6 +281,7 @@ class TestSystem(unittest.TestCase):
       self.skipTest("(DisableDebuggerAttachment is set)")
     
     lsof_prefix = stem.util.system.GET_PID_BY_PORT_LSOF
+    mocking.mock(stem.util.proc.is_available, mocking.return_false())
     mocking.mock(stem.util.system.call, filter_system_call([lsof_prefix]))
     
     tor_pid = test.runner.get_runner().get_pid()
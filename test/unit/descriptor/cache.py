@@ -0,0 +1,72 @@
+"""
+Unit tests for stem.descriptor.cache.
+"""
+
+import os
+import cPickle
+import unittest
+import StringIO
+
+import stem.descriptor.cache
+from stem.descriptor.server_descriptor import RelayDescriptor
+from stem.descriptor.extrainfo_descriptor import ExtraInfoDescriptor
+from test.unit.descriptor.server_descriptor import _make_descriptor as _make_relay_descriptor
+from test.unit.descriptor.extrainfo_descriptor import _make_descriptor as _make_extrainfo_descriptor
+
+class TestDescriptorCache(unittest.TestCase):
+  def test_dump_and_load(self):
+    """
+    Writes descriptors to a cache and reads them back.
+    """
+    
+    relay_desc = RelayDescriptor(_make_relay_descriptor({"read-history": "2012-05-03 12:07:50 (900 s) 1,2,3"}))
+    extrainfo_desc = ExtraInfoDescriptor(_make_extrainfo_descriptor())
+    
+    cache_file = StringIO.StringIO()
+    stem.descriptor.cache.dump([relay_desc, extrainfo_desc], cache_file)
+    cache_file.seek(0)
+    
+    loaded_relay_desc, loaded_extrainfo_desc = list(stem.descriptor.cache.load(cache_file))
+    
+    self.assertTrue(isinstance(loaded_relay_desc, RelayDescriptor))
+    self.assertEquals(str(relay_desc), str(loaded_relay_desc))
+    self.assertEquals(relay_desc.nickname, loaded_relay_desc.nickname)
+    self.assertEquals(relay_desc.published, loaded_relay_desc.published)
+    self.assertEquals(relay_desc.exit_policy, loaded_relay_desc.exit_policy)
+    self.assertEquals([1, 2, 3], list(loaded_relay_desc.read_history_values))
+    
+    self.assertTrue(isinstance(loaded_extrainfo_desc, ExtraInfoDescriptor))
+    self.assertEquals(str(extrainfo_desc), str(loaded_extrainfo_desc))
+    self.assertEquals(extrainfo_desc.nickname, loaded_extrainfo_desc.nickname)
+  
+  def test_malformed_cache(self):
+    """
+    Loads caches that are truncated, aren't caches, or are from a different
+    version of stem.
+    """
+    
+    cache_file = StringIO.StringIO()
+    stem.descriptor.cache.dump([RelayDescriptor(_make_relay_descriptor())], cache_file)
+    cache_content = cache_file.getvalue()
+    
+    other_version_header = stem.descriptor.cache.HEADER.pack(stem.descriptor.cache.MAGIC, stem.descriptor.cache.FORMAT_VERSION, "0.0.0")
+    
+    test_inputs = (
+      cache_content[:-1],
+      cache_content[:stem.descriptor.cache.HEADER.size + 2],
+      "not a cache",
+      other_version_header + cache_content[stem.descriptor.cache.HEADER.size:],
+    )
+    
+    for test_input in test_inputs:
+      self.assertRaises(ValueError, list, stem.descriptor.cache.load(StringIO.StringIO(test_input)))
+  
+  def test_unsafe_record(self):
+    """
+    Deserializes a record that would call something other than descriptor
+    related classes.
+    """
+    
+    unsafe_record = cPickle.dumps(os.getcwd, cPickle.HIGHEST_PROTOCOL)
+    self.assertRaises(ValueError, stem.descriptor.cache.deserialize, unsafe_record)
+
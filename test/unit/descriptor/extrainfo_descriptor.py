@@ -4,7 +4,8 @@ Unit tests for stem.descriptor.extrainfo_descriptor.
 
 import datetime
 import unittest
-from stem.descriptor.extrainfo_descriptor import ExtraInfoDescriptor, DirResponses, DirStats
+from stem.descriptor import ValidationLevel
+from stem.descriptor.extrainfo_descriptor import ExtraInfoDescriptor, DirResponses, DirStats, get_history_matrix
 
 CRYPTO_BLOB = """
 K5FSywk7qvw/boA4DQcqkls6Ize5vcBYfhQ8JnOeRQC9+uDxbnpm3qaYN9jZ8myj
@@ -89,6 +90,23 @@ class TestExtraInfoDescriptor(unittest.TestCase):
     desc_text = _make_descriptor() + "\nexit-streams-opened port=80"
     self._expect_invalid_attr(desc_text)
   
+  def test_validation_levels(self):
+    """
+    Checks that structural issues are caught without validating fields.
+    """
+    
+    desc_text = _make_descriptor({"geoip-db-digest": "blarg"})
+    self.assertRaises(ValueError, ExtraInfoDescriptor, desc_text, ValidationLevel.FULL)
+    
+    desc = ExtraInfoDescriptor(desc_text, ValidationLevel.STRUCTURE)
+    self.assertEquals("ninja", desc.nickname)
+    
+    desc_text = _make_descriptor(exclude = ["published"])
+    self.assertRaises(ValueError, ExtraInfoDescriptor, desc_text, ValidationLevel.STRUCTURE)
+    
+    desc = ExtraInfoDescriptor(desc_text, ValidationLevel.NONE)
+    self.assertEquals(None, desc.published)
+  
   def test_extrainfo_line_missing_fields(self):
     """
     Checks that validation catches when the extra-info line is missing fields
@@ -411,7 +429,7 @@ class TestExtraInfoDescriptor(unittest.TestCase):
         desc = ExtraInfoDescriptor(desc_text)
         self.assertEquals(datetime.datetime(2012, 5, 3, 12, 7, 50), getattr(desc, end_attr))
         self.assertEquals(500, getattr(desc, interval_attr))
-        self.assertEquals(expected_values, getattr(desc, values_attr))
+        self.assertEquals(expected_values, list(getattr(desc, values_attr)))
       
       test_entries = (
         "",
@@ -431,6 +449,54 @@ class TestExtraInfoDescriptor(unittest.TestCase):
         self.assertEquals(None, getattr(desc, interval_attr))
         self.assertEquals(None, getattr(desc, values_attr))
   
+  def test_history_matrix(self):
+    """
+    Aligns the read-history of several descriptors.
+    """
+    
+    desc1 = ExtraInfoDescriptor(_make_descriptor({"read-history": "2012-05-03 12:15:00 (900 s) 1,2,3"}))
+    desc2 = ExtraInfoDescriptor(_make_descriptor({"read-history": "2012-05-03 12:45:00 (900 s) 4,5"}))
+    desc3 = ExtraInfoDescriptor(_make_descriptor())
+    
+    end_times, rows = get_history_matrix([desc1, desc2, desc3])
+    
+    expected_times = [datetime.datetime(2012, 5, 3, 11, 45) + datetime.timedelta(minutes = 15 * i) for i in range(5)]
+    self.assertEquals(expected_times, end_times)
+    self.assertEquals([1, 2, 3, -1, -1], list(rows[0]))
+    self.assertEquals([-1, -1, -1, 4, 5], list(rows[1]))
+    self.assertEquals([-1] * 5, list(rows[2]))
+    
+    self.assertEquals(([], []), get_history_matrix([]))
+    
+    desc4 = ExtraInfoDescriptor(_make_descriptor({"read-history": "2012-05-03 12:45:00 (500 s) 4,5"}))
+    self.assertRaises(ValueError, get_history_matrix, [desc1, desc4])
+  
+  def test_history_matrix_unaligned(self):
+    """
+    Aligns histories that don't end on the interval's boundaries.
+    """
+    
+    desc1 = ExtraInfoDescriptor(_make_descriptor({"read-history": "2012-05-03 17:02:45 (900 s) 1,2,3"}))
+    desc2 = ExtraInfoDescriptor(_make_descriptor({"read-history": "2012-05-03 17:10:00 (900 s) 4,5"}))
+    
+    # a lone history keeps its own end times
+    
+    end_times, rows = get_history_matrix([desc1])
+    
+    expected_times = [datetime.datetime(2012, 5, 3, 16, 32, 45) + datetime.timedelta(minutes = 15 * i) for i in range(3)]
+    self.assertEquals(expected_times, end_times)
+    self.assertEquals([1, 2, 3], list(rows[0]))
+    
+    # others are placed in the nearest columns to the latest end time
+    
+    end_times, rows = get_history_matrix([desc1, desc2])
+    
+    expected_times = [datetime.datetime(2012, 5, 3, 16, 40) + datetime.timedelta(minutes = 15 * i) for i in range(3)]
+    self.assertEquals(expected_times, end_times)
+    self.assertEquals([1, 2, 3], list(rows[0]))
+    self.assertEquals([-1, 4, 5], list(rows[1]))
+  
+  
   def test_port_mapping_lines(self):
     """
     Uses valid and invalid data to tests lines of the form...
@@ -2,10 +2,13 @@
 Unit tests for stem.descriptor.reader.
 """
 
+import datetime
 import unittest
 import StringIO
 
 import stem.descriptor.reader
+import stem.descriptor.server_descriptor
+import stem.descriptor.extrainfo_descriptor
 import test.mocking as mocking
 
 class TestDescriptorReader(unittest.TestCase):
@@ -93,4 +96,149 @@ class TestDescriptorReader(unittest.TestCase):
     mocking.support_with(test_content)
     mocking.mock(open, mocking.return_value(test_content))
     self.assertRaises(TypeError, stem.descriptor.reader.load_processed_files, "")
+  
+  def test_load_processed_files_checkpoints(self):
+    """
+    Loads a listing where some of the files have read checkpoints.
+    """
+    
+    test_lines = (
+      "/dir/file 12345",
+      "/dir/cached-descriptors 12345 2048:5981:4096",
+      "/dir/with spaces/cached-extrainfo 7138743 0:12:0",
+    )
+    
+    expected_processed_files = {
+      "/dir/file": 12345,
+      "/dir/cached-descriptors": 12345,
+      "/dir/with spaces/cached-extrainfo": 7138743,
+    }
+    
+    expected_checkpoints = {
+      "/dir/cached-descriptors": (2048, 5981, 4096),
+      "/dir/with spaces/cached-extrainfo": (0, 12, 0),
+    }
+    
+    test_content = StringIO.StringIO("\n".join(test_lines))
+    mocking.support_with(test_content)
+    mocking.mock(open, mocking.return_value(test_content))
+    self.assertEquals(expected_processed_files, stem.descriptor.reader.load_processed_files(""))
+    
+    test_content.seek(0)
+    self.assertEquals((expected_processed_files, expected_checkpoints), stem.descriptor.reader.load_processed_files("", True))
+  
+  def test_load_processed_files_malformed_checkpoint(self):
+    """
+    Tests the load_processed_files() function content that is malformed because
+    it has an invalid read checkpoint.
+    """
+    
+    test_content = StringIO.StringIO()
+    mocking.support_with(test_content)
+    mocking.mock(open, mocking.return_value(test_content))
+    
+    for test_line in ("/dir/file 123 1:2", "/dir/file 123 1:2:a", "/dir/file 1:2:3"):
+      test_content.truncate(0)
+      test_content.write(test_line)
+      test_content.seek(0)
+      self.assertRaises(TypeError, stem.descriptor.reader.load_processed_files, "")
+  
+  def test_load_processed_files_digests(self):
+    """
+    Loads a listing with the digests of descriptors we've read.
+    """
+    
+    test_lines = (
+      "/dir/file 12345",
+      "digest 2e3f3b0e2ef0a0cf6b2a4c1f9f6ebb2d",
+      "digest 9A0A3B1C2D3E4F5061728394A5B6C7D8",
+    )
+    
+    test_content = StringIO.StringIO("\n".join(test_lines))
+    mocking.support_with(test_content)
+    mocking.mock(open, mocking.return_value(test_content))
+    
+    expected_digests = ["2e3f3b0e2ef0a0cf6b2a4c1f9f6ebb2d", "9A0A3B1C2D3E4F5061728394A5B6C7D8"]
+    self.assertEquals(({"/dir/file": 12345}, expected_digests), stem.descriptor.reader.load_processed_files("", include_digests = True))
+    
+    for test_line in ("digest ", "digest 2e3f3b0e", "digest 2e3f3b0e2ef0a0cf6b2a4c1f9f6ebb2g"):
+      test_content.truncate(0)
+      test_content.write(test_line)
+      test_content.seek(0)
+      self.assertRaises(TypeError, stem.descriptor.reader.load_processed_files, "", include_digests = True)
+  
+  def test_duplicate_filter(self):
+    """
+    Checks that the DuplicateFilter recognizes content it has seen, forgetting
+    the least recently seen once it's full.
+    """
+    
+    duplicate_filter = stem.descriptor.reader.DuplicateFilter(2)
+    
+    self.assertTrue(duplicate_filter.is_new("foo"))
+    self.assertTrue(duplicate_filter.is_new("bar"))
+    self.assertFalse(duplicate_filter.is_new("foo"))
+    self.assertEquals(2, len(duplicate_filter))
+    
+    # 'bar' is now the least recently seen
+    
+    self.assertTrue(duplicate_filter.is_new("baz"))
+    self.assertTrue(duplicate_filter.is_new("bar"))
+    self.assertFalse(duplicate_filter.is_new("baz"))
+    
+    restored_filter = stem.descriptor.reader.DuplicateFilter(2, duplicate_filter.get_digests())
+    self.assertEquals(duplicate_filter.get_digests(), restored_filter.get_digests())
+    self.assertFalse(restored_filter.is_new("bar"))
+    self.assertTrue(restored_filter.is_new("foo"))
+    
+    self.assertRaises(TypeError, stem.descriptor.reader.DuplicateFilter, 2, ["not hex"])
+    
+    # content can be checked without remembering it
+    
+    self.assertFalse(restored_filter.is_seen("qux"))
+    self.assertFalse(restored_filter.is_seen("qux"))
+    restored_filter.add("qux")
+    self.assertTrue(restored_filter.is_seen("qux"))
+  
+  def test_descriptor_filter(self):
+    """
+    Checks raw descriptor content against a DescriptorFilter.
+    """
+    
+    relay_content = "\n".join((
+      "router caerSidi 71.35.133.197 9001 0 0",
+      "published 2012-03-01 17:15:27",
+      "opt fingerprint A756 9A83 B570 6AB1 B1A9 CB52 EFF7 D2D3 2E45 53EB",
+    ))
+    
+    extrainfo_content = "\n".join((
+      "extra-info NINJA B2289C3EAB83ECD6EB916A2F481A02E6B76A0A48",
+      "published 2012-05-05 17:03:50",
+    ))
+    
+    test_filters = (
+      ({}, True, True),
+      ({"nicknames": ["caerSidi"]}, True, False),
+      ({"fingerprints": ["a7569a83b5706ab1b1a9cb52eff7d2d32e4553eb"]}, True, False),
+      ({"fingerprints": ["B2289C3EAB83ECD6EB916A2F481A02E6B76A0A48"]}, False, True),
+      ({"published_after": datetime.datetime(2012, 3, 1, 17, 15, 27)}, True, True),
+      ({"published_after": datetime.datetime(2012, 4, 1)}, False, True),
+      ({"published_before": datetime.datetime(2012, 4, 1)}, True, False),
+      ({"descriptor_types": [stem.descriptor.server_descriptor.RelayDescriptor]}, True, False),
+      ({"descriptor_types": [stem.descriptor.extrainfo_descriptor.ExtraInfoDescriptor]}, False, True),
+      ({"nicknames": ["caerSidi"], "published_after": datetime.datetime(2012, 4, 1)}, False, False),
+    )
+    
+    for filter_args, is_relay_match, is_extrainfo_match in test_filters:
+      descriptor_filter = stem.descriptor.reader.DescriptorFilter(**filter_args)
+      self.assertEquals(is_relay_match, descriptor_filter.is_content_match(relay_content))
+      self.assertEquals(is_extrainfo_match, descriptor_filter.is_content_match(extrainfo_content))
+    
+    # descriptors lacking the lines that we need never match
+    
+    descriptor_filter = stem.descriptor.reader.DescriptorFilter(fingerprints = ["A7569A83B5706AB1B1A9CB52EFF7D2D32E4553EB"], published_after = datetime.datetime(2012, 1, 1))
+    self.assertFalse(descriptor_filter.is_content_match("router caerSidi 71.35.133.197 9001 0 0"))
+    self.assertFalse(descriptor_filter.is_content_match(""))
+    
+    self.assertRaises(ValueError, stem.descriptor.reader.DescriptorFilter, ["not a fingerprint"])
 
@@ -7,6 +7,7 @@ import StringIO
 import unittest
 
 import stem.descriptor.server_descriptor
+from stem.descriptor import ValidationLevel
 from stem.descriptor.server_descriptor import RelayDescriptor, BridgeDescriptor
 
 CRYPTO_BLOB = """
@@ -245,7 +246,7 @@ class TestServerDescriptor(unittest.TestCase):
       
       self.assertEquals(expected_end, attr[0])
       self.assertEquals(900, attr[1])
-      self.assertEquals(expected_values, attr[2])
+      self.assertEquals(expected_values, list(attr[2]))
   
   def test_read_history_empty(self):
     """
@@ -257,7 +258,7 @@ class TestServerDescriptor(unittest.TestCase):
     desc = RelayDescriptor(desc_text)
     self.assertEquals(datetime.datetime(2005, 12, 17, 1, 23, 11), desc.read_history_end)
     self.assertEquals(900, desc.read_history_interval)
-    self.assertEquals([], desc.read_history_values)
+    self.assertEquals([], list(desc.read_history_values))
   
   def test_annotations(self):
     """
@@ -309,6 +310,30 @@ class TestServerDescriptor(unittest.TestCase):
         self.assertEquals(None, desc.socks_port)
         self.assertEquals(None, desc.dir_port)
   
+  def test_validation_levels(self):
+    """
+    Constructs descriptors with malformed fields and structure, checking which
+    are caught by each validation level.
+    """
+    
+    desc_text = _make_descriptor({"router": "caerSidi 71.35.133.197 9001 0 0", "uptime": "-"})
+    self.assertRaises(ValueError, RelayDescriptor, desc_text, ValidationLevel.FULL)
+    
+    for validate in (ValidationLevel.STRUCTURE, ValidationLevel.NONE):
+      desc = RelayDescriptor(desc_text, validate)
+      self.assertEquals("caerSidi", desc.nickname)
+      self.assertEquals(None, desc.uptime)
+    
+    desc_text = _make_descriptor(exclude = ["router-signature"])
+    
+    for validate in (ValidationLevel.FULL, ValidationLevel.STRUCTURE):
+      self.assertRaises(ValueError, RelayDescriptor, desc_text, validate)
+    
+    desc = RelayDescriptor(desc_text, ValidationLevel.NONE)
+    self.assertEquals(None, desc.signature)
+    
+    self.assertRaises(ValueError, RelayDescriptor, desc_text, "PARTIAL")
+  
   def test_fingerprint_valid(self):
     """
     Checks that a fingerprint matching the hash of our signing key will validate.
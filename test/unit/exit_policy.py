@@ -0,0 +1,242 @@
+"""
+Unit tests for the stem.exit_policy module.
+"""
+
+import datetime
+import unittest
+import stem.exit_policy
+
+from stem.exit_policy import ExitPolicy, ExitPolicyRule, ExitPolicyIndex
+
+class _Descriptor:
+  """
+  Minimal stand-in for a server descriptor.
+  """
+  
+  def __init__(self, fingerprint, policy, published = None):
+    self.fingerprint = fingerprint
+    self.exit_policy = policy
+    self.published = published
+
+class TestExitPolicy(unittest.TestCase):
+  def test_rule_parsing(self):
+    """
+    Parses a variety of valid exit policy rules.
+    """
+    
+    rule = ExitPolicyRule("accept *:*")
+    self.assertTrue(rule.is_accept)
+    self.assertEquals(None, rule.address)
+    self.assertEquals(None, rule.mask)
+    self.assertEquals(None, rule.masked_bits)
+    self.assertEquals((1, 65535), (rule.min_port, rule.max_port))
+    self.assertTrue(rule.is_address_wildcard())
+    self.assertTrue(rule.is_port_wildcard())
+    
+    rule = ExitPolicyRule("reject 192.168.0.0/16:80-443")
+    self.assertFalse(rule.is_accept)
+    self.assertEquals("192.168.0.0", rule.address)
+    self.assertEquals("255.255.0.0", rule.mask)
+    self.assertEquals(16, rule.masked_bits)
+    self.assertEquals((80, 443), (rule.min_port, rule.max_port))
+    self.assertFalse(rule.is_address_wildcard())
+    self.assertFalse(rule.is_port_wildcard())
+    self.assertEquals("reject 192.168.0.0/16:80-443", str(rule))
+    
+    rule = ExitPolicyRule("accept 10.0.0.1:25")
+    self.assertEquals("255.255.255.255", rule.mask)
+    self.assertEquals(32, rule.masked_bits)
+    self.assertEquals((25, 25), (rule.min_port, rule.max_port))
+    
+    rule = ExitPolicyRule("accept 10.0.0.0/255.255.255.0:*")
+    self.assertEquals(24, rule.masked_bits)
+    
+    rule = ExitPolicyRule("accept 10.0.0.0/255.0.255.0:*")
+    self.assertEquals(None, rule.masked_bits)
+  
+  def test_rule_parsing_invalid(self):
+    """
+    Checks that malformed exit policy rules are rejected.
+    """
+    
+    invalid_rules = (
+      "",
+      "permit *:*",
+      "accept *",
+      "accept 1.2.3:80",
+      "accept 1.2.3.4/33:80",
+      "accept 1.2.3.4/255.255.0.256:80",
+      "accept *:65536",
+      "accept *:443-80",
+      "accept *:80-",
+      "accept *:http",
+    )
+    
+    for rule in invalid_rules:
+      self.assertRaises(ValueError, ExitPolicyRule, rule)
+  
+  def test_rule_is_match(self):
+    """
+    Checks if rules match various destinations.
+    """
+    
+    rule = ExitPolicyRule("reject 192.168.0.0/16:80-443")
+    self.assertTrue(rule.is_match("192.168.12.4", 80))
+    self.assertTrue(rule.is_match("192.168.255.255", 443))
+    self.assertFalse(rule.is_match("192.169.0.1", 80))
+    self.assertFalse(rule.is_match("192.168.12.4", 444))
+    self.assertRaises(ValueError, rule.is_match, "192.168.12", 80)
+  
+  def test_can_exit_to(self):
+    """
+    Checks destinations against a policy where the rules overlap.
+    """
+    
+    policy = ExitPolicy(
+      "reject 10.0.0.0/8:*",
+      "accept 10.1.2.3:22",
+      "accept 192.168.0.0/24:22",
+      "accept *:80-443",
+      "reject *:25",
+      "accept 1.2.3.4:*",
+      "reject *:*",
+    )
+    
+    # first matching rule wins
+    self.assertFalse(policy.can_exit_to("10.1.2.3", 22))
+    self.assertFalse(policy.can_exit_to("10.1.2.3", 80))
+    
+    self.assertTrue(policy.can_exit_to("192.168.0.12", 22))
+    self.assertFalse(policy.can_exit_to("192.168.1.12", 22))
+    self.assertTrue(policy.can_exit_to("75.119.206.243", 80))
+    self.assertTrue(policy.can_exit_to("75.119.206.243", 443))
+    self.assertFalse(policy.can_exit_to("75.119.206.243", 444))
+    self.assertFalse(policy.can_exit_to("1.2.3.4", 25))
+    self.assertTrue(policy.can_exit_to("1.2.3.4", 6667))
+    
+    # addresses can be provided as integers
+    self.assertTrue(policy.can_exit_to(0x4B77CEF3, 80))
+    
+    # matches the result of checking each rule in order
+    for address in ("10.1.2.3", "192.168.0.12", "1.2.3.4", "75.119.206.243"):
+      for port in (1, 22, 25, 79, 80, 443, 444, 65535):
+        expected = True
+        
+        for rule in policy:
+          if rule.is_match(address, port):
+            expected = rule.is_accept
+            break
+        
+        self.assertEquals(expected, policy.can_exit_to(address, port))
+    
+    self.assertRaises(ValueError, policy.can_exit_to, "1.2.3", 80)
+    self.assertRaises(ValueError, policy.can_exit_to, "1.2.3.4", 0)
+    self.assertRaises(ValueError, policy.can_exit_to, "1.2.3.4", 65536)
+    
+    # without a matching rule exiting is allowed
+    self.assertTrue(ExitPolicy("reject *:25").can_exit_to("1.2.3.4", 80))
+    self.assertTrue(ExitPolicy().can_exit_to("1.2.3.4", 80))
+  
+  def test_is_exiting_allowed(self):
+    """
+    Checks if policies allow exiting at all.
+    """
+    
+    self.assertFalse(ExitPolicy("reject *:*").is_exiting_allowed())
+    self.assertFalse(ExitPolicy("reject *:1-65535", "reject *:0").is_exiting_allowed())
+    self.assertTrue(ExitPolicy("accept 1.2.3.4:80", "reject *:*").is_exiting_allowed())
+    self.assertTrue(ExitPolicy("reject *:80").is_exiting_allowed())
+  
+  def test_summary(self):
+    """
+    Checks the port listings and summaries of policies.
+    """
+    
+    policy = ExitPolicy("accept *:80", "accept *:443", "reject *:*")
+    self.assertEquals([(80, 80), (443, 443)], policy.get_accepted_ports())
+    self.assertEquals([(1, 79), (81, 442), (444, 65535)], policy.get_rejected_ports())
+    self.assertEquals("accept 80,443", policy.summary())
+    
+    policy = ExitPolicy("reject *:25", "reject *:119", "accept *:*")
+    self.assertEquals("reject 25,119", policy.summary())
+    
+    # rules for specific addresses aren't included
+    policy = ExitPolicy("reject 1.2.3.4:80", "accept 1.2.3.4:443", "accept *:80-81", "reject *:*")
+    self.assertEquals("accept 80-81", policy.summary())
+    
+    self.assertEquals("reject 1-65535", ExitPolicy("reject *:*").summary())
+    self.assertEquals("accept 1-65535", ExitPolicy("accept *:*").summary())
+  
+  def test_str_and_equality(self):
+    """
+    Checks the string representation and comparison of policies.
+    """
+    
+    policy = ExitPolicy("accept *:80", ExitPolicyRule("reject *:*"))
+    self.assertEquals("accept *:80, reject *:*", str(policy))
+    self.assertEquals(2, len(policy))
+    self.assertEquals(ExitPolicy("accept *:80", "reject *:*"), policy)
+    self.assertNotEquals(ExitPolicy("reject *:*"), policy)
+  
+  def test_index(self):
+    """
+    Checks the relays that an ExitPolicyIndex provides against each of their
+    policies.
+    """
+    
+    policies = {
+      "A" * 40: ExitPolicy("accept *:80", "accept *:443", "reject *:*"),
+      "B" * 40: ExitPolicy("reject 10.0.0.0/8:*", "reject 1.2.3.4:*", "accept *:*"),
+      "C" * 40: ExitPolicy("reject *:*"),
+      "D" * 40: ExitPolicy("accept 1.2.3.0/24:22", "reject *:1-1024", "accept *:*"),
+      "E" * 40: ExitPolicy("accept *:80", "accept *:443", "reject *:*"),
+    }
+    
+    index = ExitPolicyIndex()
+    index.update([_Descriptor(fingerprint, policy) for fingerprint, policy in policies.items()])
+    self.assertEquals(5, len(index))
+    
+    destinations = []
+    
+    for address in ("1.2.3.4", "1.2.3.5", "10.1.1.1", "75.119.206.243"):
+      for port in (1, 22, 80, 443, 1024, 1025, 65535):
+        destinations.append((address, port))
+    
+    results = index.get_exits_batch(destinations)
+    
+    for address, port in destinations:
+      expected = set([fp for fp, policy in policies.items() if policy.can_exit_to(address, port)])
+      self.assertEquals(expected, index.get_exits(address, port))
+      self.assertEquals(expected, results[(address, port)])
+    
+    self.assertEquals(set(["A" * 40, "B" * 40, "E" * 40]), index.get_exits("75.119.206.243", 80))
+    self.assertRaises(ValueError, index.get_exits, "1.2.3", 80)
+  
+  def test_index_updates(self):
+    """
+    Adds, replaces, and removes relays from an ExitPolicyIndex.
+    """
+    
+    index = ExitPolicyIndex()
+    published = datetime.datetime(2012, 3, 1, 17, 15, 27)
+    later = published + datetime.timedelta(hours = 1)
+    
+    self.assertTrue(index.add(_Descriptor("A" * 40, ExitPolicy("accept *:80", "reject *:*"), published)))
+    self.assertEquals(set(["A" * 40]), index.get_exits("1.2.3.4", 80))
+    
+    # newer descriptors replace older ones, but not the other way around
+    
+    self.assertTrue(index.add(_Descriptor("A" * 40, ExitPolicy("reject *:*"), later)))
+    self.assertFalse(index.add(_Descriptor("A" * 40, ExitPolicy("accept *:*"), published)))
+    self.assertEquals(set(), index.get_exits("1.2.3.4", 80))
+    
+    index.add(_Descriptor("B" * 40, ExitPolicy("accept *:*")))
+    self.assertEquals(set(["B" * 40]), index.get_exits("1.2.3.4", 80))
+    
+    self.assertTrue(index.remove("B" * 40))
+    self.assertFalse(index.remove("B" * 40))
+    self.assertFalse("B" * 40 in index)
+    self.assertEquals(set(), index.get_exits("1.2.3.4", 80))
+    
+    self.assertRaises(ValueError, index.add, _Descriptor(None, ExitPolicy("accept *:*")))
+
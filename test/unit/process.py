@@ -0,0 +1,264 @@
+"""
+Unit tests for the stem.process.TorProcessPool class.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import stem.process
+import stem.socket
+import test.mocking as mocking
+
+class _FakeProcess:
+  def __init__(self):
+    self.returncode = None
+  
+  def poll(self):
+    return self.returncode
+  
+  def kill(self):
+    self.returncode = -9
+  
+  def wait(self):
+    return self.returncode
+
+class _FakeController:
+  def __init__(self, control_port):
+    self.control_port = control_port
+    self.is_closed = False
+  
+  def close(self):
+    self.is_closed = True
+
+# Stands in for tor, bootstrapping right away unless its torrc has a 'slow'
+# nickname, or never if there's a '.stall' file next to it. Each launch is
+# noted with its pid, torrc, and data directory.
+
+FAKE_TOR = """#!/bin/sh
+echo "$$ $2 $(grep DataDirectory "$2" | cut -d ' ' -f 2)" >> "$0.launches"
+grep -q "Nickname slow" "$2" && sleep 0.5
+[ -e "$0.stall" ] && exec sleep 10
+echo "[notice] Bootstrapped 100%: Done."
+exec sleep 10
+"""
+
+LAUNCH_TOR_MANY = stem.process._launch_tor_many
+
+def _launch_tor_many(configs, *args):
+  for config in configs:
+    yield config, _FakeProcess()
+
+def _write_fake_tor(test_dir):
+  """
+  Writes our FAKE_TOR script to the given directory.
+  
+  :returns: path of the script
+  """
+  
+  tor_cmd = os.path.join(test_dir, "tor")
+  
+  with open(tor_cmd, "w") as tor_file:
+    tor_file.write(FAKE_TOR)
+  
+  os.chmod(tor_cmd, 0755)
+  return tor_cmd
+
+class TestProcess(unittest.TestCase):
+  def setUp(self):
+    mocking.mock(stem.process._launch_tor_many, _launch_tor_many)
+    mocking.mock(stem.process._get_controller, _FakeController)
+  
+  def tearDown(self):
+    mocking.revert_mocking()
+  
+  def test_launch_tor_many_slow_caller(self):
+    """
+    Processes that bootstrap while our caller is busy aren't counted as having
+    timed out.
+    """
+    
+    test_dir = tempfile.mkdtemp()
+    tor_cmd = _write_fake_tor(test_dir)
+    tor_processes = []
+    
+    try:
+      configs = [{"Nickname": "fast"}, {"Nickname": "slow"}]
+      
+      for config, tor_process in LAUNCH_TOR_MANY(configs, tor_cmd, 100, None, 1):
+        tor_processes.append(tor_process)
+        if config["Nickname"] == "fast": time.sleep(1.5)
+      
+      self.assertEquals(2, len(tor_processes))
+    finally:
+      for tor_process in tor_processes:
+        tor_process.kill()
+        tor_process.wait()
+      
+      shutil.rmtree(test_dir)
+  
+  def test_tor_process_pool(self):
+    """
+    Acquires and releases processes from a pool.
+    """
+    
+    with stem.process.TorProcessPool(2, {"Log": "notice stdout"}, base_port = 2777) as pool:
+      first_instance = pool.acquire()
+      second_instance = pool.acquire()
+      
+      self.assertEquals(2777, first_instance.control_port)
+      self.assertEquals(2778, first_instance.socks_port)
+      self.assertEquals(2779, second_instance.control_port)
+      self.assertEquals(2780, second_instance.socks_port)
+      
+      self.assertEquals("notice stdout", first_instance.config["Log"])
+      self.assertEquals("1", first_instance.config["CookieAuthentication"])
+      self.assertEquals(2777, first_instance.controller.control_port)
+      self.assertTrue(os.path.isdir(first_instance.config["DataDirectory"]))
+      
+      self.assertRaises(OSError, pool.acquire, 0.01)
+      
+      # reused processes are provided with a new controller
+      
+      controller = first_instance.controller
+      pool.release(first_instance)
+      self.assertTrue(controller.is_closed)
+      self.assertEquals(None, first_instance.controller)
+      self.assertEquals(first_instance, pool.acquire())
+      self.assertNotEqual(controller, first_instance.controller)
+    
+    self.assertFalse(first_instance.is_alive())
+    self.assertFalse(second_instance.is_alive())
+    self.assertFalse(os.path.exists(first_instance.config["DataDirectory"]))
+    self.assertRaises(OSError, pool.acquire)
+  
+  def test_tor_process_pool_free_ports(self):
+    """
+    Picks free ports for the pool when we aren't given a base_port.
+    """
+    
+    with stem.process.TorProcessPool(2) as pool:
+      first_instance = pool.acquire()
+      second_instance = pool.acquire()
+      
+      ports = [first_instance.control_port, first_instance.socks_port, second_instance.control_port, second_instance.socks_port]
+      self.assertEquals(4, len(set(ports)))
+      self.assertEquals(str(first_instance.control_port), first_instance.config["ControlPort"])
+  
+  def test_tor_process_pool_replacement(self):
+    """
+    Replaces processes that are released without reuse, or have exited.
+    """
+    
+    with stem.process.TorProcessPool(1) as pool:
+      instance = pool.acquire()
+      pool.release(instance, False)
+      
+      self.assertFalse(instance.is_alive())
+      self.assertFalse(os.path.exists(instance.config["DataDirectory"]))
+      
+      replacement = pool.acquire(5)
+      self.assertNotEqual(instance, replacement)
+      self.assertEquals(instance.control_port, replacement.control_port)
+      
+      # processes that have exited are replaced when released
+      
+      replacement.tor_process.kill()
+      pool.release(replacement)
+      self.assertNotEqual(replacement, pool.acquire(5))
+  
+  def test_tor_process_pool_unable_to_connect(self):
+    """
+    Replaces processes that we can't connect to.
+    """
+    
+    connection_attempts = []
+    
+    def _get_controller(control_port):
+      connection_attempts.append(control_port)
+      
+      if len(connection_attempts) == 1:
+        raise stem.socket.SocketError("connection refused")
+      
+      return _FakeController(control_port)
+    
+    mocking.mock(stem.process._get_controller, _get_controller)
+    
+    with stem.process.TorProcessPool(1) as pool:
+      start_time = time.time()
+      instance = pool.acquire(5)
+      
+      self.assertEquals([instance.control_port] * 2, connection_attempts)
+      self.assertTrue(instance.is_alive())
+      self.assertTrue(time.time() - start_time < 5)
+  
+  def test_tor_process_pool_replacement_failure(self):
+    """
+    Gives up on replacing a process after several failed attempts, after which
+    the pool no longer waits for one to become available.
+    """
+    
+    launch_attempts = []
+    
+    def _launch_tor_many_once(configs, *args):
+      launch_attempts.append(configs)
+      
+      if len(launch_attempts) > 1:
+        raise OSError("unable to start tor")
+      
+      for config in configs:
+        yield config, _FakeProcess()
+    
+    mocking.mock(stem.process._launch_tor_many, _launch_tor_many_once)
+    
+    with stem.process.TorProcessPool(1) as pool:
+      pool.release(pool.acquire(), False)
+      
+      start_time = time.time()
+      self.assertRaises(OSError, pool.acquire, 5)
+      self.assertTrue(time.time() - start_time < 5)
+      self.assertEquals(1 + stem.process.REPLACEMENT_ATTEMPTS, len(launch_attempts))
+  
+  def test_tor_process_pool_close_during_replacement(self):
+    """
+    Closes a pool while it's starting a replacement, which should be stopped
+    rather than left running.
+    """
+    
+    mocking.mock(stem.process._launch_tor_many, LAUNCH_TOR_MANY)
+    
+    test_dir = tempfile.mkdtemp()
+    tor_cmd = _write_fake_tor(test_dir)
+    
+    try:
+      pool = stem.process.TorProcessPool(1, tor_cmd = tor_cmd)
+      pool.start()
+      
+      open(tor_cmd + ".stall", "w").close()
+      pool.release(pool.acquire(), False)
+      
+      # waits for the replacement to be launched
+      
+      for _ in xrange(100):
+        with open(tor_cmd + ".launches") as launches_file:
+          if len(launches_file.readlines()) == 2: break
+        
+        time.sleep(0.01)
+      
+      start_time = time.time()
+      pool.close()
+      self.assertTrue(time.time() - start_time < 5)
+      
+      with open(tor_cmd + ".launches") as launches_file:
+        launches = [line.split() for line in launches_file.readlines()]
+      
+      self.assertEquals(2, len(launches))
+      
+      for pid, torrc_path, data_directory in launches:
+        self.assertRaises(OSError, os.kill, int(pid), 0)
+        self.assertFalse(os.path.exists(torrc_path))
+        self.assertFalse(os.path.exists(data_directory))
+    finally:
+      shutil.rmtree(test_dir)
@@ -2,10 +2,21 @@
 Unit tests for the stem.util.connection functions.
 """
 
+import time
 import unittest
+
 import stem.util.connection
+import stem.util.proc
+import test.mocking as mocking
+
+CONN_1 = ("10.0.0.5", 22, "10.0.0.2", 50010)
+CONN_2 = ("10.0.0.5", 22, "10.0.0.3", 53924)
+CONN_3 = ("127.0.0.1", 53, "0.0.0.0", 0)
 
 class TestConnection(unittest.TestCase):
+  def tearDown(self):
+    mocking.revert_mocking()
+  
   def test_is_valid_ip_address(self):
     """
     Checks the is_valid_ip_address function.
@@ -76,4 +87,107 @@ class TestConnection(unittest.TestCase):
     
     self.assertTrue(stem.util.connection.is_valid_port(0, allow_zero = True))
     self.assertTrue(stem.util.connection.is_valid_port("0", allow_zero = True))
+  
+  def test_connection_tracker(self):
+    """
+    Checks that the ConnectionTracker provides the connections that are added
+    and removed between updates.
+    """
+    
+    resolved = {100: [CONN_1, CONN_2], 200: [CONN_3]}
+    mocking.mock(stem.util.proc.get_connections_by_pid, lambda pids: dict((pid, list(resolved[pid])) for pid in pids))
+    
+    changes = []
+    tracker = stem.util.connection.ConnectionTracker([100, 200])
+    tracker.register_listener(lambda added, removed: changes.append((sorted(added), sorted(removed))))
+    
+    self.assertEquals({}, tracker.get_connections())
+    tracker.update()
+    
+    expected_added = [(100, CONN_1), (100, CONN_2), (200, CONN_3)]
+    self.assertEquals([(expected_added, [])], changes)
+    self.assertEquals(set(expected_added), set(tracker.get_connections().keys()))
+    
+    first_seen = tracker.get_first_seen(100, CONN_1)
+    self.assertTrue(first_seen <= time.time())
+    self.assertEquals(None, tracker.get_first_seen(200, CONN_1))
+    
+    # unchanged connections don't notify our listeners
+    
+    tracker.update()
+    self.assertEquals(1, len(changes))
+    
+    resolved[100] = [CONN_1]
+    resolved[200] = [CONN_1]
+    
+    added, removed = tracker.update()
+    self.assertEquals([(200, CONN_1)], added)
+    self.assertEquals([(100, CONN_2), (200, CONN_3)], sorted(removed))
+    self.assertEquals((added, sorted(removed)), changes[-1])
+    self.assertEquals(first_seen, tracker.get_first_seen(100, CONN_1))
+  
+  def test_connection_tracker_unreadable_process(self):
+    """
+    Keeps the connections of a process that we briefly can't read, dropping
+    them once it has exited.
+    """
+    
+    resolved = {100: [CONN_1], 200: [CONN_2]}
+    mocking.mock(stem.util.proc.get_connections_by_pid, lambda pids: dict((pid, list(resolved[pid])) for pid in pids if pid in resolved))
+    
+    running_pids = [100, 200]
+    mocking.mock(stem.util.connection._is_running, lambda pid: pid in running_pids)
+    
+    tracker = stem.util.connection.ConnectionTracker([100, 200])
+    tracker.update()
+    first_seen = tracker.get_first_seen(200, CONN_2)
+    
+    # process 200 can't be read but is still running
+    
+    del resolved[200]
+    self.assertEquals(([], []), tracker.update())
+    self.assertEquals(first_seen, tracker.get_first_seen(200, CONN_2))
+    
+    resolved[200] = [CONN_2]
+    self.assertEquals(([], []), tracker.update())
+    self.assertEquals(first_seen, tracker.get_first_seen(200, CONN_2))
+    
+    # process 200 has exited
+    
+    del resolved[200]
+    running_pids.remove(200)
+    self.assertEquals(([], [(200, CONN_2)]), tracker.update())
+    self.assertEquals([(100, CONN_1)], tracker.get_connections().keys())
+  
+  def test_connection_tracker_listener_failure(self):
+    """
+    Checks that a listener which raises an exception doesn't keep others from
+    being notified.
+    """
+    
+    mocking.mock(stem.util.proc.get_connections_by_pid, mocking.return_value({100: [CONN_1]}))
+    
+    changes = []
+    tracker = stem.util.connection.ConnectionTracker([100])
+    tracker.register_listener(mocking.raise_exception(ValueError("listener failure")))
+    tracker.register_listener(lambda added, removed: changes.append((added, removed)))
+    
+    self.assertEquals(([(100, CONN_1)], []), tracker.update())
+    self.assertEquals([([(100, CONN_1)], [])], changes)
+  
+  def test_connection_tracker_thread(self):
+    """
+    Runs the ConnectionTracker in its background thread.
+    """
+    
+    mocking.mock(stem.util.proc.get_connections_by_pid, mocking.return_value({100: [CONN_1]}))
+    
+    with stem.util.connection.ConnectionTracker(100, rate = 0.01) as tracker:
+      self.assertRaises(ValueError, tracker.start)
+      
+      for _ in xrange(100):
+        if tracker.get_connections(): break
+        time.sleep(0.01)
+    
+    self.assertEquals([(100, CONN_1)], tracker.get_connections().keys())
 
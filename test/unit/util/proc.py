@@ -0,0 +1,342 @@
+"""
+Unit tests for the stem.util.proc functions. These mock the proc contents, so
+they don't depend on the system running the tests.
+"""
+
+import errno
+import socket
+import struct
+import unittest
+import StringIO
+
+import stem.util.proc as proc
+import test.mocking as mocking
+
+PROC_NET_HEADER = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode"
+
+PROC_NET_TCP = "\n".join((
+  PROC_NET_HEADER,
+  "   0: 0100007F:2329 00000000:0000 0A 00000000:00000000 00:00000000 00000000   106        0 1001 1 0000000000000000 100 0 0 10 0",
+  "   1: 0500000A:0016 0200000A:C35A 01 00000000:00000000 02:000A7214 00000000     0        0 1002 4 0000000000000000 20 4 27 10 -1",
+  "   2: 0500000A:0016 0300000A:D2A4 01 00000000:00000000 02:000A7214 00000000     0        0 2001 4 0000000000000000 20 4 27 10 -1",
+  "   3: 0500000A:1F90 0400000A:D2A5 01 00000000:00000000 02:000A7214 00000000     0        0 3001 4 0000000000000000 20 4 27 10 -1",
+))
+
+PROC_NET_UDP = "\n".join((
+  PROC_NET_HEADER,
+  "  10: 0100007F:0035 00000000:0000 07 00000000:00000000 00:00000000 00000000     0        0 1003 2 0000000000000000 0",
+))
+
+PROC_NET_TCP6 = "\n".join((
+  PROC_NET_HEADER,
+  "   0: 00000000000000000000000001000000:0016 00000000000000000000000000000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 1004 1 0000000000000000 100 0 0 10 0",
+  "   1: 0000000000000000FFFF00000500000A:0016 0000000000000000FFFF00000200000A:C35B 01 00000000:00000000 02:000A7214 00000000     0        0 1005 4 0000000000000000 20 4 27 10 -1",
+  "   2: B80D01200000000067452301EFCDAB89:0016 B80D0120000000000000000001000000:C35C 01 00000000:00000000 02:000A7214 00000000     0        0 2002 4 0000000000000000 20 4 27 10 -1",
+))
+
+def _mock_proc_contents():
+  """
+  Mocks open() to provide proc contents, starting with the /proc/net tables.
+  Builtins can only be mocked once per test, so this provides the mapping of
+  paths to contents which tests can then change.
+  """
+  
+  proc_contents = {
+    "/proc/net/tcp": PROC_NET_TCP,
+    "/proc/net/udp": PROC_NET_UDP,
+  }
+  
+  def _open(path, *args):
+    if not path in proc_contents:
+      raise IOError(errno.ENOENT, "No such file or directory: '%s'" % path)
+    
+    proc_file = StringIO.StringIO(proc_contents[path])
+    mocking.support_with(proc_file)
+    return proc_file
+  
+  mocking.mock(open, _open)
+  return proc_contents
+
+PROC_STAT = "100 (tor (relay)) S 1 100 100 0 -1 4202752 24869 0 0 0 %i %i 0 0 20 0 3 0 %i 104857600 2560 18446744073709551615 1 1 0 0 0 0 0 4096 16384 0 0 0 17 0 0 0 0 0 0"
+
+PROC_IO = "\n".join((
+  "rchar: 5000",
+  "wchar: 3000",
+  "syscr: 50",
+  "syscw: 30",
+  "read_bytes: 4096",
+  "write_bytes: 8192",
+  "cancelled_write_bytes: 0",
+))
+
+def _get_sock_diag_message(msg_type, payload):
+  """
+  Provides a netlink message with the given payload.
+  """
+  
+  header = proc.NLMSG_HEADER.pack(proc.NLMSG_HEADER.size + len(payload), msg_type, 0, 1, 0)
+  padding = "\x00" * (-len(payload) % 4)
+  return header + payload + padding
+
+def _get_inet_diag_msg(local, foreign, inode):
+  """
+  Provides a sock_diag message for an IPv4 connection.
+  """
+  
+  (local_addr, local_port), (foreign_addr, foreign_port) = local, foreign
+  
+  payload = proc.INET_DIAG_MSG.pack(
+    struct.pack("!H", local_port),
+    struct.pack("!H", foreign_port),
+    socket.inet_aton(local_addr) + "\x00" * 12,
+    socket.inet_aton(foreign_addr) + "\x00" * 12,
+    inode,
+  )
+  
+  return _get_sock_diag_message(proc.SOCK_DIAG_BY_FAMILY, payload)
+
+class TestProc(unittest.TestCase):
+  def setUp(self):
+    socket_inodes = {
+      100: set(["1001", "1002", "1003", "1004", "1005"]),
+      200: set(["2001", "2002"]),
+      300: set(),
+    }
+    
+    proc.PROC_NET_SNAPSHOT = None
+    
+    def _get_socket_inodes(pid, parameter):
+      if not pid in socket_inodes:
+        raise IOError("unable to read the file descriptors of process %s" % pid)
+      
+      return socket_inodes[pid]
+    
+    mocking.mock(proc._get_socket_inodes, _get_socket_inodes)
+    mocking.mock(proc._get_netlink_entries, mocking.raise_exception(IOError("netlink unavailable")))
+  
+  def tearDown(self):
+    mocking.revert_mocking()
+    proc.NETLINK_AVAILABLE = None
+  
+  def test_process_sampler(self):
+    """
+    Samples a process' statistics and its cpu usage between samples.
+    """
+    
+    proc_contents = _mock_proc_contents()
+    proc_contents["/proc/100/stat"] = PROC_STAT % (200, 100, 5000)
+    proc_contents["/proc/100/io"] = PROC_IO
+    
+    mocking.mock(proc._get_owner, mocking.return_value(106))
+    mocking.mock(proc.get_system_start_time, mocking.return_value(1000.0))
+    
+    sampler = proc.ProcessSampler([100, 200], include_io = True)
+    samples = sampler.sample()
+    
+    self.assertEquals([100], samples.keys())
+    
+    sample = samples[100]
+    self.assertEquals(100, sample.pid)
+    self.assertEquals("tor (relay)", sample.command)
+    self.assertEquals("S", sample.state)
+    self.assertEquals(106, sample.uid)
+    self.assertEquals(1000.0 + 5000.0 / proc.CLOCK_TICKS, sample.start_time)
+    self.assertEquals(200.0 / proc.CLOCK_TICKS, sample.cpu_utime)
+    self.assertEquals(100.0 / proc.CLOCK_TICKS, sample.cpu_stime)
+    self.assertEquals(None, sample.cpu_percent)
+    self.assertEquals(3, sample.threads)
+    self.assertEquals(2560 * proc.PAGE_SIZE, sample.resident_size)
+    self.assertEquals(104857600, sample.virtual_size)
+    self.assertEquals(4096, sample.read_bytes)
+    self.assertEquals(8192, sample.write_bytes)
+    
+    # pretends that the prior sample was ten seconds ago, during which the
+    # process used two seconds of cpu time
+    
+    sample.timestamp -= 10
+    proc_contents["/proc/100/stat"] = PROC_STAT % (200 + 2 * proc.CLOCK_TICKS, 100, 5000)
+    del proc_contents["/proc/100/io"]
+    
+    sample = sampler.sample()[100]
+    self.assertTrue(19.9 < sample.cpu_percent < 20.0)
+    self.assertEquals(None, sample.read_bytes)
+    
+    # a new process with the same pid doesn't have a cpu percentage
+    
+    sample.timestamp -= 10
+    proc_contents["/proc/100/stat"] = PROC_STAT % (0, 0, 6000)
+    self.assertEquals(None, sampler.sample()[100].cpu_percent)
+    
+    proc_contents["/proc/100/stat"] = "100 (tor) S 1 100"
+    self.assertEquals({}, sampler.sample())
+  
+  def test_get_pids_by_port(self):
+    """
+    Checks that we look for the sockets listening on a port.
+    """
+    
+    proc_contents = _mock_proc_contents()
+    proc_contents["/proc/net/tcp6"] = PROC_NET_TCP6
+    
+    fd_queries = []
+    mocking.mock(proc._get_pids_with_fd, lambda fd_links, parameter, pids: fd_queries.append(fd_links) or [100])
+    
+    self.assertEquals([100], proc.get_pids_by_port(9001))
+    self.assertEquals([100], proc.get_pids_by_port("22"))
+    self.assertEquals([], proc.get_pids_by_port(80))
+    self.assertEquals([set(["socket:[1001]"]), set(["socket:[1004]"])], fd_queries)
+  
+  def test_get_connections(self):
+    """
+    Checks that we only provide the established tcp connections and udp
+    connections of a process.
+    """
+    
+    _mock_proc_contents()
+    
+    expected_connections = [
+      ("10.0.0.5", 22, "10.0.0.2", 50010),
+      ("127.0.0.1", 53, "0.0.0.0", 0),
+    ]
+    
+    self.assertEquals(expected_connections, sorted(proc.get_connections(100)))
+    self.assertEquals([], proc.get_connections(300))
+    self.assertEquals([], proc.get_connections(0))
+    
+    # processes that don't exist or can't be read
+    
+    self.assertRaises(IOError, proc.get_connections, 400)
+  
+  def test_get_connections_by_pid(self):
+    """
+    Resolves the connections of several processes at once.
+    """
+    
+    _mock_proc_contents()
+    
+    expected_connections = {
+      0: [],
+      100: [("10.0.0.5", 22, "10.0.0.2", 50010), ("127.0.0.1", 53, "0.0.0.0", 0)],
+      200: [("10.0.0.5", 22, "10.0.0.3", 53924)],
+      300: [],
+    }
+    
+    connections = proc.get_connections_by_pid([0, 100, 200, 300])
+    self.assertEquals(expected_connections, dict((pid, sorted(conn)) for (pid, conn) in connections.items()))
+  
+  def test_get_connections_by_pid_failures(self):
+    """
+    Resolves the connections of several processes where some can't be read,
+    and where none of them have sockets.
+    """
+    
+    _mock_proc_contents()
+    
+    # processes we can't read (like those that have exited) are omitted
+    
+    connections = proc.get_connections_by_pid([100, 400])
+    self.assertEquals([100], connections.keys())
+    self.assertEquals(2, len(connections[100]))
+    
+    # /proc/net isn't read if there aren't any sockets
+    
+    mocking.mock(proc._get_proc_net_entries, mocking.raise_exception(IOError("shouldn't be read")))
+    self.assertEquals({300: []}, proc.get_connections_by_pid([300, 400]))
+  
+  def test_get_connections_ipv6(self):
+    """
+    Resolves connections from the tcp6 table, along with the IPv4 tables.
+    """
+    
+    proc_contents = _mock_proc_contents()
+    proc_contents["/proc/net/tcp6"] = PROC_NET_TCP6
+    
+    expected_connections = {
+      100: [("10.0.0.5", 22, "10.0.0.2", 50010), ("127.0.0.1", 53, "0.0.0.0", 0), ("::ffff:10.0.0.5", 22, "::ffff:10.0.0.2", 50011)],
+      200: [("10.0.0.5", 22, "10.0.0.3", 53924), ("2001:db8::123:4567:89ab:cdef", 22, "2001:db8::1", 50012)],
+    }
+    
+    connections = proc.get_connections_by_pid([100, 200])
+    self.assertEquals(expected_connections, dict((pid, sorted(conn)) for (pid, conn) in connections.items()))
+  
+  def test_get_connections_cache(self):
+    """
+    Checks that the /proc/net contents are reused until they're older than
+    PROC_NET_CACHE_TTL.
+    """
+    
+    proc_contents = _mock_proc_contents()
+    self.assertEquals(2, len(proc.get_connections(100)))
+    
+    proc_contents["/proc/net/udp"] = PROC_NET_HEADER
+    self.assertEquals(2, len(proc.get_connections(100)))
+    
+    snapshot_time, entries = proc.PROC_NET_SNAPSHOT
+    proc.PROC_NET_SNAPSHOT = (snapshot_time - proc.PROC_NET_CACHE_TTL, entries)
+    self.assertEquals(1, len(proc.get_connections(100)))
+  
+  def test_get_connections_netlink(self):
+    """
+    Resolves connections from a sock_diag netlink response.
+    """
+    
+    response = "".join((
+      _get_inet_diag_msg(("10.0.0.5", 22), ("10.0.0.2", 50010), 1002),
+      _get_inet_diag_msg(("127.0.0.1", 53), ("0.0.0.0", 0), 1003),
+      _get_inet_diag_msg(("10.0.0.5", 22), ("10.0.0.3", 53924), 2001),
+      _get_inet_diag_msg(("10.0.0.5", 8080), ("10.0.0.4", 53925), 3001),
+    ))
+    
+    entries = {}
+    self.assertFalse(proc._read_sock_diag_response(response, socket.AF_INET, entries))
+    self.assertTrue(proc._read_sock_diag_response(_get_sock_diag_message(proc.NLMSG_DONE, "\x00" * 4), socket.AF_INET, entries))
+    
+    mocking.mock(proc._get_netlink_entries, mocking.return_value(entries))
+    
+    expected_connections = {
+      100: [("10.0.0.5", 22, "10.0.0.2", 50010), ("127.0.0.1", 53, "0.0.0.0", 0)],
+      200: [("10.0.0.5", 22, "10.0.0.3", 53924)],
+    }
+    
+    connections = proc.get_connections_by_pid([100, 200])
+    self.assertEquals(expected_connections, dict((pid, sorted(conn)) for (pid, conn) in connections.items()))
+    self.assertTrue(proc.NETLINK_AVAILABLE)
+  
+  def test_get_connections_netlink_fallback(self):
+    """
+    Reads the /proc/net contents if netlink provides an error, and doesn't try
+    netlink again afterward.
+    """
+    
+    error_response = _get_sock_diag_message(proc.NLMSG_ERROR, struct.pack("=i", -errno.EACCES))
+    self.assertRaises(IOError, proc._read_sock_diag_response, error_response, socket.AF_INET, {})
+    self.assertRaises(IOError, proc._read_sock_diag_response, error_response[:-4], socket.AF_INET, {})
+    
+    _mock_proc_contents()
+    self.assertEquals(2, len(proc.get_connections(100)))
+    self.assertEquals(False, proc.NETLINK_AVAILABLE)
+  
+  def test_get_connections_malformed(self):
+    """
+    Checks that we raise an IOError when the /proc/net contents are malformed
+    or missing.
+    """
+    
+    proc_contents = _mock_proc_contents()
+    
+    test_inputs = (
+      "   0: 0100007F:2329 00000000:0000 0A",
+      "   0: 0100007F 00000000:0000 01 00000000:00000000 00:00000000 00000000 0 0 1001",
+      "   0: 0100007G:2329 00000000:0000 01 00000000:00000000 00:00000000 00000000 0 0 1001",
+    )
+    
+    for test_input in test_inputs:
+      proc.PROC_NET_SNAPSHOT = None
+      proc_contents["/proc/net/tcp"] = PROC_NET_HEADER + "\n" + test_input
+      self.assertRaises(IOError, proc.get_connections, 100)
+    
+    proc.PROC_NET_SNAPSHOT = None
+    proc_contents["/proc/net/tcp"] = PROC_NET_TCP
+    del proc_contents["/proc/net/udp"]
+    self.assertRaises(IOError, proc.get_connections, 100)
+
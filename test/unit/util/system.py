@@ -6,6 +6,7 @@ system running the tests.
 """
 
 import os
+import time
 import platform
 import functools
 import unittest
@@ -92,6 +93,7 @@ class TestSystem(unittest.TestCase):
     mocking.mock(stem.util.proc.is_available, mocking.return_false())
     mocking.mock(system.is_available, mocking.return_true())
     mocking.mock(system.call, mocking.return_none())
+    system.PID_CACHE.clear()
   
   def tearDown(self):
     mocking.revert_mocking()
@@ -187,6 +189,67 @@ class TestSystem(unittest.TestCase):
       expected_response = 1111 if test_input == "success" else None
       self.assertEquals(expected_response, system.get_pid_by_name(test_input))
   
+  def test_get_pid_by_name_proc(self):
+    """
+    Tests the get_pid_by_name function with proc results, which aren't cached
+    so additional processes with the name are noticed.
+    """
+    
+    pids = {"tor": [1111], "multiple_results": [123, 456]}
+    
+    mocking.mock(stem.util.proc.is_available, mocking.return_true())
+    mocking.mock(stem.util.proc.get_pids_by_name, lambda name: pids.get(name, []))
+    mocking.mock(stem.util.proc.get_stats, mocking.return_value(("1340000000.0",)))
+    
+    self.assertEquals(1111, system.get_pid_by_name("tor"))
+    self.assertEquals(None, system.get_pid_by_name("multiple_results"))
+    self.assertEquals(None, system.get_pid_by_name("no_results"))
+    
+    pids["tor"] = [1111, 2222]
+    self.assertEquals(None, system.get_pid_by_name("tor"))
+    self.assertEquals({}, system.PID_CACHE)
+  
+  def test_get_pid_by_port_proc(self):
+    """
+    Tests the get_pid_by_port function with proc results, and that results are
+    cached until the process stops listening or the pid's reused.
+    """
+    
+    start_times = {1111: "1340000000.0", 2222: "1340000200.0"}
+    listeners = {9051: [1111]}
+    queries = []
+    
+    def _get_pids_by_port(port, pids = None):
+      queries.append(pids)
+      return [pid for pid in listeners.get(port, []) if pids is None or pid in pids]
+    
+    mocking.mock(stem.util.proc.is_available, mocking.return_true())
+    mocking.mock(stem.util.proc.get_pids_by_port, _get_pids_by_port)
+    mocking.mock(stem.util.proc.get_stats, lambda pid, *stat_types: (start_times[pid],))
+    
+    self.assertEquals(1111, system.get_pid_by_port(9051))
+    self.assertEquals(None, system.get_pid_by_port(80))
+    
+    # cached results are only checked against that process
+    
+    del queries[:]
+    self.assertEquals(1111, system.get_pid_by_port(9051))
+    self.assertEquals([[1111]], queries)
+    
+    # but not used once it stops listening
+    
+    listeners[9051] = [2222]
+    self.assertEquals(2222, system.get_pid_by_port(9051))
+    self.assertEquals((2222, "1340000200.0"), system.PID_CACHE[("port", 9051)])
+    
+    # or if the pid's been reused by another process
+    
+    start_times[2222] = "1340000300.0"
+    del queries[:]
+    self.assertEquals(2222, system.get_pid_by_port(9051))
+    self.assertEquals([None], queries)
+    self.assertEquals((2222, "1340000300.0"), system.PID_CACHE[("port", 9051)])
+  
   def test_get_pid_by_port_netstat(self):
     """
     Tests the get_pid_by_port function with a netstat response.
@@ -304,4 +367,48 @@ class TestSystem(unittest.TestCase):
     self.assertEquals("/tmp/foo", system.expand_path("./foo", "/tmp"))
     
     os.path.sep = original_path_sep
+  
+  def test_call_many(self):
+    """
+    Tests the call_many function, which should provide the first valid result
+    without waiting for slower commands.
+    """
+    
+    def _call(command):
+      if command == "slow": time.sleep(0.5)
+      return {"slow": ["1111"], "fast": ["2222"], "invalid": ["bad data"]}.get(command)
+    
+    mocking.mock(system.call, _call)
+    parser = lambda command, results: system._parse_single_pid(results)
+    
+    start_time = time.time()
+    self.assertEquals(2222, system.call_many(["slow", "invalid", "fast", "fails"], parser))
+    self.assertEquals(["2222"], system.call_many(["fast"]))
+    self.assertTrue(time.time() - start_time < 0.5)
+    
+    self.assertEquals(None, system.call_many(["invalid", "fails"], parser))
+    self.assertEquals(None, system.call_many(["slow"], parser, timeout = 0.05))
+    self.assertEquals(None, system.call_many([]))
+  
+  def test_call_many_cancelled(self):
+    """
+    Checks that call_many doesn't run commands that haven't started by the
+    time it's finished.
+    """
+    
+    issued_commands = []
+    mocking.mock(system.call, lambda command: issued_commands.append(command))
+    
+    # holding the lock keeps the threads from starting their commands until
+    # call_many() has timed out
+    
+    with system.RUNNING_CALLS_LOCK:
+      self.assertEquals(None, system.call_many(["first", "second"], timeout = 0.05))
+    
+    for _ in xrange(100):
+      if not system.CALL_CANCELLATIONS: break
+      time.sleep(0.01)
+    
+    self.assertEquals({}, system.CALL_CANCELLATIONS)
+    self.assertEquals([], issued_commands)
 